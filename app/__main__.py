@@ -0,0 +1,212 @@
+import argparse
+import json
+import os
+import random
+import shutil
+import tempfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import anyio
+import uvicorn
+
+from app.settings import settings
+from app.utilities.ledgers import backfill_ledger_ids
+from app.utilities.migrations import (
+    archive_transactions,
+    migrate_to_buckets,
+    migrate_to_documents,
+)
+
+TRANSACTION_COLLECTIONS = ["expenses", "bills"]
+
+
+async def migrate_storage(layout: str, collections: list[str]) -> None:
+    """
+    Convert transaction collections to another storage layout
+    """
+    for name in collections:
+        if layout == "bucket":
+            moved = await migrate_to_buckets(name)
+        else:
+            moved = await migrate_to_documents(name)
+
+        print(f"{name}: moved {moved} transactions to the {layout} layout")
+
+
+async def archive(collections: list[str]) -> None:
+    """
+    Move transactions older than the archive cutoff into cold storage
+    """
+    for name in collections:
+        moved = await archive_transactions(name)
+        print(f"{name}: archived {moved} transactions")
+
+
+async def backfill_ledgers() -> None:
+    """
+    Put documents from before ledgers into their owner's personal ledger
+    """
+    for name, updated in (await backfill_ledger_ids()).items():
+        print(f"{name}: updated {updated} documents")
+
+
+def serve(
+    host: str, port: int, workers: int, loop: str, http: str, keep_alive: int
+) -> None:
+    """
+    Run the API, with workers sharing cache invalidations over a local socket
+    directory
+    """
+    socket_dir = None
+    if workers > 1 and not settings.invalidation_socket_dir:
+        socket_dir = tempfile.mkdtemp(prefix="budget-app-")
+        # Read by the settings of each worker process.
+        os.environ["INVALIDATION_SOCKET_DIR"] = socket_dir
+
+    try:
+        uvicorn.run(
+            "app.main:app",
+            host=host,
+            port=port,
+            workers=workers,
+            loop=loop,
+            http=http,
+            timeout_keep_alive=keep_alive,
+            backlog=settings.serve_backlog,
+            # The app logs every request itself.
+            access_log=False,
+        )
+    finally:
+        if socket_dir:
+            shutil.rmtree(socket_dir, ignore_errors=True)
+
+
+def webhook_sink(host: str, port: int, fail_rate: float) -> None:
+    """
+    Receive budget alerts like a webhook would and print them, failing some
+    batches on purpose to see deliveries retried
+    """
+
+    class AlertHandler(BaseHTTPRequestHandler):
+        def do_POST(self) -> None:
+            body = self.rfile.read(int(self.headers.get("content-length", 0)))
+            if random.random() < fail_rate:
+                print(f"rejected a batch of {len(body)} bytes")
+                self.send_response(503)
+                self.end_headers()
+                return
+
+            alerts = json.loads(body)["alerts"]
+            for alert in alerts:
+                print(
+                    f"{alert['id']} {alert['user_id']} {alert['month']} "
+                    f"{alert['category']}: {alert['spent']:.2f} of "
+                    f"{alert['budget']:.2f} {alert['currency']} "
+                    f"({alert['threshold']:.0%})"
+                )
+            self.send_response(204)
+            self.end_headers()
+
+        def log_message(self, format: str, *args: object) -> None:
+            pass
+
+    with ThreadingHTTPServer((host, port), AlertHandler) as server:
+        print(f"Receiving alerts on http://{host}:{port}")
+        server.serve_forever()
+
+
+def main() -> None:
+    """
+    Management commands
+    """
+    parser = argparse.ArgumentParser(prog="python -m app")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    migrate = commands.add_parser(
+        "migrate-storage",
+        help="Convert expenses and bills between the document and bucket layouts.",
+    )
+    migrate.add_argument("layout", choices=["document", "bucket"])
+    migrate.add_argument(
+        "--collection",
+        dest="collections",
+        action="append",
+        choices=TRANSACTION_COLLECTIONS,
+        help="Collection to convert, defaults to all of them.",
+    )
+
+    archive_parser = commands.add_parser(
+        "archive",
+        help="Move transactions older than ARCHIVE_AFTER_DAYS into compressed "
+        "archive collections, e.g. daily from cron.",
+    )
+    archive_parser.add_argument(
+        "--collection",
+        dest="collections",
+        action="append",
+        choices=TRANSACTION_COLLECTIONS,
+        help="Collection to archive, defaults to all of them.",
+    )
+
+    commands.add_parser(
+        "backfill-ledgers",
+        help="Set the ledger of documents written before ledgers existed.",
+    )
+
+    serve_parser = commands.add_parser(
+        "serve",
+        help="Run the API, by default with one worker per CPU core.",
+    )
+    serve_parser.add_argument("--host", default=settings.serve_host)
+    serve_parser.add_argument("--port", type=int, default=settings.serve_port)
+    serve_parser.add_argument(
+        "--workers", type=int, default=settings.serve_workers or os.cpu_count() or 1
+    )
+    serve_parser.add_argument(
+        "--loop", choices=["auto", "asyncio", "uvloop"], default=settings.serve_loop
+    )
+    serve_parser.add_argument(
+        "--http", choices=["auto", "h11", "httptools"], default=settings.serve_http
+    )
+    serve_parser.add_argument(
+        "--keep-alive",
+        type=int,
+        default=settings.serve_keep_alive_seconds,
+        help="Seconds to keep idle connections open, longer than the idle "
+        "timeout of a load balancer in front.",
+    )
+
+    sink_parser = commands.add_parser(
+        "webhook-sink",
+        help="Receive budget alerts locally and print them, "
+        "for ALERT_WEBHOOK_URL=http://127.0.0.1:8001.",
+    )
+    sink_parser.add_argument("--host", default="127.0.0.1")
+    sink_parser.add_argument("--port", type=int, default=8001)
+    sink_parser.add_argument(
+        "--fail-rate",
+        type=float,
+        default=0.0,
+        help="Share of batches to answer with a 503.",
+    )
+
+    args = parser.parse_args()
+
+    if args.command == "migrate-storage":
+        anyio.run(
+            migrate_storage, args.layout, args.collections or TRANSACTION_COLLECTIONS
+        )
+    elif args.command == "archive":
+        if settings.archive_after_days is None:
+            parser.error("ARCHIVE_AFTER_DAYS is not set")
+        anyio.run(archive, args.collections or TRANSACTION_COLLECTIONS)
+    elif args.command == "backfill-ledgers":
+        anyio.run(backfill_ledgers)
+    elif args.command == "serve":
+        serve(args.host, args.port, args.workers, args.loop, args.http, args.keep_alive)
+    elif args.command == "webhook-sink":
+        webhook_sink(args.host, args.port, args.fail_rate)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,29 +1,70 @@
+import time
+from collections import OrderedDict
 from typing import Annotated
 
 from anyio.to_thread import run_sync
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 from firebase_admin import auth
 
+from app.settings import settings
+from app.utilities.capture import REQUEST_USER
+from app.utilities.ledgers import Access, ledger_access
+
 security = HTTPBearer()
 
+# Scope key of the user a batch sub-request runs as.
+BATCH_USER = "budget_app.batch_user"
+
+# Verified tokens and their user, until the token expires. Revocation is not
+# checked when verifying either, so this accepts exactly the same tokens.
+_verified: OrderedDict[str, tuple[float, str | None]] = OrderedDict()
+
 
 async def validate_access(
-    access_token: Annotated[HTTPAuthorizationCredentials, Depends(security)]
+    request: Request,
+    access_token: Annotated[HTTPAuthorizationCredentials, Depends(security)],
 ) -> str | None:
     """
     Validates access tokens.
 
-    Raises a 401 HTTPException if an invalid token is provided.
+    Raises a 401 HTTPException if an invalid token is provided. Sub-requests
+    of a batch run as the user the batch was validated for. The user is kept
+    in the request scope for traffic capture.
     """
+    if BATCH_USER in request.scope:
+        batch_user: str | None = request.scope[BATCH_USER]
+        return batch_user
+
+    token = access_token.credentials
+    cached = _verified.get(token)
+    if cached is not None and cached[0] > time.time():
+        _verified.move_to_end(token)
+        request.scope[REQUEST_USER] = cached[1]
+        return cached[1]
+
     try:
-        user_result = await run_sync(auth.verify_id_token, access_token.credentials)
+        user_result = await run_sync(auth.verify_id_token, token)
         if user_result:
             user_id: str | None = user_result.get("user_id")
 
+            _verified[token] = (user_result.get("exp", 0), user_id)
+            while len(_verified) > settings.token_cache_size:
+                _verified.popitem(last=False)
+
+            request.scope[REQUEST_USER] = user_id
             return user_id
 
     except Exception as e:
         print(e)
 
     raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Unauthorized")
+
+
+async def resolve_access(
+    user_id: Annotated[str | None, Depends(validate_access)],
+) -> Access:
+    """
+    Ledgers the user can read and write.
+    """
+    return await ledger_access(user_id)
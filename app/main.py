@@ -1,25 +1,91 @@
+import asyncio
+import contextlib
 import time
-from typing import Any, Callable, TypeVar
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable, TypeVar
 
+from anyio.to_thread import run_sync
 from fastapi import FastAPI, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 
 from app.routers.auth import auth
+from app.routers.batch import batch
 from app.routers.bills import bills
 from app.routers.budgets import budgets
 from app.routers.expenses import expenses
+from app.routers.jobs import jobs
+from app.routers.ledgers import ledgers
+from app.routers.metrics import metrics
+from app.routers.profile import profile
+from app.routers.reports import reports
+from app.routers.search import search
 from app.routers.wishlists import wishlists
 
+from .settings import settings
+from .utilities.alerts import alerts_enabled, run_dispatcher
+from .utilities.balances import run_snapshots
+from .utilities.batching import close_batchers
+from .utilities.capture import capture
+from .utilities.changes import drain_logged_writes
+from .utilities.compression import CompressionMiddleware
+from .utilities.deadlines import DeadlineMiddleware
+from .utilities.fx import load_fx_rates
+from .utilities.indexes import create_indexes
+from .utilities.invalidation import bus
+from .utilities.jobs import runner
+from .utilities.ledgers import ensure_ledger_ids
+from .utilities.limiter import ConcurrencyLimitMiddleware
 from .utilities.log import logger
+from .utilities.responses import ORJSONResponse
+from .utilities.schedule import run_scheduler
+from .utilities.sqlite import pool
+from .utilities.warmup import warm_up
 
 F = TypeVar("F", bound=Callable[..., Any])
 
 
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    """
+    Warm up connections, create indexes, put documents from before ledgers into
+    personal ledgers and load exchange rates before serving requests, run
+    background jobs, keep bill schedules extended, deliver budget alerts when a
+    webhook is set, snapshot balances when changes are logged, and drain queued
+    writes, flush captured traffic and close SQLite connections on shutdown
+    """
+    await warm_up()
+    await create_indexes()
+    await ensure_ledger_ids()
+    await run_sync(load_fx_rates)
+    bus.start(settings.invalidation_socket_dir)
+    await runner.start()
+    tasks = [asyncio.create_task(run_scheduler())]
+    if alerts_enabled():
+        tasks.append(asyncio.create_task(run_dispatcher()))
+    if settings.change_log:
+        tasks.append(asyncio.create_task(run_snapshots()))
+
+    yield
+
+    await runner.close()
+    for task in tasks:
+        task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
+    await drain_logged_writes()
+    await close_batchers()
+    await capture.close()
+    bus.close()
+    pool.close()
+
+
 app = FastAPI(
     title="Budget planner",
     description="We think ahead",
     version="1.0.0",
     docs_url="/",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse,
 )
 
 app.add_middleware(
@@ -32,16 +98,21 @@ app.add_middleware(
         "http://localhost:8000",
     ],
 )
+app.add_middleware(CompressionMiddleware, minimum_size=settings.compression_min_bytes)
+app.add_middleware(ConcurrencyLimitMiddleware)
+app.add_middleware(DeadlineMiddleware)
 
 
 @app.middleware("http")
 async def process_time_log_middleware(request: Request, call_next: F) -> Response:
     """
-    Add API process time in response headers and log calls
+    Add API process time in response headers, log calls and capture their
+    shapes when a capture file is set
     """
     start_time = time.time()
     response: Response = await call_next(request)
-    process_time = str(round(time.time() - start_time, 3))
+    elapsed = time.time() - start_time
+    process_time = str(round(elapsed, 3))
     response.headers["X-Process-Time"] = process_time
 
     logger.info(
@@ -51,12 +122,28 @@ async def process_time_log_middleware(request: Request, call_next: F) -> Respons
         response.status_code,
         process_time,
     )
+    capture.record(request, response, elapsed)
 
     return response
 
 
+@app.get("/health", include_in_schema=False)
+async def health() -> dict[str, str]:
+    """
+    Liveness check, answered even when the limiter sheds other requests
+    """
+    return {"status": "ok"}
+
+
 app.include_router(auth.router)
+app.include_router(batch.router)
 app.include_router(bills.router)
 app.include_router(budgets.router)
 app.include_router(expenses.router)
+app.include_router(jobs.router)
+app.include_router(ledgers.router)
+app.include_router(metrics.router)
+app.include_router(profile.router)
+app.include_router(reports.router)
+app.include_router(search.router)
 app.include_router(wishlists.router)
@@ -1,5 +1,179 @@
-from pydantic import BaseModel
+import json
+from datetime import datetime, timedelta, timezone
+from typing import Annotated, Any, Literal, Optional, Self
+
+from pydantic import BaseModel, Field, field_validator, model_validator
+
+# ISO 4217 code, e.g. USD.
+Currency = Annotated[str, Field(pattern=r"^[A-Z]{3}$")]
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
 
 
 class GenericException(BaseModel):
     detail: str
+
+
+def as_utc(value: datetime) -> datetime:
+    """
+    Treat naive datetimes, as stored by MongoDB, as UTC, and move aware ones
+    to UTC.
+    """
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+
+    return value.astimezone(timezone.utc)
+
+
+def epoch_micros(value: datetime) -> int:
+    """
+    Microseconds since the epoch, how SQLite stores dates.
+    """
+    return (as_utc(value) - EPOCH) // timedelta(microseconds=1)
+
+
+class CategoryFilters(BaseModel):
+    category: Optional[str] = None
+
+    def to_query(self, ledger_ids: list[str | None]) -> dict[str, Any]:
+        """
+        MongoDB filter for the documents of some ledgers.
+        """
+        query: dict[str, Any] = {"ledger_id": {"$in": ledger_ids}}
+        if self.category is not None:
+            query["category"] = self.category
+
+        return query
+
+    def to_sql(self, ledger_ids: list[str | None]) -> tuple[str, list[Any]]:
+        """
+        SQLite condition and parameters for the documents of some ledgers.
+        """
+        conditions = ["ledger_id IN (SELECT value FROM json_each(?))"]
+        params: list[Any] = [json.dumps(ledger_ids)]
+        if self.category is not None:
+            conditions.append("category = ?")
+            params.append(self.category)
+
+        return " AND ".join(conditions), params
+
+    def matches(self, doc: dict[str, Any]) -> bool:
+        """
+        Whether a document passes the filters.
+        """
+        return self.category is None or doc.get("category") == self.category
+
+
+class TransactionFilters(CategoryFilters):
+    start: Optional[datetime] = None
+    end: Optional[datetime] = None
+    min_total: Optional[float] = None
+    max_total: Optional[float] = None
+
+    @field_validator("start", "end")
+    @classmethod
+    def to_utc(cls, value: datetime | None) -> datetime | None:
+        """
+        Compare and query dates in UTC, whether they came with an offset or not.
+        """
+        return None if value is None else as_utc(value)
+
+    @model_validator(mode="after")
+    def check_ranges(self) -> Self:
+        if self.start and self.end and self.start > self.end:
+            raise ValueError("start must not be after end")
+        if (
+            self.min_total is not None
+            and self.max_total is not None
+            and self.min_total > self.max_total
+        ):
+            raise ValueError("min_total must not be greater than max_total")
+
+        return self
+
+    def to_query(self, ledger_ids: list[str | None]) -> dict[str, Any]:
+        """
+        MongoDB filter for the transactions of some ledgers, start inclusive and
+        end exclusive.
+        """
+        query = super().to_query(ledger_ids)
+
+        created_at: dict[str, Any] = {}
+        if self.start is not None:
+            created_at["$gte"] = self.start
+        if self.end is not None:
+            created_at["$lt"] = self.end
+        if created_at:
+            query["created_at"] = created_at
+
+        total: dict[str, Any] = {}
+        if self.min_total is not None:
+            total["$gte"] = self.min_total
+        if self.max_total is not None:
+            total["$lte"] = self.max_total
+        if total:
+            query["total"] = total
+
+        return query
+
+    def to_sql(self, ledger_ids: list[str | None]) -> tuple[str, list[Any]]:
+        """
+        SQLite condition and parameters for the transactions of some ledgers,
+        start inclusive and end exclusive.
+        """
+        condition, params = super().to_sql(ledger_ids)
+        conditions = [condition]
+        if self.start is not None:
+            conditions.append("created_at >= ?")
+            params.append(epoch_micros(self.start))
+        if self.end is not None:
+            conditions.append("created_at < ?")
+            params.append(epoch_micros(self.end))
+        if self.min_total is not None:
+            conditions.append("total >= ?")
+            params.append(self.min_total)
+        if self.max_total is not None:
+            conditions.append("total <= ?")
+            params.append(self.max_total)
+
+        return " AND ".join(conditions), params
+
+    def matches(self, doc: dict[str, Any]) -> bool:
+        """
+        Whether a transaction passes the filters.
+        """
+        if not super().matches(doc):
+            return False
+
+        created_at = as_utc(doc["created_at"])
+        if self.start is not None and created_at < as_utc(self.start):
+            return False
+        if self.end is not None and created_at >= as_utc(self.end):
+            return False
+
+        total = doc.get("total", 0)
+        if self.min_total is not None and total < self.min_total:
+            return False
+        if self.max_total is not None and total > self.max_total:
+            return False
+
+        return True
+
+
+class ImportOptions(BaseModel):
+    """
+    Which ledger statement rows go to and how they map onto expenses.
+
+    Columns only apply to CSV, OFX fields are fixed.
+    """
+
+    ledger_id: Optional[str] = None
+    date_column: str = "date"
+    amount_column: str = "amount"
+    place_column: str = "description"
+    category_column: Optional[str] = None
+    default_category: str = "uncategorized"
+    date_format: Optional[str] = None
+    decimal_separator: Literal[".", ","] = "."
+    currency: Optional[Currency] = None
+    debits_negative: bool = True
@@ -0,0 +1,117 @@
+import asyncio
+from typing import Annotated
+
+import orjson
+from fastapi import APIRouter, Depends, Request, Response, status
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+from starlette.exceptions import HTTPException
+from starlette.types import Message
+
+from app.auth import BATCH_USER, validate_access
+from app.models import GenericException
+from app.utilities.log import logger
+
+from .models import BatchQuery, BatchRequest, BatchResponse
+
+router = APIRouter(
+    prefix="/v1/batch",
+    tags=["batch"],
+    responses={
+        status.HTTP_401_UNAUTHORIZED: {
+            "description": "Unauthorized",
+            "model": GenericException,
+        }
+    },
+)
+
+security = HTTPBearer()
+
+# Headers of the batch request that do not apply to its sub-requests.
+DROPPED_HEADERS = {b"accept", b"accept-encoding", b"content-length", b"content-type"}
+
+
+async def run_query(
+    request: Request, user_id: str | None, query: BatchQuery
+) -> tuple[int, bytes]:
+    """
+    Status and JSON body of a GET of one path, routed in process.
+
+    The sub-request skips middleware and token verification, it runs as the
+    user the batch was authenticated as.
+    """
+    path, _, query_string = query.path.partition("?")
+    scope = dict(request.scope)
+    for key in ("route", "endpoint", "path_params"):
+        scope.pop(key, None)
+    scope |= {
+        "method": "GET",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": query_string.encode(),
+        "headers": [
+            (name, value)
+            for name, value in request.scope["headers"]
+            if name not in DROPPED_HEADERS
+        ]
+        + [(b"accept", b"application/json")],
+        BATCH_USER: user_id,
+    }
+
+    sent_request = False
+    response_status = status.HTTP_500_INTERNAL_SERVER_ERROR
+    body = bytearray()
+
+    async def receive() -> Message:
+        nonlocal sent_request
+        if not sent_request:
+            sent_request = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        return await request.receive()
+
+    async def send(message: Message) -> None:
+        nonlocal response_status
+        if message["type"] == "http.response.start":
+            response_status = message["status"]
+        elif message["type"] == "http.response.body":
+            body.extend(message.get("body", b""))
+
+    try:
+        await request.app.router(scope, receive, send)
+    except HTTPException as e:
+        # Raised by routing itself, for unknown paths and methods.
+        return e.status_code, orjson.dumps({"detail": e.detail})
+    except Exception:
+        logger.exception("Batch query %s failed", query.path)
+        return status.HTTP_500_INTERNAL_SERVER_ERROR, orjson.dumps(
+            {"detail": "Internal Server Error"}
+        )
+
+    return response_status, bytes(body) or b"null"
+
+
+@router.post("", response_model=BatchResponse)
+async def batch(
+    credentials: Annotated[HTTPAuthorizationCredentials, Depends(security)],
+    user_id: Annotated[None | str, Depends(validate_access)],
+    request: Request,
+    batch_request: BatchRequest,
+) -> Response:
+    """
+    Run several reads in one request.
+
+    Each query is a GET of an API path, with its query string. Queries run
+    concurrently, and each result has the status and body that path returns
+    on its own.
+    """
+    results = await asyncio.gather(
+        *(run_query(request, user_id, query) for query in batch_request.queries)
+    )
+
+    # Bodies are already JSON, splice them in instead of decoding them.
+    parts = [
+        b'{"id":%b,"status":%d,"body":%b}' % (orjson.dumps(query.id), code, body)
+        for query, (code, body) in zip(batch_request.queries, results)
+    ]
+    return Response(
+        b'{"results":[' + b",".join(parts) + b"]}", media_type="application/json"
+    )
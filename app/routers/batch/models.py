@@ -0,0 +1,26 @@
+from typing import Any
+
+from pydantic import BaseModel, Field
+
+from app.settings import settings
+
+
+class BatchQuery(BaseModel):
+    id: str
+    path: str = Field(pattern=r"^/v1/", examples=["/v1/expenses?category=food"])
+
+
+class BatchRequest(BaseModel):
+    queries: list[BatchQuery] = Field(
+        min_length=1, max_length=settings.batch_max_queries
+    )
+
+
+class BatchResult(BaseModel):
+    id: str
+    status: int
+    body: Any
+
+
+class BatchResponse(BaseModel):
+    results: list[BatchResult]
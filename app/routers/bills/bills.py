@@ -6,20 +6,45 @@ from bson import ObjectId
 from fastapi import (
     APIRouter,
     Depends,
+    Header,
     HTTPException,
+    Query,
     status,
 )
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 
-from app.auth import validate_access
-from app.models import GenericException
-from app.utilities.clients import db
+from app.auth import resolve_access, validate_access
+from app.models import GenericException, TransactionFilters
+from app.utilities.alerts import affects_spending, alerts_enabled, record_spending
+from app.utilities.cache import SingleFlight, invalidate_user
+from app.utilities.idempotency import idempotency_slot
+from app.utilities.ledgers import Access
+from app.utilities.money import with_money, with_money_update
+from app.utilities.responses import NegotiatedRoute
+from app.utilities.schedule import (
+    SCHEDULE_FIELDS,
+    reschedule_bill,
+    schedule_bill,
+    unschedule_bill,
+    upcoming,
+)
+from app.utilities.stores.base import Document, find_all
+from app.utilities.suggestions import suggestions
+from app.utilities.transactions import transaction_store
 
-from .models import Bill, BillCreate, BillCreateResult, BillSuccessResult, BillUpdate
+from .models import (
+    Bill,
+    BillCreate,
+    BillCreateResult,
+    BillOccurrence,
+    BillSuccessResult,
+    BillUpdate,
+)
 
 router = APIRouter(
     prefix="/v1/bills",
     tags=["bills"],
+    route_class=NegotiatedRoute,
     responses={
         status.HTTP_401_UNAUTHORIZED: {
             "description": "Unauthorized",
@@ -30,25 +55,40 @@ router = APIRouter(
 
 security = HTTPBearer()
 
+store = transaction_store("bills")
+list_flight: SingleFlight[list[Document]] = SingleFlight("bills.list")
+get_flight: SingleFlight[Document | None] = SingleFlight("bills.get")
+
 
 @router.get("", response_model=list[Bill])
 async def get_bills(
     credentials: Annotated[HTTPAuthorizationCredentials, Depends(security)],
     user_id: Annotated[None | str, Depends(validate_access)],
+    access: Annotated[Access, Depends(resolve_access)],
+    filters: Annotated[TransactionFilters, Query()],
 ) -> list[Bill]:
     """
     Get bills
     """
     results = []
-    async for doc in db.bills.find({"user_id": user_id}):
+    docs = await list_flight.run(
+        user_id,
+        (tuple(access.readable), filters.model_dump_json()),
+        lambda: find_all(store, access.readable, filters),
+    )
+    for doc in docs:
 
         results.append(
             Bill(
                 id=str(doc.get("_id")),
                 user_id=doc.get("user_id"),
+                ledger_id=doc.get("ledger_id"),
                 total=doc.get("total"),
+                currency=doc.get("currency"),
+                amount_minor=doc.get("amount_minor"),
                 category=doc.get("category"),
                 place=doc.get("place"),
+                recurrence=doc.get("recurrence"),
                 updated_at=doc.get("updated_at"),
                 created_at=doc.get("created_at"),
             )
@@ -57,6 +97,29 @@ async def get_bills(
     return results
 
 
+@router.get("/upcoming", response_model=list[BillOccurrence])
+async def get_upcoming_bills(
+    credentials: Annotated[HTTPAuthorizationCredentials, Depends(security)],
+    user_id: Annotated[None | str, Depends(validate_access)],
+    access: Annotated[Access, Depends(resolve_access)],
+    days: Annotated[int, Query(ge=1, le=90)] = 30,
+) -> list[BillOccurrence]:
+    """
+    Get bills due in the next days
+    """
+    return [
+        BillOccurrence(
+            bill_id=str(doc.get("bill_id")),
+            due=doc.get("due"),
+            total=doc.get("total"),
+            currency=doc.get("currency"),
+            category=doc.get("category"),
+            place=doc.get("place"),
+        )
+        for doc in await upcoming(access.readable, days)
+    ]
+
+
 @router.get(
     "/{bill_id}",
     response_model=Bill,
@@ -74,6 +137,7 @@ async def get_bills(
 async def get_bill(
     credentials: Annotated[HTTPAuthorizationCredentials, Depends(security)],
     user_id: Annotated[None | str, Depends(validate_access)],
+    access: Annotated[Access, Depends(resolve_access)],
     bill_id: str,
 ) -> Bill:
     """
@@ -86,7 +150,11 @@ async def get_bill(
             status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid bill id format."
         )
 
-    doc = await db.bills.find_one({"_id": bill_object_id, "user_id": user_id})
+    doc = await get_flight.run(
+        user_id,
+        (tuple(access.readable), bill_object_id),
+        lambda: store.find_one(access.readable, bill_object_id),
+    )
     if not doc:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Bill not found."
@@ -95,9 +163,13 @@ async def get_bill(
     return Bill(
         id=str(doc.get("_id")),
         user_id=doc.get("user_id"),
+        ledger_id=doc.get("ledger_id"),
         total=doc.get("total"),
+        currency=doc.get("currency"),
+        amount_minor=doc.get("amount_minor"),
         category=doc.get("category"),
         place=doc.get("place"),
+        recurrence=doc.get("recurrence"),
         updated_at=doc.get("updated_at"),
         created_at=doc.get("created_at"),
     )
@@ -110,19 +182,38 @@ async def get_bill(
 async def add_bill(
     credentials: Annotated[HTTPAuthorizationCredentials, Depends(security)],
     user_id: Annotated[None | str, Depends(validate_access)],
+    access: Annotated[Access, Depends(resolve_access)],
     new_bill: BillCreate,
+    ledger_id: Annotated[str | None, Query()] = None,
+    idempotency_key: Annotated[str | None, Header(max_length=255)] = None,
 ) -> BillCreateResult:
     """
     Add a bill.
     """
-    data = new_bill.model_dump() | {
-        "user_id": user_id,
-        "created_at": datetime.now(timezone.utc),
-    }
-    create_result = await db.bills.insert_one(data)
-    create_result_str = str(create_result.inserted_id)
+    ledger_id = access.ledger(ledger_id)
+    async with idempotency_slot(
+        user_id, "bills", idempotency_key, new_bill, ledger_id
+    ) as slot:
+        if slot.result:
+            return BillCreateResult(**slot.result)
 
-    return BillCreateResult(id=create_result_str)
+        data = with_money(new_bill.model_dump(mode="json")) | {
+            "user_id": user_id,
+            "ledger_id": ledger_id,
+            "created_at": datetime.now(timezone.utc),
+        }
+        inserted_id = await store.insert_one(data)
+        if new_bill.recurrence:
+            await schedule_bill(inserted_id, user_id, data)
+        suggestions.record(user_id, data)
+        invalidate_user(user_id)
+        create_result_str = str(inserted_id)
+
+        result = BillCreateResult(id=create_result_str)
+        await slot.save(result.model_dump())
+
+    await record_spending(None, data)
+    return result
 
 
 @router.delete(
@@ -142,6 +233,7 @@ async def add_bill(
 async def delete_bill(
     credentials: Annotated[HTTPAuthorizationCredentials, Depends(security)],
     user_id: Annotated[None | str, Depends(validate_access)],
+    access: Annotated[Access, Depends(resolve_access)],
     bill_id: str,
 ) -> BillSuccessResult:
     """
@@ -154,14 +246,22 @@ async def delete_bill(
             status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid bill id format."
         )
 
-    delete_result = await db.bills.delete_one(
-        {"_id": bill_object_id, "user_id": user_id}
+    doc = (
+        await store.find_one(access.writable, bill_object_id)
+        if alerts_enabled() or suggestions.tracks()
+        else None
     )
-    if delete_result.deleted_count == 0:
+    deleted = await store.delete_one(access.writable, bill_object_id)
+    if not deleted:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Bill not found",
         )
+    if doc:
+        suggestions.forget(doc["user_id"], doc)
+    await unschedule_bill(bill_object_id)
+    invalidate_user(user_id)
+    await record_spending(doc, None)
 
     return BillSuccessResult(success=True)
 
@@ -183,6 +283,7 @@ async def delete_bill(
 async def update_bill(
     credentials: Annotated[HTTPAuthorizationCredentials, Depends(security)],
     user_id: Annotated[None | str, Depends(validate_access)],
+    access: Annotated[Access, Depends(resolve_access)],
     bill_id: str,
     bill_update: BillUpdate,
 ) -> BillSuccessResult:
@@ -196,16 +297,35 @@ async def update_bill(
             status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid bill id format."
         )
 
-    update_data = bill_update.model_dump(exclude_unset=True) | {
+    update_data = bill_update.model_dump(mode="json", exclude_unset=True) | {
         "updated_at": datetime.now(timezone.utc)
     }
-    update_result = await db.bills.update_one(
-        {"_id": bill_object_id, "user_id": user_id}, {"$set": update_data}
-    )
+    doc = None
+    if (
+        "total" in update_data
+        or "currency" in update_data
+        or affects_spending(update_data)
+        or suggestions.tracks(update_data)
+    ):
+        doc = await store.find_one(access.writable, bill_object_id)
+    if doc and ("total" in update_data or "currency" in update_data):
+        update_data = with_money_update(update_data, doc)
+    updated = await store.update_one(access.writable, bill_object_id, update_data)
 
-    if update_result.matched_count == 0:
+    if not updated:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Bill not found."
         )
+    if doc:
+        suggestions.forget(doc["user_id"], doc, update_data)
+        suggestions.record(doc["user_id"], update_data)
+    if any(field in update_data for field in SCHEDULE_FIELDS):
+        updated_doc = await store.find_one(access.readable, bill_object_id)
+        if updated_doc:
+            # Occurrences belong to the bill's owner, not to who edited it.
+            await reschedule_bill(bill_object_id, updated_doc["user_id"], updated_doc)
+    invalidate_user(user_id)
+    if doc:
+        await record_spending(doc, doc | update_data)
 
     return BillSuccessResult(success=True)
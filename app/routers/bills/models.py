@@ -1,29 +1,62 @@
-from datetime import datetime
-from typing import Optional
+from datetime import date, datetime
+from typing import Literal, Optional, Self
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, model_validator
+
+from app.models import Currency
+
+
+class Recurrence(BaseModel):
+    frequency: Literal["daily", "weekly", "monthly", "yearly"]
+    interval: int = Field(1, ge=1, le=366)
+    start: date
+    until: Optional[date] = None
+
+    @model_validator(mode="after")
+    def check_range(self) -> Self:
+        if self.until and self.until < self.start:
+            raise ValueError("until must not be before start")
+
+        return self
 
 
 class Bill(BaseModel):
     id: str
     user_id: str
+    ledger_id: Optional[str] = None
     total: float
+    currency: Optional[str] = None
+    amount_minor: Optional[int] = None
     category: str
     place: str
+    recurrence: Optional[Recurrence] = None
     created_at: datetime
     updated_at: Optional[datetime] = None
 
 
 class BillCreate(BaseModel):
     total: float
+    currency: Optional[Currency] = None
     category: str
     place: str
+    recurrence: Optional[Recurrence] = None
 
 
 class BillUpdate(BaseModel):
     total: Optional[float] = None
+    currency: Optional[Currency] = None
     category: Optional[str] = None
     place: Optional[str] = None
+    recurrence: Optional[Recurrence] = None
+
+
+class BillOccurrence(BaseModel):
+    bill_id: str
+    due: date
+    total: float
+    currency: Optional[str] = None
+    category: str
+    place: str
 
 
 class BillCreateResult(BaseModel):
@@ -6,14 +6,24 @@ from bson import ObjectId
 from fastapi import (
     APIRouter,
     Depends,
+    Header,
     HTTPException,
+    Query,
     status,
 )
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 
-from app.auth import validate_access
-from app.models import GenericException
-from app.utilities.clients import db
+from app.auth import resolve_access, validate_access
+from app.models import CategoryFilters, GenericException
+from app.utilities.cache import SingleFlight, invalidate_user
+from app.utilities.idempotency import idempotency_slot
+from app.utilities.ledgers import Access
+from app.utilities.money import with_money, with_money_update
+from app.utilities.responses import NegotiatedRoute
+from app.utilities.spending import invalidate_spending
+from app.utilities.stores.base import Document, find_all
+from app.utilities.suggestions import suggestions
+from app.utilities.transactions import plan_store
 
 from .models import (
     Budget,
@@ -26,6 +36,7 @@ from .models import (
 router = APIRouter(
     prefix="/v1/budgets",
     tags=["budgets"],
+    route_class=NegotiatedRoute,
     responses={
         status.HTTP_401_UNAUTHORIZED: {
             "description": "Unauthorized",
@@ -36,23 +47,37 @@ router = APIRouter(
 
 security = HTTPBearer()
 
+store = plan_store("budgets")
+list_flight: SingleFlight[list[Document]] = SingleFlight("budgets.list")
+get_flight: SingleFlight[Document | None] = SingleFlight("budgets.get")
+
 
 @router.get("", response_model=list[Budget])
 async def get_budgets(
     credentials: Annotated[HTTPAuthorizationCredentials, Depends(security)],
     user_id: Annotated[None | str, Depends(validate_access)],
+    access: Annotated[Access, Depends(resolve_access)],
+    filters: Annotated[CategoryFilters, Query()],
 ) -> list[Budget]:
     """
     Get gas budgets.
     """
     results = []
-    async for doc in db.budgets.find({"user_id": user_id}):
+    docs = await list_flight.run(
+        user_id,
+        (tuple(access.readable), filters.model_dump_json()),
+        lambda: find_all(store, access.readable, filters),
+    )
+    for doc in docs:
 
         results.append(
             Budget(
                 id=str(doc.get("_id")),
                 user_id=doc.get("user_id"),
+                ledger_id=doc.get("ledger_id"),
                 total=doc.get("total"),
+                currency=doc.get("currency"),
+                amount_minor=doc.get("amount_minor"),
                 category=doc.get("category"),
                 name=doc.get("name"),
                 updated_at=doc.get("updated_at"),
@@ -80,6 +105,7 @@ async def get_budgets(
 async def get_budget(
     credentials: Annotated[HTTPAuthorizationCredentials, Depends(security)],
     user_id: Annotated[None | str, Depends(validate_access)],
+    access: Annotated[Access, Depends(resolve_access)],
     budget_id: str,
 ) -> Budget:
     """
@@ -92,7 +118,11 @@ async def get_budget(
             status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid budget id format."
         )
 
-    doc = await db.budgets.find_one({"_id": budget_object_id, "user_id": user_id})
+    doc = await get_flight.run(
+        user_id,
+        (tuple(access.readable), budget_object_id),
+        lambda: store.find_one(access.readable, budget_object_id),
+    )
     if not doc:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Budget not found."
@@ -101,7 +131,10 @@ async def get_budget(
     return Budget(
         id=str(doc.get("_id")),
         user_id=doc.get("user_id"),
+        ledger_id=doc.get("ledger_id"),
         total=doc.get("total"),
+        currency=doc.get("currency"),
+        amount_minor=doc.get("amount_minor"),
         category=doc.get("category"),
         name=doc.get("name"),
         updated_at=doc.get("updated_at"),
@@ -116,20 +149,36 @@ async def get_budget(
 async def add_budget(
     credentials: Annotated[HTTPAuthorizationCredentials, Depends(security)],
     user_id: Annotated[None | str, Depends(validate_access)],
+    access: Annotated[Access, Depends(resolve_access)],
     new_budget: BudgetCreate,
+    ledger_id: Annotated[str | None, Query()] = None,
+    idempotency_key: Annotated[str | None, Header(max_length=255)] = None,
 ) -> BudgetCreatResult:
     """
     Add a gas budget.
     """
 
-    data = (
-        new_budget.model_dump()
-        | {"user_id": user_id}
-        | {"created_at": datetime.now(timezone.utc)}
-    )
-    create_result = await db.budgets.insert_one(data)
+    ledger_id = access.ledger(ledger_id)
+    async with idempotency_slot(
+        user_id, "budgets", idempotency_key, new_budget, ledger_id
+    ) as slot:
+        if slot.result:
+            return BudgetCreatResult(**slot.result)
 
-    return BudgetCreatResult(id=str(create_result.inserted_id))
+        data = (
+            with_money(new_budget.model_dump())
+            | {"user_id": user_id, "ledger_id": ledger_id}
+            | {"created_at": datetime.now(timezone.utc)}
+        )
+        inserted_id = await store.insert_one(data)
+        suggestions.record(user_id, data)
+        invalidate_user(user_id)
+        invalidate_spending(user_id)
+
+        result = BudgetCreatResult(id=str(inserted_id))
+        await slot.save(result.model_dump())
+
+    return result
 
 
 @router.delete(
@@ -149,6 +198,7 @@ async def add_budget(
 async def delete_budget(
     credentials: Annotated[HTTPAuthorizationCredentials, Depends(security)],
     user_id: Annotated[None | str, Depends(validate_access)],
+    access: Annotated[Access, Depends(resolve_access)],
     budget_id: str,
 ) -> BudgetSuccessResult:
     """
@@ -162,14 +212,21 @@ async def delete_budget(
             status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid budget id format."
         )
 
-    delete_result = await db.budgets.delete_one(
-        {"_id": budget_object_id, "user_id": user_id}
+    doc = (
+        await store.find_one(access.writable, budget_object_id)
+        if suggestions.tracks()
+        else None
     )
-    if delete_result.deleted_count == 0:
+    deleted = await store.delete_one(access.writable, budget_object_id)
+    if not deleted:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Budget not found",
         )
+    if doc:
+        suggestions.forget(doc["user_id"], doc)
+    invalidate_user(user_id)
+    invalidate_spending(user_id)
 
     return BudgetSuccessResult(success=True)
 
@@ -191,6 +248,7 @@ async def delete_budget(
 async def update_budget(
     credentials: Annotated[HTTPAuthorizationCredentials, Depends(security)],
     user_id: Annotated[None | str, Depends(validate_access)],
+    access: Annotated[Access, Depends(resolve_access)],
     budget_id: str,
     budget_update: BudgetUpdate,
 ) -> BudgetSuccessResult:
@@ -208,13 +266,24 @@ async def update_budget(
     update_data = budget_update.model_dump(exclude_unset=True) | {
         "updated_at": datetime.now(timezone.utc)
     }
-    update_result = await db.budgets.update_one(
-        {"_id": budget_object_id, "user_id": user_id}, {"$set": update_data}
-    )
-
-    if update_result.matched_count == 0:
+    doc = None
+    if (
+        "total" in update_data
+        or "currency" in update_data
+        or suggestions.tracks(update_data)
+    ):
+        doc = await store.find_one(access.writable, budget_object_id)
+    if doc and ("total" in update_data or "currency" in update_data):
+        update_data = with_money_update(update_data, doc)
+    updated = await store.update_one(access.writable, budget_object_id, update_data)
+    if not updated:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Budget not found."
         )
+    if doc:
+        suggestions.forget(doc["user_id"], doc, update_data)
+        suggestions.record(doc["user_id"], update_data)
+    invalidate_user(user_id)
+    invalidate_spending(user_id)
 
     return BudgetSuccessResult(success=True)
@@ -3,11 +3,16 @@ from typing import Optional
 
 from pydantic import BaseModel
 
+from app.models import Currency
+
 
 class Budget(BaseModel):
     id: str
     user_id: str
+    ledger_id: Optional[str] = None
     total: float
+    currency: Optional[str] = None
+    amount_minor: Optional[int] = None
     category: str
     name: str
     created_at: datetime
@@ -16,12 +21,14 @@ class Budget(BaseModel):
 
 class BudgetCreate(BaseModel):
     total: float
+    currency: Optional[Currency] = None
     category: str
     name: str
 
 
 class BudgetUpdate(BaseModel):
     total: Optional[float] = None
+    currency: Optional[Currency] = None
     category: Optional[str] = None
     name: Optional[str] = None
 
@@ -6,19 +6,38 @@ from bson import ObjectId
 from fastapi import (
     APIRouter,
     Depends,
+    Header,
     HTTPException,
+    Query,
+    Request,
     status,
 )
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 
-from app.auth import validate_access
-from app.models import GenericException
-from app.utilities.clients import db
+from app.auth import resolve_access, validate_access
+from app.models import GenericException, ImportOptions, TransactionFilters
+from app.utilities.alerts import (
+    affects_spending,
+    alerts_enabled,
+    record_spending,
+    refresh_spending,
+)
+from app.utilities.cache import SingleFlight, invalidate_user
+from app.utilities.idempotency import idempotency_slot
+from app.utilities.jobs import JobCancelled, runner
+from app.utilities.ledgers import Access
+from app.utilities.money import with_money, with_money_update
+from app.utilities.responses import NegotiatedRoute
+from app.utilities.statements import csv_records, import_statement, ofx_records
+from app.utilities.stores.base import Document, find_all
+from app.utilities.suggestions import suggestions
+from app.utilities.transactions import transaction_store
 
 from .models import (
     Expense,
     ExpenseCreate,
     ExpenseCreatResult,
+    ExpenseImportResult,
     ExpenseSuccessResult,
     ExpenseUpdate,
 )
@@ -26,6 +45,7 @@ from .models import (
 router = APIRouter(
     prefix="/v1/expenses",
     tags=["expenses"],
+    route_class=NegotiatedRoute,
     responses={
         status.HTTP_401_UNAUTHORIZED: {
             "description": "Unauthorized",
@@ -36,17 +56,28 @@ router = APIRouter(
 
 security = HTTPBearer()
 
+store = transaction_store("expenses")
+list_flight: SingleFlight[list[Document]] = SingleFlight("expenses.list")
+get_flight: SingleFlight[Document | None] = SingleFlight("expenses.get")
+
 
 @router.get("", response_model=list[Expense])
 async def get_expenses(
     credentials: Annotated[HTTPAuthorizationCredentials, Depends(security)],
     user_id: Annotated[None | str, Depends(validate_access)],
+    access: Annotated[Access, Depends(resolve_access)],
+    filters: Annotated[TransactionFilters, Query()],
 ) -> list[Expense]:
     """
     Get gas expenses.
     """
     results = []
-    async for doc in db.expenses.find({"user_id": user_id}):
+    docs = await list_flight.run(
+        user_id,
+        (tuple(access.readable), filters.model_dump_json()),
+        lambda: find_all(store, access.readable, filters),
+    )
+    for doc in docs:
 
         updated_at = doc.get("updated_at")
         if updated_at:
@@ -56,7 +87,10 @@ async def get_expenses(
             Expense(
                 id=str(doc.get("_id")),
                 user_id=doc.get("user_id"),
+                ledger_id=doc.get("ledger_id"),
                 total=doc.get("total"),
+                currency=doc.get("currency"),
+                amount_minor=doc.get("amount_minor"),
                 category=doc.get("category"),
                 place=doc.get("place"),
                 updated_at=doc.get("updated_at"),
@@ -84,6 +118,7 @@ async def get_expenses(
 async def get_expense(
     credentials: Annotated[HTTPAuthorizationCredentials, Depends(security)],
     user_id: Annotated[None | str, Depends(validate_access)],
+    access: Annotated[Access, Depends(resolve_access)],
     expense_id: str,
 ) -> Expense:
     """
@@ -96,7 +131,11 @@ async def get_expense(
             status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid expense id format."
         )
 
-    doc = await db.expenses.find_one({"_id": expense_object_id, "user_id": user_id})
+    doc = await get_flight.run(
+        user_id,
+        (tuple(access.readable), expense_object_id),
+        lambda: store.find_one(access.readable, expense_object_id),
+    )
     if not doc:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Expense not found."
@@ -105,7 +144,10 @@ async def get_expense(
     return Expense(
         id=str(doc.get("_id")),
         user_id=doc.get("user_id"),
+        ledger_id=doc.get("ledger_id"),
         total=doc.get("total"),
+        currency=doc.get("currency"),
+        amount_minor=doc.get("amount_minor"),
         category=doc.get("category"),
         place=doc.get("place"),
         updated_at=doc.get("updated_at"),
@@ -120,20 +162,103 @@ async def get_expense(
 async def add_expense(
     credentials: Annotated[HTTPAuthorizationCredentials, Depends(security)],
     user_id: Annotated[None | str, Depends(validate_access)],
+    access: Annotated[Access, Depends(resolve_access)],
     new_expense: ExpenseCreate,
+    ledger_id: Annotated[str | None, Query()] = None,
+    idempotency_key: Annotated[str | None, Header(max_length=255)] = None,
 ) -> ExpenseCreatResult:
     """
     Add a gas expense.
     """
 
-    data = (
-        new_expense.model_dump()
-        | {"user_id": user_id}
-        | {"created_at": datetime.now(timezone.utc)}
-    )
-    create_result = await db.expenses.insert_one(data)
+    ledger_id = access.ledger(ledger_id)
+    async with idempotency_slot(
+        user_id, "expenses", idempotency_key, new_expense, ledger_id
+    ) as slot:
+        if slot.result:
+            return ExpenseCreatResult(**slot.result)
 
-    return ExpenseCreatResult(id=str(create_result.inserted_id))
+        data = (
+            with_money(new_expense.model_dump())
+            | {"user_id": user_id, "ledger_id": ledger_id}
+            | {"created_at": datetime.now(timezone.utc)}
+        )
+        inserted_id = await store.insert_one(data)
+        suggestions.record(user_id, data)
+        invalidate_user(user_id)
+
+        result = ExpenseCreatResult(id=str(inserted_id))
+        await slot.save(result.model_dump())
+
+    await record_spending(None, data)
+    return result
+
+
+@router.post(
+    "/import",
+    response_model=ExpenseImportResult,
+    responses={
+        status.HTTP_400_BAD_REQUEST: {
+            "description": "Malformed statement.",
+            "model": GenericException,
+        },
+        status.HTTP_409_CONFLICT: {
+            "description": "Import cancelled.",
+            "model": GenericException,
+        },
+        status.HTTP_415_UNSUPPORTED_MEDIA_TYPE: {
+            "description": "Statement must be CSV or OFX.",
+            "model": GenericException,
+        },
+    },
+)
+async def import_expenses(
+    credentials: Annotated[HTTPAuthorizationCredentials, Depends(security)],
+    user_id: Annotated[None | str, Depends(validate_access)],
+    access: Annotated[Access, Depends(resolve_access)],
+    request: Request,
+    options: Annotated[ImportOptions, Query()],
+    content_type: Annotated[str | None, Header()] = None,
+) -> ExpenseImportResult:
+    """
+    Import expenses from a CSV or OFX bank statement sent as the request body.
+
+    The statement is parsed while it is received. Rows imported before are
+    skipped, so an interrupted import can be sent again. Progress is visible on
+    the import's job while it runs.
+    """
+    ledger_id = access.ledger(options.ledger_id)
+    media_type = (content_type or "").split(";")[0].strip().lower()
+    if media_type in ("text/csv", "application/csv"):
+        statement_format = "csv"
+        records = csv_records(request.stream())
+    elif media_type in ("application/x-ofx", "application/ofx"):
+        statement_format = "ofx"
+        records = ofx_records(request.stream())
+    else:
+        raise HTTPException(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            detail="Statement must be CSV or OFX.",
+        )
+
+    try:
+        async with runner.track(
+            user_id, "expense_import", {"format": statement_format}
+        ) as job:
+            job.result = await import_statement(
+                store, user_id, ledger_id, records, statement_format, options, job
+            )
+    except JobCancelled:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT, detail="Import cancelled."
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    finally:
+        invalidate_user(user_id)
+        await refresh_spending(user_id)
+
+    return ExpenseImportResult(job_id=str(job.id), **job.result)
 
 
 @router.delete(
@@ -153,6 +278,7 @@ async def add_expense(
 async def delete_expense(
     credentials: Annotated[HTTPAuthorizationCredentials, Depends(security)],
     user_id: Annotated[None | str, Depends(validate_access)],
+    access: Annotated[Access, Depends(resolve_access)],
     expense_id: str,
 ) -> ExpenseSuccessResult:
     """
@@ -166,14 +292,21 @@ async def delete_expense(
             status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid expense id format."
         )
 
-    delete_result = await db.expenses.delete_one(
-        {"_id": expense_object_id, "user_id": user_id}
+    doc = (
+        await store.find_one(access.writable, expense_object_id)
+        if alerts_enabled() or suggestions.tracks()
+        else None
     )
-    if delete_result.deleted_count == 0:
+    deleted = await store.delete_one(access.writable, expense_object_id)
+    if not deleted:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Expense not found",
         )
+    if doc:
+        suggestions.forget(doc["user_id"], doc)
+    invalidate_user(user_id)
+    await record_spending(doc, None)
 
     return ExpenseSuccessResult(success=True)
 
@@ -195,6 +328,7 @@ async def delete_expense(
 async def update_expense(
     credentials: Annotated[HTTPAuthorizationCredentials, Depends(security)],
     user_id: Annotated[None | str, Depends(validate_access)],
+    access: Annotated[Access, Depends(resolve_access)],
     expense_id: str,
     expense_update: ExpenseUpdate,
 ) -> ExpenseSuccessResult:
@@ -212,13 +346,27 @@ async def update_expense(
     update_data = expense_update.model_dump(exclude_unset=True) | {
         "updated_at": datetime.now(timezone.utc)
     }
-    update_result = await db.expenses.update_one(
-        {"_id": expense_object_id, "user_id": user_id}, {"$set": update_data}
-    )
+    doc = None
+    if (
+        "total" in update_data
+        or "currency" in update_data
+        or affects_spending(update_data)
+        or suggestions.tracks(update_data)
+    ):
+        doc = await store.find_one(access.writable, expense_object_id)
+    if doc and ("total" in update_data or "currency" in update_data):
+        update_data = with_money_update(update_data, doc)
+    updated = await store.update_one(access.writable, expense_object_id, update_data)
 
-    if update_result.matched_count == 0:
+    if not updated:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Expense not found."
         )
+    if doc:
+        suggestions.forget(doc["user_id"], doc, update_data)
+        suggestions.record(doc["user_id"], update_data)
+    invalidate_user(user_id)
+    if doc:
+        await record_spending(doc, doc | update_data)
 
     return ExpenseSuccessResult(success=True)
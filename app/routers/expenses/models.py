@@ -3,11 +3,16 @@ from typing import Optional
 
 from pydantic import BaseModel
 
+from app.models import Currency
+
 
 class Expense(BaseModel):
     id: str
     user_id: str
+    ledger_id: Optional[str] = None
     total: float
+    currency: Optional[str] = None
+    amount_minor: Optional[int] = None
     category: str
     place: str
     created_at: datetime
@@ -16,12 +21,14 @@ class Expense(BaseModel):
 
 class ExpenseCreate(BaseModel):
     total: float
+    currency: Optional[Currency] = None
     category: str
     place: str
 
 
 class ExpenseUpdate(BaseModel):
     total: Optional[float] = None
+    currency: Optional[Currency] = None
     category: Optional[str] = None
     place: Optional[str] = None
 
@@ -32,3 +39,18 @@ class ExpenseCreatResult(BaseModel):
 
 class ExpenseSuccessResult(BaseModel):
     success: bool
+
+
+class ImportRowError(BaseModel):
+    row: int
+    error: str
+
+
+class ExpenseImportResult(BaseModel):
+    job_id: str
+    rows: int
+    inserted: int
+    duplicates: int
+    skipped: int
+    error_count: int
+    errors: list[ImportRowError]
@@ -0,0 +1,126 @@
+from typing import Annotated, Any
+
+import bson
+from bson import ObjectId
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+
+from app.auth import validate_access
+from app.models import GenericException
+from app.utilities.jobs import job_store, runner
+from app.utilities.responses import NegotiatedRoute
+
+from .models import Job
+
+router = APIRouter(
+    prefix="/v1/jobs",
+    tags=["jobs"],
+    route_class=NegotiatedRoute,
+    responses={
+        status.HTTP_401_UNAUTHORIZED: {
+            "description": "Unauthorized",
+            "model": GenericException,
+        }
+    },
+)
+
+security = HTTPBearer()
+
+
+def to_job(doc: Any) -> Job:
+    return Job(
+        id=str(doc.get("_id")),
+        kind=doc.get("kind"),
+        status=doc.get("status"),
+        progress=doc.get("progress"),
+        result=doc.get("result"),
+        error=doc.get("error"),
+        created_at=doc.get("created_at"),
+        started_at=doc.get("started_at"),
+        finished_at=doc.get("finished_at"),
+    )
+
+
+def parse_job_id(job_id: str) -> ObjectId:
+    try:
+        return ObjectId(job_id)
+    except bson.errors.InvalidId:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid job id format."
+        )
+
+
+@router.get("", response_model=list[Job])
+async def get_jobs(
+    credentials: Annotated[HTTPAuthorizationCredentials, Depends(security)],
+    user_id: Annotated[None | str, Depends(validate_access)],
+    limit: Annotated[int, Query(ge=1, le=100)] = 20,
+) -> list[Job]:
+    """
+    Get the latest jobs
+    """
+    return [to_job(doc) for doc in await job_store().latest(user_id, limit)]
+
+
+@router.get(
+    "/{job_id}",
+    response_model=Job,
+    responses={
+        status.HTTP_400_BAD_REQUEST: {
+            "description": "Invalid job id format.",
+            "model": GenericException,
+        },
+        status.HTTP_404_NOT_FOUND: {
+            "description": "Job not found.",
+            "model": GenericException,
+        },
+    },
+)
+async def get_job(
+    credentials: Annotated[HTTPAuthorizationCredentials, Depends(security)],
+    user_id: Annotated[None | str, Depends(validate_access)],
+    job_id: str,
+) -> Job:
+    """
+    Get a job's status and progress.
+    """
+    doc = await job_store().get(parse_job_id(job_id))
+    if not doc or doc["user_id"] != user_id:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Job not found."
+        )
+
+    return to_job(doc)
+
+
+@router.post(
+    "/{job_id}/cancel",
+    response_model=Job,
+    responses={
+        status.HTTP_400_BAD_REQUEST: {
+            "description": "Invalid job id format.",
+            "model": GenericException,
+        },
+        status.HTTP_404_NOT_FOUND: {
+            "description": "Job not found.",
+            "model": GenericException,
+        },
+    },
+)
+async def cancel_job(
+    credentials: Annotated[HTTPAuthorizationCredentials, Depends(security)],
+    user_id: Annotated[None | str, Depends(validate_access)],
+    job_id: str,
+) -> Job:
+    """
+    Cancel a job.
+
+    A running job stops at its next await, finished jobs are left as they are.
+    """
+    doc = await runner.cancel(user_id, parse_job_id(job_id))
+    if not doc:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Job not found."
+        )
+
+    return to_job(doc)
@@ -0,0 +1,162 @@
+from datetime import datetime, timezone
+from typing import Annotated, Any
+
+import bson
+from bson import ObjectId
+from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+
+from app.auth import validate_access
+from app.models import GenericException
+from app.utilities.ledgers import invalidate_access, ledger_store
+from app.utilities.responses import NegotiatedRoute
+
+from .models import (
+    Ledger,
+    LedgerCreate,
+    LedgerCreateResult,
+    LedgerMemberUpdate,
+    LedgerSuccessResult,
+)
+
+router = APIRouter(
+    prefix="/v1/ledgers",
+    tags=["ledgers"],
+    route_class=NegotiatedRoute,
+    responses={
+        status.HTTP_401_UNAUTHORIZED: {
+            "description": "Unauthorized",
+            "model": GenericException,
+        }
+    },
+)
+
+security = HTTPBearer()
+
+member_responses: dict[int | str, dict[str, Any]] = {
+    status.HTTP_400_BAD_REQUEST: {
+        "description": "Invalid ledger id format, Owners cannot change or remove "
+        "themselves.",
+        "model": GenericException,
+    },
+    status.HTTP_404_NOT_FOUND: {
+        "description": "Ledger not found.",
+        "model": GenericException,
+    },
+}
+
+
+def parse_ledger_id(ledger_id: str) -> ObjectId:
+    try:
+        return ObjectId(ledger_id)
+    except bson.errors.InvalidId:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid ledger id format.",
+        )
+
+
+@router.get("", response_model=list[Ledger])
+async def get_ledgers(
+    credentials: Annotated[HTTPAuthorizationCredentials, Depends(security)],
+    user_id: Annotated[None | str, Depends(validate_access)],
+) -> list[Ledger]:
+    """
+    Get shared ledgers the user is a member of
+    """
+    return [
+        Ledger(
+            id=str(doc["_id"]),
+            name=doc["name"],
+            members=doc["members"],
+            created_at=doc["created_at"],
+        )
+        for doc in await ledger_store().member_of(user_id)
+    ]
+
+
+@router.post("", response_model=LedgerCreateResult)
+async def add_ledger(
+    credentials: Annotated[HTTPAuthorizationCredentials, Depends(security)],
+    user_id: Annotated[None | str, Depends(validate_access)],
+    new_ledger: LedgerCreate,
+) -> LedgerCreateResult:
+    """
+    Create a shared ledger owned by the user.
+    """
+    ledger_id = await ledger_store().insert(
+        new_ledger.model_dump()
+        | {
+            "members": [{"user_id": user_id, "role": "owner"}],
+            "created_at": datetime.now(timezone.utc),
+        }
+    )
+    invalidate_access([user_id])
+
+    return LedgerCreateResult(id=str(ledger_id))
+
+
+@router.put(
+    "/{ledger_id}/members/{member_id}",
+    response_model=LedgerSuccessResult,
+    responses=member_responses,
+)
+async def put_ledger_member(
+    credentials: Annotated[HTTPAuthorizationCredentials, Depends(security)],
+    user_id: Annotated[None | str, Depends(validate_access)],
+    ledger_id: str,
+    member_id: str,
+    member: LedgerMemberUpdate,
+) -> LedgerSuccessResult:
+    """
+    Add a member to a ledger or change their role, owners only.
+    """
+    ledger_object_id = parse_ledger_id(ledger_id)
+    if member_id == user_id:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Owners cannot change or remove themselves.",
+        )
+
+    if not await ledger_store().put_member(
+        ledger_object_id, user_id, member_id, member.role
+    ):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Ledger not found."
+        )
+    invalidate_access([member_id])
+
+    return LedgerSuccessResult(success=True)
+
+
+@router.delete(
+    "/{ledger_id}/members/{member_id}",
+    response_model=LedgerSuccessResult,
+    responses=member_responses,
+)
+async def delete_ledger_member(
+    credentials: Annotated[HTTPAuthorizationCredentials, Depends(security)],
+    user_id: Annotated[None | str, Depends(validate_access)],
+    ledger_id: str,
+    member_id: str,
+) -> LedgerSuccessResult:
+    """
+    Remove a member from a ledger.
+
+    Owners remove others, members remove themselves to leave.
+    """
+    ledger_object_id = parse_ledger_id(ledger_id)
+    if not await ledger_store().remove_member(ledger_object_id, user_id, member_id):
+        if member_id == user_id and await ledger_store().is_member(
+            ledger_object_id, user_id
+        ):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Owners cannot change or remove themselves.",
+            )
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Ledger not found."
+        )
+    invalidate_access([member_id])
+
+    return LedgerSuccessResult(success=True)
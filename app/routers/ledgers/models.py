@@ -0,0 +1,34 @@
+from datetime import datetime
+from typing import Literal
+
+from pydantic import BaseModel
+
+Role = Literal["owner", "editor", "viewer"]
+
+
+class LedgerMember(BaseModel):
+    user_id: str
+    role: Role
+
+
+class Ledger(BaseModel):
+    id: str
+    name: str
+    members: list[LedgerMember]
+    created_at: datetime
+
+
+class LedgerCreate(BaseModel):
+    name: str
+
+
+class LedgerMemberUpdate(BaseModel):
+    role: Role
+
+
+class LedgerCreateResult(BaseModel):
+    id: str
+
+
+class LedgerSuccessResult(BaseModel):
+    success: bool
@@ -0,0 +1,63 @@
+from typing import Annotated
+
+from fastapi import APIRouter, Depends, status
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+
+from app.auth import validate_access
+from app.models import GenericException
+from app.utilities import alerts, deadlines
+from app.utilities.cache import flights
+from app.utilities.limiter import limiter
+from app.utilities.responses import NegotiatedRoute
+
+from .models import AlertStats, DeadlineStats, FlightStats, LimiterStats, Metrics
+
+router = APIRouter(
+    prefix="/v1/metrics",
+    tags=["metrics"],
+    route_class=NegotiatedRoute,
+    responses={
+        status.HTTP_401_UNAUTHORIZED: {
+            "description": "Unauthorized",
+            "model": GenericException,
+        }
+    },
+)
+
+security = HTTPBearer()
+
+
+@router.get("", response_model=Metrics)
+async def get_metrics(
+    credentials: Annotated[HTTPAuthorizationCredentials, Depends(security)],
+    user_id: Annotated[None | str, Depends(validate_access)],
+) -> Metrics:
+    """
+    Counters of this worker since it started: reads per single-flight route
+    and how many of them joined a call already in flight, the state of the
+    concurrency limiter, requests stopped by their deadline or by the client
+    going away, and budget alerts queued and delivered.
+    """
+    return Metrics(
+        singleflight={
+            flight.name: FlightStats(calls=flight.calls, coalesced=flight.coalesced)
+            for flight in flights
+        },
+        limiter=LimiterStats(
+            limit=limiter.limit,
+            in_flight=limiter.in_flight,
+            queued=limiter.queued,
+            shed=limiter.shed,
+            priority=limiter.priority,
+        ),
+        deadlines=DeadlineStats(
+            timed_out=deadlines.stats.timed_out,
+            disconnected=deadlines.stats.disconnected,
+        ),
+        alerts=AlertStats(
+            queued=alerts.stats.queued,
+            delivered=alerts.stats.delivered,
+            retried=alerts.stats.retried,
+            failed=alerts.stats.failed,
+        ),
+    )
@@ -0,0 +1,33 @@
+from pydantic import BaseModel
+
+
+class FlightStats(BaseModel):
+    calls: int
+    coalesced: int
+
+
+class LimiterStats(BaseModel):
+    limit: float
+    in_flight: int
+    queued: int
+    shed: int
+    priority: int
+
+
+class DeadlineStats(BaseModel):
+    timed_out: int
+    disconnected: int
+
+
+class AlertStats(BaseModel):
+    queued: int
+    delivered: int
+    retried: int
+    failed: int
+
+
+class Metrics(BaseModel):
+    singleflight: dict[str, FlightStats]
+    limiter: LimiterStats
+    deadlines: DeadlineStats
+    alerts: AlertStats
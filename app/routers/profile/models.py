@@ -0,0 +1,11 @@
+from pydantic import BaseModel
+
+from app.models import Currency
+
+
+class Profile(BaseModel):
+    base_currency: str
+
+
+class ProfileUpdate(BaseModel):
+    base_currency: Currency
@@ -0,0 +1,73 @@
+from typing import Annotated
+
+from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+
+from app.auth import validate_access
+from app.models import GenericException
+from app.settings import settings
+from app.utilities.cache import invalidate_user
+from app.utilities.fx import fx_rates
+from app.utilities.money import base_currency
+from app.utilities.profiles import profile_store
+from app.utilities.responses import NegotiatedRoute
+from app.utilities.spending import invalidate_spending
+
+from .models import Profile, ProfileUpdate
+
+router = APIRouter(
+    prefix="/v1/profile",
+    tags=["profile"],
+    route_class=NegotiatedRoute,
+    responses={
+        status.HTTP_401_UNAUTHORIZED: {
+            "description": "Unauthorized",
+            "model": GenericException,
+        }
+    },
+)
+
+security = HTTPBearer()
+
+
+@router.get("", response_model=Profile)
+async def get_profile(
+    credentials: Annotated[HTTPAuthorizationCredentials, Depends(security)],
+    user_id: Annotated[None | str, Depends(validate_access)],
+) -> Profile:
+    """
+    Get the user's settings.
+    """
+    return Profile(base_currency=await base_currency(user_id))
+
+
+@router.patch(
+    "",
+    response_model=Profile,
+    responses={
+        status.HTTP_422_UNPROCESSABLE_ENTITY: {
+            "description": "No exchange rates for the currency.",
+            "model": GenericException,
+        },
+    },
+)
+async def update_profile(
+    credentials: Annotated[HTTPAuthorizationCredentials, Depends(security)],
+    user_id: Annotated[None | str, Depends(validate_access)],
+    profile_update: ProfileUpdate,
+) -> Profile:
+    """
+    Change the currency reports are in.
+    """
+    currency = profile_update.base_currency
+    if currency != settings.default_currency and not fx_rates.knows(currency):
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail="No exchange rates for the currency.",
+        )
+
+    await profile_store().set_base_currency(user_id, currency)
+    invalidate_user(user_id)
+    invalidate_spending(user_id)
+
+    return Profile(base_currency=currency)
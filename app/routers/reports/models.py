@@ -0,0 +1,56 @@
+from datetime import date, datetime
+from typing import Any, Literal, Optional
+
+from pydantic import BaseModel
+
+
+class CategoryForecast(BaseModel):
+    category: str
+    spent: float
+    daily_mean_7: float
+    daily_mean_30: float
+    seasonality: float
+    projected: float
+    budget: Optional[float] = None
+    projected_over_budget: Optional[float] = None
+
+
+class Forecast(BaseModel):
+    as_of: date
+    month: str
+    currency: str
+    spent: float
+    projected: float
+    budget: float
+    categories: list[CategoryForecast]
+
+
+class Balance(BaseModel):
+    collection: str
+    currency: str
+    total: float
+    amount_minor: int
+    saved: float = 0
+    saved_minor: int = 0
+
+
+class BalanceReport(BaseModel):
+    at: datetime
+    snapshot_at: datetime
+    replayed: int
+    balances: list[Balance]
+
+
+Collection = Literal["expenses", "bills", "budgets", "wishlists"]
+
+
+class Change(BaseModel):
+    id: str
+    collection: Collection
+    entity_id: str
+    op: Literal["create", "update", "delete"]
+    user_id: Optional[str] = None
+    ledger_id: Optional[str] = None
+    at: datetime
+    before: Optional[dict[str, Any]] = None
+    after: Optional[dict[str, Any]] = None
@@ -0,0 +1,315 @@
+import asyncio
+from dataclasses import asdict
+from datetime import datetime, timezone
+from typing import Annotated, Any, Optional
+
+import bson
+import numpy as np
+from anyio.to_thread import run_sync
+from bson import ObjectId
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+
+from app.auth import resolve_access, validate_access
+from app.models import Currency, GenericException, as_utc
+from app.routers.jobs.models import JobCreateResult
+from app.settings import settings
+from app.utilities.balances import NoHistory, balance_at
+from app.utilities.cache import UserCache
+from app.utilities.changes import change_log
+from app.utilities.forecast import (
+    Columns,
+    encode,
+    epoch_days,
+    project_month,
+    year_totals,
+)
+from app.utilities.fx import UnknownCurrency, fx_rates
+from app.utilities.jobs import JobContext, job_handler, runner
+from app.utilities.ledgers import Access
+from app.utilities.money import amount_of, base_currency, from_minor
+from app.utilities.responses import NegotiatedRoute
+from app.utilities.spending import load_budgets
+from app.utilities.transactions import transaction_store
+
+from .models import (
+    Balance,
+    BalanceReport,
+    CategoryForecast,
+    Change,
+    Collection,
+    Forecast,
+)
+
+router = APIRouter(
+    prefix="/v1/reports",
+    tags=["reports"],
+    route_class=NegotiatedRoute,
+    responses={
+        status.HTTP_401_UNAUTHORIZED: {
+            "description": "Unauthorized",
+            "model": GenericException,
+        }
+    },
+)
+
+security = HTTPBearer()
+
+stores = [transaction_store("expenses"), transaction_store("bills")]
+
+forecasts: UserCache[Forecast] = UserCache(max_users=settings.report_cache_users)
+
+
+async def load_columns(
+    user_id: str | None, currency: str, since: datetime | None = None
+) -> Columns:
+    """
+    A user's expenses and bills as columns, reading only the fields needed,
+    all of them or those from a date on.
+
+    Totals are converted to one currency at the rate of their day.
+    """
+    created_at = []
+    amounts = []
+    currencies = []
+    categories = []
+    fields = ["created_at", "total", "amount_minor", "currency", "category"]
+    for store in stores:
+        async for doc in store.project(user_id, fields, since):
+            amount_minor, doc_currency = amount_of(doc)
+            created_at.append(doc["created_at"])
+            amounts.append(amount_minor)
+            currencies.append(doc_currency)
+            categories.append(doc.get("category") or "")
+
+    days = epoch_days(created_at)
+    currency_codes, currency_names = encode(currencies)
+    totals = fx_rates.convert(
+        np.fromiter(amounts, dtype=np.int64, count=len(amounts)),
+        currency_codes,
+        currency_names,
+        days,
+        currency,
+    )
+    category_codes, category_names = encode(categories)
+
+    return Columns(
+        days=days, totals=totals, categories=category_codes, names=category_names
+    )
+
+
+def no_rate(e: UnknownCurrency) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(e)
+    )
+
+
+@router.get("/forecast", response_model=Forecast)
+async def get_forecast(
+    credentials: Annotated[HTTPAuthorizationCredentials, Depends(security)],
+    user_id: Annotated[None | str, Depends(validate_access)],
+    currency: Optional[Currency] = None,
+) -> Forecast:
+    """
+    Project this month's spending per category against budgets, in the user's
+    base currency unless another is asked for.
+
+    Results are cached until the user's next write.
+    """
+    today = datetime.now(timezone.utc).date()
+    currency = currency or await base_currency(user_id)
+    cached = forecasts.get(user_id)
+    if cached is not None and cached.as_of == today and cached.currency == currency:
+        return cached
+
+    generation = forecasts.generation(user_id)
+    try:
+        columns, budgets = await asyncio.gather(
+            load_columns(user_id, currency), load_budgets(user_id, currency)
+        )
+    except UnknownCurrency as e:
+        raise no_rate(e)
+    projections = await run_sync(project_month, columns, budgets, today)
+
+    categories = [
+        CategoryForecast(
+            **asdict(projection),
+            projected_over_budget=(
+                projection.projected - projection.budget
+                if projection.budget is not None
+                else None
+            ),
+        )
+        for projection in projections
+    ]
+    forecast = Forecast(
+        as_of=today,
+        month=today.strftime("%Y-%m"),
+        currency=currency,
+        spent=sum(category.spent for category in categories),
+        projected=sum(category.projected for category in categories),
+        budget=sum(budgets.values()),
+        categories=categories,
+    )
+    forecasts.set(user_id, forecast, generation)
+
+    return forecast
+
+
+@job_handler("year_report")
+async def year_report(job: JobContext) -> dict[str, Any]:
+    """
+    Totals per category and month of a calendar year.
+    """
+    year = job.params["year"]
+    currency = job.params.get("currency") or await base_currency(job.user_id)
+    columns = await load_columns(
+        job.user_id, currency, datetime(year, 1, 1, tzinfo=timezone.utc)
+    )
+    await job.progress(1, 2)
+    categories = await job.run_cpu(year_totals, columns, year)
+    await job.progress(2, 2)
+
+    return {
+        "year": year,
+        "currency": currency,
+        "total": sum(category.total for category in categories),
+        "categories": [asdict(category) for category in categories],
+    }
+
+
+@router.post(
+    "/year",
+    response_model=JobCreateResult,
+    status_code=status.HTTP_202_ACCEPTED,
+)
+async def create_year_report(
+    credentials: Annotated[HTTPAuthorizationCredentials, Depends(security)],
+    user_id: Annotated[None | str, Depends(validate_access)],
+    year: Annotated[int, Query(ge=1970, le=9999)],
+    currency: Optional[Currency] = None,
+) -> JobCreateResult:
+    """
+    Start building a year-end report, the result is on the job.
+    """
+    job_id = await runner.submit(
+        user_id, "year_report", {"year": year, "currency": currency}
+    )
+
+    return JobCreateResult(id=str(job_id))
+
+
+def no_change_log() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_404_NOT_FOUND, detail="Change log is disabled."
+    )
+
+
+@router.get(
+    "/balance",
+    response_model=BalanceReport,
+    responses={
+        status.HTTP_404_NOT_FOUND: {
+            "description": "Change log is disabled, No balance history then.",
+            "model": GenericException,
+        },
+    },
+)
+async def get_balance(
+    credentials: Annotated[HTTPAuthorizationCredentials, Depends(security)],
+    user_id: Annotated[None | str, Depends(validate_access)],
+    at: Optional[datetime] = None,
+) -> BalanceReport:
+    """
+    Amounts of expenses, bills, budgets and wishlists per currency at a time,
+    now unless another is asked for, replayed from the change log.
+    """
+    if change_log() is None:
+        raise no_change_log()
+
+    try:
+        result = await balance_at(user_id, as_utc(at) if at else None)
+    except NoHistory as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
+
+    return BalanceReport(
+        at=result.at,
+        snapshot_at=result.snapshot_at,
+        replayed=result.replayed,
+        balances=[
+            Balance(
+                **row,
+                total=from_minor(row["amount_minor"], row["currency"]),
+                saved=from_minor(row["saved_minor"], row["currency"]),
+            )
+            for row in result.balances
+        ],
+    )
+
+
+def plain(doc: dict[str, Any] | None) -> dict[str, Any] | None:
+    """
+    A logged document with its ids as strings.
+    """
+    if doc is None:
+        return None
+
+    return {
+        field: str(value) if isinstance(value, ObjectId) else value
+        for field, value in doc.items()
+    }
+
+
+@router.get(
+    "/changes",
+    response_model=list[Change],
+    responses={
+        status.HTTP_400_BAD_REQUEST: {
+            "description": "Invalid entity id format.",
+            "model": GenericException,
+        },
+        status.HTTP_404_NOT_FOUND: {
+            "description": "Change log is disabled.",
+            "model": GenericException,
+        },
+    },
+)
+async def get_changes(
+    credentials: Annotated[HTTPAuthorizationCredentials, Depends(security)],
+    user_id: Annotated[None | str, Depends(validate_access)],
+    access: Annotated[Access, Depends(resolve_access)],
+    collection: Optional[Collection] = None,
+    entity_id: Optional[str] = None,
+    limit: Annotated[int, Query(ge=1, le=settings.change_history_limit)] = 100,
+) -> list[Change]:
+    """
+    Creates, updates and deletes of documents in the user's ledgers, newest
+    first, optionally of one collection or document.
+    """
+    log = change_log()
+    if log is None:
+        raise no_change_log()
+
+    try:
+        entity_object_id = ObjectId(entity_id) if entity_id else None
+    except bson.errors.InvalidId:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid entity id format."
+        )
+
+    return [
+        Change(
+            id=str(doc["_id"]),
+            collection=doc["collection"],
+            entity_id=str(doc["entity_id"]),
+            op=doc["op"],
+            user_id=doc.get("user_id"),
+            ledger_id=doc.get("ledger_id"),
+            at=as_utc(doc["at"]),
+            before=plain(doc.get("before")),
+            after=plain(doc.get("after")),
+        )
+        for doc in await log.history(
+            access.readable, collection, entity_object_id, limit
+        )
+    ]
@@ -0,0 +1,26 @@
+from datetime import datetime
+from typing import Literal, Optional
+
+from pydantic import BaseModel
+
+
+class SearchHit(BaseModel):
+    kind: Literal["expense", "bill", "budget", "wishlist"]
+    id: str
+    score: float
+    title: str
+    category: str
+    total: float
+    currency: Optional[str] = None
+    created_at: datetime
+
+
+class SearchResult(BaseModel):
+    hits: list[SearchHit]
+    page: int
+    page_size: int
+    partial: list[str]
+
+
+class SuggestResult(BaseModel):
+    suggestions: list[str]
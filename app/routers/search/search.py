@@ -0,0 +1,121 @@
+import asyncio
+from typing import Annotated, Any, Literal
+
+from fastapi import APIRouter, Depends, Query, status
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+
+from app.auth import validate_access
+from app.models import GenericException
+from app.settings import settings
+from app.utilities.log import logger
+from app.utilities.responses import NegotiatedRoute
+from app.utilities.suggestions import suggestions
+from app.utilities.transactions import plan_store, transaction_store
+
+from .models import SearchHit, SearchResult, SuggestResult
+
+router = APIRouter(
+    prefix="/v1/search",
+    tags=["search"],
+    route_class=NegotiatedRoute,
+    responses={
+        status.HTTP_401_UNAUTHORIZED: {
+            "description": "Unauthorized",
+            "model": GenericException,
+        }
+    },
+)
+
+security = HTTPBearer()
+
+stores = {
+    "expense": transaction_store("expenses"),
+    "bill": transaction_store("bills"),
+    "budget": plan_store("budgets"),
+    "wishlist": plan_store("wishlists"),
+}
+
+
+def to_hit(kind: Any, doc: Any) -> SearchHit:
+    return SearchHit(
+        kind=kind,
+        id=str(doc.get("_id")),
+        score=doc.get("score"),
+        title=doc.get("place") or doc.get("name"),
+        category=doc.get("category"),
+        total=doc.get("total"),
+        currency=doc.get("currency"),
+        created_at=doc.get("created_at"),
+    )
+
+
+async def search_kind(
+    kind: str, user_id: str | None, q: str, limit: int
+) -> list[SearchHit]:
+    """
+    Ranked text matches of one kind of document.
+    """
+    docs = await stores[kind].search(user_id, q, limit)
+
+    return [to_hit(kind, doc) for doc in docs]
+
+
+@router.get("", response_model=SearchResult)
+async def search(
+    credentials: Annotated[HTTPAuthorizationCredentials, Depends(security)],
+    user_id: Annotated[None | str, Depends(validate_access)],
+    q: Annotated[str, Query(min_length=1, max_length=200)],
+    page: Annotated[int, Query(ge=1, le=50)] = 1,
+    page_size: Annotated[int, Query(ge=1, le=100)] = 20,
+) -> SearchResult:
+    """
+    Search expenses and bills by place and category, budgets and wishlists by
+    name and category.
+
+    Collections that miss the latency budget are left out and listed in
+    `partial`.
+    """
+    limit = page * page_size
+    kinds = list(stores)
+    tasks = {
+        kind: asyncio.create_task(search_kind(kind, user_id, q, limit))
+        for kind in kinds
+    }
+    await asyncio.wait(tasks.values(), timeout=settings.search_timeout_ms / 1000)
+
+    hits: list[SearchHit] = []
+    partial: list[str] = []
+    for kind, task in tasks.items():
+        if not task.done():
+            task.cancel()
+            partial.append(kind)
+        elif task.exception() is not None:
+            logger.warning("Search of %s failed: %s", kind, task.exception())
+            partial.append(kind)
+        else:
+            hits.extend(task.result())
+
+    hits.sort(key=lambda hit: (hit.score, hit.created_at), reverse=True)
+
+    return SearchResult(
+        hits=hits[(page - 1) * page_size : limit],
+        page=page,
+        page_size=page_size,
+        partial=partial,
+    )
+
+
+@router.get("/suggest", response_model=SuggestResult)
+async def suggest(
+    credentials: Annotated[HTTPAuthorizationCredentials, Depends(security)],
+    user_id: Annotated[None | str, Depends(validate_access)],
+    prefix: Annotated[str, Query(min_length=1, max_length=100)],
+    field: Literal["place", "category"] = "place",
+    limit: Annotated[int, Query(ge=1, le=50)] = 10,
+) -> SuggestResult:
+    """
+    Autocomplete places and categories, most used first.
+    """
+    return SuggestResult(
+        suggestions=await suggestions.complete(user_id, field, prefix, limit)
+    )
@@ -1,13 +1,20 @@
 from datetime import datetime
 from typing import Optional
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+
+from app.models import Currency
 
 
 class Wishlist(BaseModel):
     id: str
     user_id: str
+    ledger_id: Optional[str] = None
     total: float
+    currency: Optional[str] = None
+    amount_minor: Optional[int] = None
+    saved: float = 0
+    saved_minor: int = 0
     category: str
     name: str
     created_at: datetime
@@ -16,12 +23,14 @@ class Wishlist(BaseModel):
 
 class WishlistCreate(BaseModel):
     total: float
+    currency: Optional[Currency] = None
     name: str
     category: str
 
 
 class WishlistUpdate(BaseModel):
     total: Optional[float] = None
+    currency: Optional[Currency] = None
     category: Optional[str] = None
     name: Optional[str] = None
 
@@ -32,3 +41,34 @@ class WishlistCreatResult(BaseModel):
 
 class WishlistSuccessResult(BaseModel):
     success: bool
+
+
+class WishlistContribution(BaseModel):
+    """
+    Amount put towards a wishlist in its currency, negative to take some out.
+    """
+
+    amount: float = Field(allow_inf_nan=False)
+
+
+class WishlistContributionEntry(BaseModel):
+    amount: float
+    saved: float
+    currency: str
+    user_id: Optional[str] = None
+    created_at: datetime
+
+
+class WishlistProgress(BaseModel):
+    id: str
+    name: str
+    currency: str
+    total: float
+    saved: float
+    remaining: float
+    progress: float
+
+
+class WishlistProgressSummary(BaseModel):
+    wishlists: list[WishlistProgress]
+    completed: int
@@ -6,19 +6,39 @@ from bson import ObjectId
 from fastapi import (
     APIRouter,
     Depends,
+    Header,
     HTTPException,
+    Query,
     status,
 )
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 
-from app.auth import validate_access
-from app.models import GenericException
-from app.utilities.clients import db
+from app.auth import resolve_access, validate_access
+from app.models import CategoryFilters, GenericException
+from app.utilities.cache import SingleFlight, invalidate_user
+from app.utilities.contributions import contributions, record_contribution
+from app.utilities.idempotency import idempotency_slot
+from app.utilities.ledgers import Access
+from app.utilities.money import (
+    amount_of,
+    from_minor,
+    to_minor,
+    with_money,
+    with_money_update,
+)
+from app.utilities.responses import NegotiatedRoute
+from app.utilities.stores.base import Document, find_all
+from app.utilities.suggestions import suggestions
+from app.utilities.transactions import plan_store
 
 from .models import (
     Wishlist,
+    WishlistContribution,
+    WishlistContributionEntry,
     WishlistCreate,
     WishlistCreatResult,
+    WishlistProgress,
+    WishlistProgressSummary,
     WishlistSuccessResult,
     WishlistUpdate,
 )
@@ -26,6 +46,7 @@ from .models import (
 router = APIRouter(
     prefix="/v1/wishlists",
     tags=["wishlists"],
+    route_class=NegotiatedRoute,
     responses={
         status.HTTP_401_UNAUTHORIZED: {
             "description": "Unauthorized",
@@ -36,23 +57,60 @@ router = APIRouter(
 
 security = HTTPBearer()
 
+store = plan_store("wishlists")
+list_flight: SingleFlight[list[Document]] = SingleFlight("wishlists.list")
+get_flight: SingleFlight[Document | None] = SingleFlight("wishlists.get")
+
+
+def saved_of(doc: Document) -> float:
+    return from_minor(doc.get("saved_minor", 0), amount_of(doc)[1])
+
+
+def to_progress(doc: Document) -> WishlistProgress:
+    """
+    How far a wishlist's savings are towards its total.
+    """
+    amount_minor, currency = amount_of(doc)
+    saved_minor = doc.get("saved_minor", 0)
+    return WishlistProgress(
+        id=str(doc.get("_id")),
+        name=doc.get("name"),
+        currency=currency,
+        total=from_minor(amount_minor, currency),
+        saved=from_minor(saved_minor, currency),
+        remaining=from_minor(max(0, amount_minor - saved_minor), currency),
+        progress=saved_minor / amount_minor if amount_minor > 0 else 1.0,
+    )
+
 
 @router.get("", response_model=list[Wishlist])
 async def get_wishlists(
     credentials: Annotated[HTTPAuthorizationCredentials, Depends(security)],
     user_id: Annotated[None | str, Depends(validate_access)],
+    access: Annotated[Access, Depends(resolve_access)],
+    filters: Annotated[CategoryFilters, Query()],
 ) -> list[Wishlist]:
     """
     Get gas wishlists.
     """
     results = []
-    async for doc in db.wishlists.find({"user_id": user_id}):
+    docs = await list_flight.run(
+        user_id,
+        (tuple(access.readable), filters.model_dump_json()),
+        lambda: find_all(store, access.readable, filters),
+    )
+    for doc in docs:
 
         results.append(
             Wishlist(
                 id=str(doc.get("_id")),
                 user_id=doc.get("user_id"),
+                ledger_id=doc.get("ledger_id"),
                 total=doc.get("total"),
+                currency=doc.get("currency"),
+                amount_minor=doc.get("amount_minor"),
+                saved=saved_of(doc),
+                saved_minor=doc.get("saved_minor", 0),
                 category=doc.get("category"),
                 name=doc.get("name"),
                 updated_at=doc.get("updated_at"),
@@ -63,6 +121,29 @@ async def get_wishlists(
     return results
 
 
+@router.get("/progress", response_model=WishlistProgressSummary)
+async def get_wishlist_progress(
+    credentials: Annotated[HTTPAuthorizationCredentials, Depends(security)],
+    user_id: Annotated[None | str, Depends(validate_access)],
+    access: Annotated[Access, Depends(resolve_access)],
+) -> WishlistProgressSummary:
+    """
+    Savings progress of every wishlist, read straight from the wishlists.
+    """
+    filters = CategoryFilters()
+    docs = await list_flight.run(
+        user_id,
+        (tuple(access.readable), filters.model_dump_json()),
+        lambda: find_all(store, access.readable, filters),
+    )
+    wishlists = [to_progress(doc) for doc in docs]
+
+    return WishlistProgressSummary(
+        wishlists=wishlists,
+        completed=sum(wishlist.progress >= 1 for wishlist in wishlists),
+    )
+
+
 @router.get(
     "/{wishlist_id}",
     response_model=Wishlist,
@@ -80,6 +161,7 @@ async def get_wishlists(
 async def get_wishlist(
     credentials: Annotated[HTTPAuthorizationCredentials, Depends(security)],
     user_id: Annotated[None | str, Depends(validate_access)],
+    access: Annotated[Access, Depends(resolve_access)],
     wishlist_id: str,
 ) -> Wishlist:
     """
@@ -93,7 +175,11 @@ async def get_wishlist(
             detail="Invalid wishlist id format.",
         )
 
-    doc = await db.wishlists.find_one({"_id": wishlist_object_id, "user_id": user_id})
+    doc = await get_flight.run(
+        user_id,
+        (tuple(access.readable), wishlist_object_id),
+        lambda: store.find_one(access.readable, wishlist_object_id),
+    )
     if not doc:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Wishlist not found."
@@ -102,7 +188,12 @@ async def get_wishlist(
     return Wishlist(
         id=str(doc.get("_id")),
         user_id=doc.get("user_id"),
+        ledger_id=doc.get("ledger_id"),
         total=doc.get("total"),
+        currency=doc.get("currency"),
+        amount_minor=doc.get("amount_minor"),
+        saved=saved_of(doc),
+        saved_minor=doc.get("saved_minor", 0),
         category=doc.get("category"),
         name=doc.get("name"),
         updated_at=doc.get("updated_at"),
@@ -117,19 +208,36 @@ async def get_wishlist(
 async def add_wishlist(
     credentials: Annotated[HTTPAuthorizationCredentials, Depends(security)],
     user_id: Annotated[None | str, Depends(validate_access)],
+    access: Annotated[Access, Depends(resolve_access)],
     new_wishlist: WishlistCreate,
+    ledger_id: Annotated[str | None, Query()] = None,
+    idempotency_key: Annotated[str | None, Header(max_length=255)] = None,
 ) -> WishlistCreatResult:
     """
     Add a wishlist.
     """
 
-    data = new_wishlist.model_dump() | {
-        "user_id": user_id,
-        "created_at": datetime.now(timezone.utc),
-    }
-    create_result = await db.wishlists.insert_one(data)
+    ledger_id = access.ledger(ledger_id)
+    async with idempotency_slot(
+        user_id, "wishlists", idempotency_key, new_wishlist, ledger_id
+    ) as slot:
+        if slot.result:
+            return WishlistCreatResult(**slot.result)
+
+        data = with_money(new_wishlist.model_dump()) | {
+            "saved_minor": 0,
+            "user_id": user_id,
+            "ledger_id": ledger_id,
+            "created_at": datetime.now(timezone.utc),
+        }
+        inserted_id = await store.insert_one(data)
+        suggestions.record(user_id, data)
+        invalidate_user(user_id)
 
-    return WishlistCreatResult(id=str(create_result.inserted_id))
+        result = WishlistCreatResult(id=str(inserted_id))
+        await slot.save(result.model_dump())
+
+    return result
 
 
 @router.delete(
@@ -149,6 +257,7 @@ async def add_wishlist(
 async def delete_wishlist(
     credentials: Annotated[HTTPAuthorizationCredentials, Depends(security)],
     user_id: Annotated[None | str, Depends(validate_access)],
+    access: Annotated[Access, Depends(resolve_access)],
     wishlist_id: str,
 ) -> WishlistSuccessResult:
     """
@@ -163,14 +272,20 @@ async def delete_wishlist(
             detail="Invalid wishlist id format.",
         )
 
-    delete_result = await db.wishlists.delete_one(
-        {"_id": wishlist_object_id, "user_id": user_id}
+    doc = (
+        await store.find_one(access.writable, wishlist_object_id)
+        if suggestions.tracks()
+        else None
     )
-    if delete_result.deleted_count == 0:
+    deleted = await store.delete_one(access.writable, wishlist_object_id)
+    if not deleted:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Wishlist not found",
         )
+    if doc:
+        suggestions.forget(doc["user_id"], doc)
+    invalidate_user(user_id)
 
     return WishlistSuccessResult(success=True)
 
@@ -192,6 +307,7 @@ async def delete_wishlist(
 async def update_wishlist(
     credentials: Annotated[HTTPAuthorizationCredentials, Depends(security)],
     user_id: Annotated[None | str, Depends(validate_access)],
+    access: Annotated[Access, Depends(resolve_access)],
     wishlist_id: str,
     wishlist_update: WishlistUpdate,
 ) -> WishlistSuccessResult:
@@ -210,13 +326,156 @@ async def update_wishlist(
     update_data = wishlist_update.model_dump(exclude_unset=True) | {
         "updated_at": datetime.now(timezone.utc)
     }
-    update_result = await db.wishlists.update_one(
-        {"_id": wishlist_object_id, "user_id": user_id}, {"$set": update_data}
-    )
-
-    if update_result.matched_count == 0:
+    doc = None
+    if (
+        "total" in update_data
+        or "currency" in update_data
+        or suggestions.tracks(update_data)
+    ):
+        doc = await store.find_one(access.writable, wishlist_object_id)
+    if doc and ("total" in update_data or "currency" in update_data):
+        update_data = with_money_update(update_data, doc)
+        if doc.get("saved_minor") and update_data["currency"] != amount_of(doc)[1]:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="Wishlist has savings in its current currency.",
+            )
+    updated = await store.update_one(access.writable, wishlist_object_id, update_data)
+    if not updated:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Wishlist not found."
         )
+    if doc:
+        suggestions.forget(doc["user_id"], doc, update_data)
+        suggestions.record(doc["user_id"], update_data)
+    invalidate_user(user_id)
 
     return WishlistSuccessResult(success=True)
+
+
+@router.post(
+    "/{wishlist_id}/contributions",
+    response_model=WishlistProgress,
+    responses={
+        status.HTTP_400_BAD_REQUEST: {
+            "description": "Invalid wishlist id format.",
+            "model": GenericException,
+        },
+        status.HTTP_404_NOT_FOUND: {
+            "description": "Wishlist not found.",
+            "model": GenericException,
+        },
+        status.HTTP_409_CONFLICT: {
+            "description": "Not enough saved to take out.",
+            "model": GenericException,
+        },
+    },
+)
+async def add_contribution(
+    credentials: Annotated[HTTPAuthorizationCredentials, Depends(security)],
+    user_id: Annotated[None | str, Depends(validate_access)],
+    access: Annotated[Access, Depends(resolve_access)],
+    wishlist_id: str,
+    contribution: WishlistContribution,
+    idempotency_key: Annotated[str | None, Header(max_length=255)] = None,
+) -> WishlistProgress:
+    """
+    Put money towards a wishlist, or take some out, and get its new progress.
+
+    The saved amount is changed in one atomic update, so concurrent
+    contributions all count. Each one is also added to the wishlist's log.
+    """
+    try:
+        wishlist_object_id = ObjectId(wishlist_id)
+    except bson.errors.InvalidId:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid wishlist id format.",
+        )
+
+    async with idempotency_slot(
+        user_id,
+        f"wishlist_contributions:{wishlist_object_id}",
+        idempotency_key,
+        contribution,
+    ) as slot:
+        if slot.result:
+            return WishlistProgress(**slot.result)
+
+        doc = await store.find_one(access.writable, wishlist_object_id)
+        if not doc:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND, detail="Wishlist not found."
+            )
+
+        now = datetime.now(timezone.utc)
+        amount_minor = to_minor(contribution.amount, amount_of(doc)[1])
+        doc = await store.increment(
+            access.writable,
+            wishlist_object_id,
+            "saved_minor",
+            amount_minor,
+            {"updated_at": now},
+        )
+        if not doc:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="Not enough saved to take out.",
+            )
+        await record_contribution(doc, user_id, amount_minor, now)
+        invalidate_user(user_id)
+
+        result = to_progress(doc)
+        await slot.save(result.model_dump())
+
+    return result
+
+
+@router.get(
+    "/{wishlist_id}/contributions",
+    response_model=list[WishlistContributionEntry],
+    responses={
+        status.HTTP_400_BAD_REQUEST: {
+            "description": "Invalid wishlist id format.",
+            "model": GenericException,
+        },
+        status.HTTP_404_NOT_FOUND: {
+            "description": "Wishlist not found.",
+            "model": GenericException,
+        },
+    },
+)
+async def get_contributions(
+    credentials: Annotated[HTTPAuthorizationCredentials, Depends(security)],
+    user_id: Annotated[None | str, Depends(validate_access)],
+    access: Annotated[Access, Depends(resolve_access)],
+    wishlist_id: str,
+) -> list[WishlistContributionEntry]:
+    """
+    Get the contributions to a wishlist, newest first.
+    """
+    try:
+        wishlist_object_id = ObjectId(wishlist_id)
+    except bson.errors.InvalidId:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid wishlist id format.",
+        )
+
+    doc = await store.find_one(access.readable, wishlist_object_id)
+    if not doc:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Wishlist not found."
+        )
+
+    currency = amount_of(doc)[1]
+    return [
+        WishlistContributionEntry(
+            amount=from_minor(entry["amount_minor"], currency),
+            saved=from_minor(entry["saved_minor"], currency),
+            currency=currency,
+            user_id=entry.get("user_id"),
+            created_at=entry["created_at"],
+        )
+        for entry in await contributions(wishlist_object_id)
+    ]
@@ -1,3 +1,5 @@
+from typing import Literal, Optional
+
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
@@ -13,6 +15,87 @@ class Settings(BaseSettings):
     )
     google_auth_sign_in_key: str
     testing: bool = False
+    mongo_min_pool_size: int = 10
+    mongo_max_pool_size: int = 100
+    serve_host: str = "127.0.0.1"
+    serve_port: int = 8000
+    serve_workers: Optional[int] = None
+    serve_loop: Literal["auto", "asyncio", "uvloop"] = "uvloop"
+    serve_http: Literal["auto", "h11", "httptools"] = "httptools"
+    serve_keep_alive_seconds: int = 75
+    serve_backlog: int = 2048
+    invalidation_socket_dir: Optional[str] = None
+    idempotency_ttl_seconds: int = 86400
+    idempotency_pending_timeout: int = 30
+    idempotency_cache_size: int = 10000
+    storage_backend: Literal["mongo", "memory", "sqlite"] = "mongo"
+    sqlite_path: str = "budget.db"
+    sqlite_pool_size: int = 4
+    sqlite_busy_timeout_ms: int = 5000
+    sqlite_cached_statements: int = 128
+    transaction_storage: Literal["document", "bucket"] = "document"
+    archive_after_days: Optional[int] = None
+    archive_batch_size: int = 1000
+    archive_zstd_level: int = 9
+    search_timeout_ms: int = 300
+    expense_write_batching: bool = False
+    write_batch_max_docs: int = 500
+    write_batch_max_delay_ms: int = 5
+    report_cache_users: int = 1000
+    bill_horizon_days: int = 120
+    bill_extend_slack_days: int = 7
+    bill_schedule_interval_seconds: int = 3600
+    job_workers: int = 4
+    job_process_workers: int = 2
+    job_heartbeat_seconds: int = 5
+    job_stale_seconds: int = 300
+    import_batch_size: int = 1000
+    import_max_errors: int = 100
+    import_max_record_chars: int = 1_000_000
+    token_cache_size: int = 10000
+    access_cache_users: int = 10000
+    access_cache_seconds: int = 60
+    default_currency: str = "USD"
+    fx_rates_path: Optional[str] = None
+    fx_quote_currency: str = "EUR"
+    batch_max_queries: int = 20
+    compression_min_bytes: int = 1024
+    compression_gzip_level: int = 6
+    compression_brotli_quality: int = 4
+    compression_zstd_level: int = 3
+    suggestion_cache_users: int = 1000
+    suggestion_ttl_seconds: int = 3600
+    limiter_initial_limit: int = 50
+    limiter_min_limit: int = 5
+    limiter_max_limit: int = 500
+    limiter_latency_target_ms: int = 250
+    limiter_backoff: float = 0.9
+    limiter_max_queue: int = 100
+    limiter_retry_after_seconds: int = 1
+    limiter_priority_paths: list[str] = ["/health", "/v1/auth/login"]
+    request_timeout_ms: int = 10000
+    route_timeouts_ms: dict[str, int] = {"/v1/reports": 30000}
+    # POST routes that only read, and get a budget like GETs.
+    read_paths: list[str] = ["/v1/batch"]
+    alert_webhook_url: Optional[str] = None
+    alert_thresholds: list[float] = [0.8, 1.0]
+    alert_cache_users: int = 10000
+    alert_batch_size: int = 100
+    alert_poll_seconds: float = 5
+    alert_timeout_seconds: float = 10
+    alert_lease_seconds: int = 60
+    alert_retry_base_seconds: float = 2
+    alert_retry_max_seconds: float = 3600
+    alert_max_attempts: int = 10
+    alert_retention_days: int = 90
+    change_log: bool = False
+    change_snapshot_every: int = 500
+    change_snapshot_interval_seconds: int = 300
+    change_settle_seconds: int = 60
+    change_history_limit: int = 1000
+    capture_path: Optional[str] = None
+    capture_sample_rate: float = 1.0
+    capture_user_buckets: int = 100
 
     model_config = SettingsConfigDict(env_file=".env", extra="ignore")
 
@@ -0,0 +1,506 @@
+import asyncio
+import contextlib
+import json
+import random
+import sqlite3
+from datetime import datetime, timedelta, timezone
+from typing import Any, Protocol
+
+import bson
+import httpx
+import orjson
+from bson import ObjectId
+from pymongo import ASCENDING
+from pymongo.errors import DuplicateKeyError
+
+from app.models import epoch_micros
+from app.settings import settings
+from app.utilities.clients import db
+from app.utilities.fx import UnknownCurrency
+from app.utilities.invalidation import bus
+from app.utilities.log import logger
+from app.utilities.spending import (
+    MonthSpending,
+    invalidate_spending,
+    load_month,
+    month_of,
+    totals,
+)
+from app.utilities.sqlite import SQLiteTables, decode
+
+# Fields of a transaction that move spending between categories or amounts.
+SPENDING_FIELDS = ("total", "currency", "category")
+
+
+class Outbox(Protocol):
+    """
+    Storage for alerts waiting to be delivered, kept for the configured
+    retention after they were queued.
+    """
+
+    async def queue(self, alert: dict[str, Any]) -> bool: ...
+
+    async def claim(
+        self, now: datetime, lease_until: datetime, limit: int
+    ) -> list[dict[str, Any]]: ...
+
+    async def settle(self, alert_id: ObjectId, fields: dict[str, Any]) -> None: ...
+
+    async def delivered(self, alert_ids: list[ObjectId], at: datetime) -> None: ...
+
+    async def create_indexes(self) -> None: ...
+
+
+class DocumentOutbox:
+    """
+    One MongoDB document per alert, removed by a TTL index.
+    """
+
+    def __init__(self) -> None:
+        self.collection = db.alert_outbox
+
+    async def queue(self, alert: dict[str, Any]) -> bool:
+        """
+        Queue an alert, False if it was queued before.
+        """
+        try:
+            await self.collection.insert_one(alert)
+        except DuplicateKeyError:
+            return False
+
+        return True
+
+    async def claim(
+        self, now: datetime, lease_until: datetime, limit: int
+    ) -> list[dict[str, Any]]:
+        """
+        Lease due alerts until a time, oldest due first.
+        """
+        due = {"status": "pending", "next_attempt_at": {"$lte": now}}
+        ids = [
+            doc["_id"]
+            async for doc in self.collection.find(due, {"_id": 1})
+            .sort("next_attempt_at", ASCENDING)
+            .limit(limit)
+        ]
+        if not ids:
+            return []
+
+        claim = ObjectId()
+        await self.collection.update_many(
+            due | {"_id": {"$in": ids}},
+            {"$set": {"claim": claim, "next_attempt_at": lease_until}},
+        )
+        return await self.collection.find({"claim": claim}).to_list(None)
+
+    async def settle(self, alert_id: ObjectId, fields: dict[str, Any]) -> None:
+        """
+        Set fields of a claimed alert and give up its lease.
+        """
+        await self.collection.update_one(
+            {"_id": alert_id}, {"$set": fields, "$unset": {"claim": ""}}
+        )
+
+    async def delivered(self, alert_ids: list[ObjectId], at: datetime) -> None:
+        await self.collection.update_many(
+            {"_id": {"$in": alert_ids}},
+            {
+                "$set": {"status": "delivered", "delivered_at": at},
+                "$unset": {"claim": ""},
+            },
+        )
+
+    async def create_indexes(self) -> None:
+        await self.collection.create_index(
+            [
+                ("user_id", ASCENDING),
+                ("month", ASCENDING),
+                ("category", ASCENDING),
+                ("threshold", ASCENDING),
+            ],
+            unique=True,
+        )
+        await self.collection.create_index(
+            [("status", ASCENDING), ("next_attempt_at", ASCENDING)]
+        )
+        await self.collection.create_index("claim", sparse=True)
+        await self.collection.create_index(
+            "created_at", expireAfterSeconds=settings.alert_retention_days * 86400
+        )
+
+
+class SQLiteOutbox(SQLiteTables):
+    """
+    One row per alert in a SQLite table, its document kept whole as BSON next
+    to copies of the fields alerts are looked up by. Alerts past their
+    retention are deleted when the next one is queued.
+    """
+
+    statements = (
+        "CREATE TABLE IF NOT EXISTS alert_outbox (id TEXT PRIMARY KEY,"
+        " user_id TEXT, month TEXT NOT NULL, category TEXT NOT NULL,"
+        " threshold REAL NOT NULL, status TEXT NOT NULL,"
+        " next_attempt_at INTEGER NOT NULL, created_at INTEGER NOT NULL,"
+        " doc BLOB NOT NULL, UNIQUE (user_id, month, category, threshold))",
+        "CREATE INDEX IF NOT EXISTS alert_outbox_due"
+        " ON alert_outbox (status, next_attempt_at)",
+        "CREATE INDEX IF NOT EXISTS alert_outbox_created ON alert_outbox (created_at)",
+    )
+
+    @staticmethod
+    def _update(
+        connection: sqlite3.Connection,
+        alert_ids: list[ObjectId],
+        fields: dict[str, Any],
+        unset: tuple[str, ...] = (),
+    ) -> list[dict[str, Any]]:
+        rows = connection.execute(
+            "SELECT doc FROM alert_outbox WHERE id IN (SELECT value FROM json_each(?))"
+            " ORDER BY next_attempt_at",
+            (json.dumps([str(alert_id) for alert_id in alert_ids]),),
+        ).fetchall()
+        alerts = []
+        for doc in (decode(doc) for doc, in rows):
+            alert = {
+                field: value for field, value in doc.items() if field not in unset
+            } | fields
+            connection.execute(
+                "UPDATE alert_outbox SET status = ?, next_attempt_at = ?, doc = ?"
+                " WHERE id = ?",
+                (
+                    alert["status"],
+                    epoch_micros(alert["next_attempt_at"]),
+                    bson.encode(alert),
+                    str(alert["_id"]),
+                ),
+            )
+            alerts.append(alert)
+        return alerts
+
+    async def queue(self, alert: dict[str, Any]) -> bool:
+        alert.setdefault("_id", ObjectId())
+        expired_before = alert["created_at"] - timedelta(
+            days=settings.alert_retention_days
+        )
+
+        def insert(connection: sqlite3.Connection) -> bool:
+            connection.execute(
+                "DELETE FROM alert_outbox WHERE created_at < ?",
+                (epoch_micros(expired_before),),
+            )
+            cursor = connection.execute(
+                "INSERT OR IGNORE INTO alert_outbox (id, user_id, month, category,"
+                " threshold, status, next_attempt_at, created_at, doc)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    str(alert["_id"]),
+                    alert["user_id"],
+                    alert["month"],
+                    alert["category"],
+                    alert["threshold"],
+                    alert["status"],
+                    epoch_micros(alert["next_attempt_at"]),
+                    epoch_micros(alert["created_at"]),
+                    bson.encode(alert),
+                ),
+            )
+            return cursor.rowcount > 0
+
+        return await self.write(insert)
+
+    async def claim(
+        self, now: datetime, lease_until: datetime, limit: int
+    ) -> list[dict[str, Any]]:
+        claim = ObjectId()
+
+        def claim_due(connection: sqlite3.Connection) -> list[dict[str, Any]]:
+            rows = connection.execute(
+                "SELECT id FROM alert_outbox WHERE status = 'pending'"
+                " AND next_attempt_at <= ? ORDER BY next_attempt_at LIMIT ?",
+                (epoch_micros(now), limit),
+            )
+            return self._update(
+                connection,
+                [ObjectId(alert_id) for alert_id, in rows],
+                {"claim": claim, "next_attempt_at": lease_until},
+            )
+
+        return await self.write(claim_due)
+
+    async def settle(self, alert_id: ObjectId, fields: dict[str, Any]) -> None:
+        await self.write(
+            lambda connection: self._update(
+                connection, [alert_id], fields, unset=("claim",)
+            )
+        )
+
+    async def delivered(self, alert_ids: list[ObjectId], at: datetime) -> None:
+        await self.write(
+            lambda connection: self._update(
+                connection,
+                alert_ids,
+                {"status": "delivered", "delivered_at": at},
+                unset=("claim",),
+            )
+        )
+
+
+document_outbox = DocumentOutbox()
+sqlite_outbox = SQLiteOutbox()
+
+
+def outbox() -> Outbox:
+    """
+    Get the alert outbox in the configured backend: in SQLite with the SQLite
+    backend, in MongoDB otherwise.
+    """
+    if settings.storage_backend == "sqlite":
+        return sqlite_outbox
+
+    return document_outbox
+
+
+class AlertStats:
+    queued = 0
+    delivered = 0
+    retried = 0
+    failed = 0
+
+
+stats = AlertStats()
+
+_wake = asyncio.Event()
+
+
+def alerts_enabled() -> bool:
+    return settings.alert_webhook_url is not None
+
+
+def affects_spending(update_data: dict[str, Any]) -> bool:
+    """
+    Whether an update needs the document as it was, to follow its spending.
+    """
+    return alerts_enabled() and any(field in update_data for field in SPENDING_FIELDS)
+
+
+async def queue_alerts(
+    user_id: str | None, spending: MonthSpending, categories: list[str]
+) -> None:
+    """
+    Put alerts for the thresholds some categories crossed into the outbox.
+
+    An alert is queued once per user, month, category and threshold, also
+    when several workers see the crossing.
+    """
+    now = datetime.now(timezone.utc)
+    for category in categories:
+        budget = spending.budgets.get(category)
+        if not budget or budget <= 0:
+            continue
+
+        spent = spending.spent.get(category, 0.0)
+        for threshold in sorted(settings.alert_thresholds):
+            key = (category, threshold)
+            if spent < budget * threshold or key in spending.alerted:
+                continue
+
+            if await outbox().queue(
+                {
+                    "user_id": user_id,
+                    "month": spending.month,
+                    "category": category,
+                    "threshold": threshold,
+                    "spent": spent,
+                    "budget": budget,
+                    "currency": spending.currency,
+                    "created_at": now,
+                    "status": "pending",
+                    "attempts": 0,
+                    "next_attempt_at": now,
+                }
+            ):
+                stats.queued += 1
+                _wake.set()
+            spending.alerted.add(key)
+
+
+async def record_spending(
+    before: dict[str, Any] | None, after: dict[str, Any] | None
+) -> None:
+    """
+    Follow a write to an expense or bill in its owner's running totals for
+    this month, and queue alerts for the budget thresholds it crosses.
+
+    `before` and `after` are the transaction as it was and as it is now, None
+    when it did not or no longer exists. Totals are loaded on a user's first
+    write of the month and then only updated, at which point every category
+    is checked.
+
+    The write has happened by then, so failures are logged, not raised.
+    """
+    doc = after or before
+    if not alerts_enabled() or doc is None:
+        return
+
+    user_id = doc.get("user_id")
+    month = month_of(datetime.now(timezone.utc))
+    generation = totals.bump(user_id)
+    try:
+        spending = totals.get(user_id, month)
+        if spending is None:
+            spending = await load_month(user_id, month)
+            totals.set(user_id, spending, generation)
+            categories = list(spending.budgets)
+        else:
+            spending.apply(
+                [
+                    (doc, sign)
+                    for doc, sign in ((before, -1), (after, 1))
+                    if doc is not None
+                ]
+            )
+            categories = [(after or {}).get("category") or ""]
+
+        await queue_alerts(user_id, spending, categories)
+    except UnknownCurrency as e:
+        logger.warning("No budget alerts for user %s: %s", user_id, e)
+    except Exception:
+        logger.exception("Evaluating budget alerts failed")
+    finally:
+        # Totals in other workers miss this write.
+        bus.publish("spending", [user_id])
+
+
+async def refresh_spending(user_id: str | None) -> None:
+    """
+    Load a user's totals again after a bulk write, like an import, and check
+    every category.
+    """
+    if not alerts_enabled():
+        return
+
+    invalidate_spending(user_id)
+    generation = totals.bump(user_id)
+    try:
+        spending = await load_month(user_id, month_of(datetime.now(timezone.utc)))
+        totals.set(user_id, spending, generation)
+        await queue_alerts(user_id, spending, list(spending.budgets))
+    except UnknownCurrency as e:
+        logger.warning("No budget alerts for user %s: %s", user_id, e)
+    except Exception:
+        logger.exception("Evaluating budget alerts failed")
+
+
+def retry_delay(attempts: int) -> timedelta:
+    """
+    Exponential backoff with jitter, so failed deliveries do not all come back
+    at once.
+    """
+    delay = min(
+        settings.alert_retry_max_seconds,
+        settings.alert_retry_base_seconds * 2 ** (attempts - 1),
+    )
+    return timedelta(seconds=delay * random.uniform(0.5, 1.0))
+
+
+def payload(alerts: list[dict[str, Any]]) -> bytes:
+    return orjson.dumps(
+        {
+            "alerts": [
+                {
+                    "id": str(alert["_id"]),
+                    "user_id": alert["user_id"],
+                    "month": alert["month"],
+                    "category": alert["category"],
+                    "threshold": alert["threshold"],
+                    "spent": alert["spent"],
+                    "budget": alert["budget"],
+                    "currency": alert["currency"],
+                    "created_at": alert["created_at"],
+                }
+                for alert in alerts
+            ]
+        }
+    )
+
+
+async def claim_batch() -> list[Any]:
+    """
+    Take due alerts off the outbox for a while, so other workers do not
+    deliver them too. Alerts of a worker that stops while delivering become
+    due again once the lease runs out.
+    """
+    now = datetime.now(timezone.utc)
+    return await outbox().claim(
+        now,
+        now + timedelta(seconds=settings.alert_lease_seconds),
+        settings.alert_batch_size,
+    )
+
+
+async def deliver_batch(client: httpx.AsyncClient) -> int:
+    """
+    Send one batch of due alerts to the webhook, and schedule a retry of the
+    batch if it was not accepted. Returns how many alerts were sent.
+    """
+    alerts = await claim_batch()
+    if not alerts:
+        return 0
+
+    assert settings.alert_webhook_url is not None
+    try:
+        response = await client.post(
+            settings.alert_webhook_url,
+            content=payload(alerts),
+            headers={"content-type": "application/json"},
+        )
+        error = None if response.is_success else f"status {response.status_code}"
+    except httpx.HTTPError as e:
+        error = str(e) or type(e).__name__
+
+    if error is not None:
+        logger.warning("Delivering %s alerts failed: %s", len(alerts), error)
+        now = datetime.now(timezone.utc)
+        for alert in alerts:
+            attempts = alert["attempts"] + 1
+            if attempts >= settings.alert_max_attempts:
+                stats.failed += 1
+                update: dict[str, Any] = {"status": "failed"}
+            else:
+                stats.retried += 1
+                update = {"next_attempt_at": now + retry_delay(attempts)}
+            await outbox().settle(alert["_id"], update | {"attempts": attempts})
+        return len(alerts)
+
+    await outbox().delivered(
+        [alert["_id"] for alert in alerts], datetime.now(timezone.utc)
+    )
+    stats.delivered += len(alerts)
+    return len(alerts)
+
+
+async def run_dispatcher() -> None:
+    """
+    Keep delivering queued alerts in batches, until cancelled.
+
+    Waits for alerts queued by this worker, or polls for ones queued by
+    others and for retries coming due.
+    """
+    async with httpx.AsyncClient(timeout=settings.alert_timeout_seconds) as client:
+        while True:
+            _wake.clear()
+            try:
+                sent = await deliver_batch(client)
+            except Exception:
+                logger.exception("Delivering alerts failed")
+                sent = 0
+
+            if sent == settings.alert_batch_size:
+                continue
+
+            with contextlib.suppress(TimeoutError):
+                await asyncio.wait_for(_wake.wait(), settings.alert_poll_seconds)
+
+
+async def create_indexes() -> None:
+    await outbox().create_indexes()
@@ -0,0 +1,461 @@
+import json
+import sqlite3
+from datetime import datetime, timedelta, timezone
+from typing import Any, AsyncIterator, Callable, Protocol, TypeVar
+
+import bson
+import zstandard
+from bson import CodecOptions, ObjectId
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import DuplicateKeyError
+
+from app.models import as_utc, epoch_micros
+from app.settings import settings
+from app.utilities import sqlite
+from app.utilities.clients import db
+from app.utilities.deadlines import max_time_ms
+from app.utilities.money import amount_of
+from app.utilities.sqlite import write_transaction
+
+T = TypeVar("T")
+
+# Fields projections can get from the daily rollups of a chunk.
+ROLLUP_FIELDS = {"created_at", "total", "amount_minor", "currency", "category"}
+
+# Chunk fields left out when only the rollups are read.
+BULK_FIELDS = ("data", "ids", "import_hashes")
+
+# Dates come back like the hot store has them, the memory store keeps their
+# time zone.
+CODEC_OPTIONS: CodecOptions[dict[str, Any]] = CodecOptions(
+    tz_aware=settings.storage_backend == "memory"
+)
+
+
+def month_start(when: datetime) -> datetime:
+    return as_utc(when).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def archive_cutoff() -> datetime:
+    """
+    Start of the oldest month kept in hot storage. Transactions before it are
+    archived, whole months at a time.
+    """
+    assert settings.archive_after_days is not None
+    return month_start(
+        datetime.now(timezone.utc) - timedelta(days=settings.archive_after_days)
+    )
+
+
+def pack(docs: list[dict[str, Any]], version: int = 0) -> dict[str, Any]:
+    """
+    A chunk of transactions of one user, ledger and month: the documents
+    compressed together, with their daily totals per category and currency
+    kept readable for reports.
+    """
+    days: dict[tuple[Any, ...], dict[str, Any]] = {}
+    for doc in docs:
+        amount_minor, currency = amount_of(doc)
+        day = as_utc(doc["created_at"]).replace(
+            hour=0, minute=0, second=0, microsecond=0
+        )
+        rollup = days.setdefault(
+            (day, doc.get("category"), currency),
+            {
+                "day": day,
+                "category": doc.get("category"),
+                "currency": currency,
+                "count": 0,
+                "total": 0.0,
+                "amount_minor": 0,
+            },
+        )
+        rollup["count"] += 1
+        rollup["total"] += doc.get("total") or 0
+        rollup["amount_minor"] += amount_minor
+
+    compressor = zstandard.ZstdCompressor(level=settings.archive_zstd_level)
+    return {
+        "user_id": docs[0].get("user_id"),
+        "ledger_id": docs[0].get("ledger_id"),
+        "month": month_start(docs[0]["created_at"]),
+        "version": version,
+        "count": len(docs),
+        "days": list(days.values()),
+        "ids": [doc["_id"] for doc in docs],
+        "import_hashes": [doc["import_hash"] for doc in docs if doc.get("import_hash")],
+        "data": bson.Binary(compressor.compress(bson.encode({"docs": docs}))),
+    }
+
+
+def unpack(chunk: dict[str, Any]) -> list[dict[str, Any]]:
+    docs: list[dict[str, Any]] = bson.decode(
+        zstandard.ZstdDecompressor().decompress(chunk["data"]), CODEC_OPTIONS
+    )["docs"]
+    return docs
+
+
+def rollup_rows(chunk: dict[str, Any], fields: list[str]) -> list[dict[str, Any]]:
+    """
+    A chunk's daily totals shaped like projected transactions, one row per
+    day, category and currency.
+    """
+    return [
+        {
+            field: value
+            for field, value in (
+                ("created_at", rollup["day"]),
+                ("total", rollup["total"]),
+                ("amount_minor", rollup["amount_minor"]),
+                ("currency", rollup["currency"]),
+                ("category", rollup["category"]),
+            )
+            if field in fields
+        }
+        for rollup in chunk["days"]
+    ]
+
+
+class ColdStore(Protocol):
+    """
+    Storage for the archived chunks of a transaction collection.
+    """
+
+    async def insert(self, chunk: dict[str, Any]) -> None: ...
+
+    async def replace(
+        self, chunk: dict[str, Any], docs: list[dict[str, Any]]
+    ) -> bool: ...
+
+    def ledger_chunks(
+        self,
+        ledger_ids: list[str | None],
+        start: datetime | None,
+        end: datetime | None,
+    ) -> AsyncIterator[dict[str, Any]]: ...
+
+    def user_chunks(
+        self, user_id: str | None, since: datetime | None, with_data: bool
+    ) -> AsyncIterator[dict[str, Any]]: ...
+
+    async def chunk_with(
+        self, ledger_ids: list[str | None], entry_id: ObjectId
+    ) -> dict[str, Any] | None: ...
+
+    async def archived_ids(self, entry_ids: list[ObjectId]) -> set[ObjectId]: ...
+
+    async def existing_import_hashes(
+        self, user_id: str | None, hashes: list[str]
+    ) -> set[str]: ...
+
+    async def create_indexes(self) -> None: ...
+
+
+class DocumentArchive:
+    """
+    One MongoDB document per chunk.
+    """
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.collection = db[f"{name}_archive"]
+
+    async def insert(self, chunk: dict[str, Any]) -> None:
+        await self.collection.insert_one(chunk)
+
+    async def replace(self, chunk: dict[str, Any], docs: list[dict[str, Any]]) -> bool:
+        """
+        Put other documents in a chunk, or remove it when there are none, if
+        nobody changed it since it was read.
+        """
+        current = {"_id": chunk["_id"], "version": chunk["version"]}
+        if not docs:
+            delete_result = await self.collection.delete_one(current)
+            return delete_result.deleted_count > 0
+
+        replace_result = await self.collection.replace_one(
+            current, pack(docs, chunk["version"] + 1)
+        )
+        return replace_result.matched_count > 0
+
+    async def ledger_chunks(
+        self,
+        ledger_ids: list[str | None],
+        start: datetime | None,
+        end: datetime | None,
+    ) -> AsyncIterator[dict[str, Any]]:
+        query: dict[str, Any] = {"ledger_id": {"$in": ledger_ids}}
+        month: dict[str, Any] = {}
+        if start is not None:
+            month["$gte"] = month_start(start)
+        if end is not None:
+            month["$lt"] = end
+        if month:
+            query["month"] = month
+
+        async for chunk in (
+            self.collection.find(query)
+            .sort("month", DESCENDING)
+            .max_time_ms(max_time_ms())
+        ):
+            yield chunk
+
+    async def user_chunks(
+        self, user_id: str | None, since: datetime | None, with_data: bool
+    ) -> AsyncIterator[dict[str, Any]]:
+        query: dict[str, Any] = {"user_id": user_id}
+        if since is not None:
+            query["month"] = {"$gte": month_start(since)}
+        projection = None if with_data else {field: 0 for field in BULK_FIELDS}
+
+        async for chunk in self.collection.find(
+            query, projection, max_time_ms=max_time_ms()
+        ):
+            yield chunk
+
+    async def chunk_with(
+        self, ledger_ids: list[str | None], entry_id: ObjectId
+    ) -> dict[str, Any] | None:
+        chunk: dict[str, Any] | None = await self.collection.find_one(
+            {"ids": entry_id, "ledger_id": {"$in": ledger_ids}},
+            max_time_ms=max_time_ms(),
+        )
+        return chunk
+
+    async def archived_ids(self, entry_ids: list[ObjectId]) -> set[ObjectId]:
+        wanted = set(entry_ids)
+        return {
+            entry_id
+            async for chunk in self.collection.find(
+                {"ids": {"$in": entry_ids}}, {"ids": 1}
+            )
+            for entry_id in chunk["ids"]
+            if entry_id in wanted
+        }
+
+    async def existing_import_hashes(
+        self, user_id: str | None, hashes: list[str]
+    ) -> set[str]:
+        wanted = set(hashes)
+        return {
+            import_hash
+            async for chunk in self.collection.find(
+                {"user_id": user_id, "import_hashes": {"$in": hashes}},
+                {"import_hashes": 1},
+                max_time_ms=max_time_ms(),
+            )
+            for import_hash in chunk["import_hashes"]
+            if import_hash in wanted
+        }
+
+    async def create_indexes(self) -> None:
+        await self.collection.create_index(
+            [("ledger_id", ASCENDING), ("month", DESCENDING)]
+        )
+        await self.collection.create_index(
+            [("user_id", ASCENDING), ("month", ASCENDING)]
+        )
+        # A transaction is in at most one chunk, also with concurrent runs.
+        await self.collection.create_index("ids", unique=True)
+        await self.collection.create_index(
+            [("user_id", ASCENDING), ("import_hashes", ASCENDING)]
+        )
+
+
+class SQLiteArchive:
+    """
+    One row per chunk in a SQLite table, next to tables of the archived
+    transactions' ids and import hashes for finding their chunks.
+    """
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.table = f"{name}_archive"
+        self.pool = sqlite.pool
+        self._ready = False
+
+    async def _run(self, fn: Callable[[sqlite3.Connection], T]) -> T:
+        if not self._ready:
+            await self.create_indexes()
+
+        return await self.pool.run(fn)
+
+    def _write(self, connection: sqlite3.Connection, chunk: dict[str, Any]) -> None:
+        chunk_id = str(chunk["_id"])
+        connection.execute(
+            f"INSERT INTO {self.table} (id, user_id, ledger_id, month, chunk)"
+            " VALUES (?, ?, ?, ?, ?)",
+            (
+                chunk_id,
+                chunk["user_id"],
+                chunk["ledger_id"],
+                epoch_micros(chunk["month"]),
+                bson.encode(chunk),
+            ),
+        )
+        connection.executemany(
+            f"INSERT INTO {self.table}_entries (entry_id, chunk_id) VALUES (?, ?)",
+            [(str(entry_id), chunk_id) for entry_id in chunk["ids"]],
+        )
+        connection.executemany(
+            f"INSERT INTO {self.table}_hashes (user_id, import_hash, chunk_id)"
+            " VALUES (?, ?, ?)",
+            [
+                (chunk["user_id"], import_hash, chunk_id)
+                for import_hash in chunk["import_hashes"]
+            ],
+        )
+
+    def _delete(self, connection: sqlite3.Connection, chunk_id: str) -> None:
+        connection.execute(f"DELETE FROM {self.table} WHERE id = ?", (chunk_id,))
+        for side in ("entries", "hashes"):
+            connection.execute(
+                f"DELETE FROM {self.table}_{side} WHERE chunk_id = ?", (chunk_id,)
+            )
+
+    async def insert(self, chunk: dict[str, Any]) -> None:
+        chunk.setdefault("_id", ObjectId())
+
+        def insert(connection: sqlite3.Connection) -> None:
+            try:
+                with write_transaction(connection):
+                    self._write(connection, chunk)
+            except sqlite3.IntegrityError as e:
+                raise DuplicateKeyError(str(e)) from e
+
+        await self._run(insert)
+
+    async def replace(self, chunk: dict[str, Any], docs: list[dict[str, Any]]) -> bool:
+        chunk_id = str(chunk["_id"])
+
+        def replace(connection: sqlite3.Connection) -> bool:
+            with write_transaction(connection):
+                row = connection.execute(
+                    f"SELECT chunk FROM {self.table} WHERE id = ?", (chunk_id,)
+                ).fetchone()
+                if row is None or bson.decode(row[0])["version"] != chunk["version"]:
+                    return False
+                self._delete(connection, chunk_id)
+                if docs:
+                    self._write(
+                        connection,
+                        pack(docs, chunk["version"] + 1) | {"_id": chunk["_id"]},
+                    )
+            return True
+
+        return await self._run(replace)
+
+    async def _select(self, condition: str, params: list[Any]) -> list[dict[str, Any]]:
+        def select(connection: sqlite3.Connection) -> list[dict[str, Any]]:
+            rows = connection.execute(
+                f"SELECT chunk FROM {self.table} WHERE {condition}"
+                " ORDER BY month DESC",
+                params,
+            )
+            return [bson.decode(chunk) for chunk, in rows]
+
+        return await self._run(select)
+
+    async def ledger_chunks(
+        self,
+        ledger_ids: list[str | None],
+        start: datetime | None,
+        end: datetime | None,
+    ) -> AsyncIterator[dict[str, Any]]:
+        conditions = ["ledger_id IN (SELECT value FROM json_each(?))"]
+        params: list[Any] = [json.dumps(ledger_ids)]
+        if start is not None:
+            conditions.append("month >= ?")
+            params.append(epoch_micros(month_start(start)))
+        if end is not None:
+            conditions.append("month < ?")
+            params.append(epoch_micros(end))
+
+        for chunk in await self._select(" AND ".join(conditions), params):
+            yield chunk
+
+    async def user_chunks(
+        self, user_id: str | None, since: datetime | None, with_data: bool
+    ) -> AsyncIterator[dict[str, Any]]:
+        conditions = ["user_id = ?"]
+        params: list[Any] = [user_id]
+        if since is not None:
+            conditions.append("month >= ?")
+            params.append(epoch_micros(month_start(since)))
+
+        for chunk in await self._select(" AND ".join(conditions), params):
+            yield chunk
+
+    async def chunk_with(
+        self, ledger_ids: list[str | None], entry_id: ObjectId
+    ) -> dict[str, Any] | None:
+        chunks = await self._select(
+            f"id = (SELECT chunk_id FROM {self.table}_entries WHERE entry_id = ?)"
+            " AND ledger_id IN (SELECT value FROM json_each(?))",
+            [str(entry_id), json.dumps(ledger_ids)],
+        )
+        return chunks[0] if chunks else None
+
+    async def archived_ids(self, entry_ids: list[ObjectId]) -> set[ObjectId]:
+        def select(connection: sqlite3.Connection) -> set[ObjectId]:
+            rows = connection.execute(
+                f"SELECT entry_id FROM {self.table}_entries"
+                " WHERE entry_id IN (SELECT value FROM json_each(?))",
+                (json.dumps([str(entry_id) for entry_id in entry_ids]),),
+            )
+            return {ObjectId(entry_id) for entry_id, in rows}
+
+        return await self._run(select)
+
+    async def existing_import_hashes(
+        self, user_id: str | None, hashes: list[str]
+    ) -> set[str]:
+        def select(connection: sqlite3.Connection) -> set[str]:
+            rows = connection.execute(
+                f"SELECT import_hash FROM {self.table}_hashes WHERE user_id = ?"
+                " AND import_hash IN (SELECT value FROM json_each(?))",
+                (user_id, json.dumps(hashes)),
+            )
+            return {import_hash for import_hash, in rows}
+
+        return await self._run(select)
+
+    async def create_indexes(self) -> None:
+        table = self.table
+        statements = [
+            f"CREATE TABLE IF NOT EXISTS {table} (id TEXT PRIMARY KEY, user_id TEXT,"
+            " ledger_id TEXT, month INTEGER NOT NULL, chunk BLOB NOT NULL)",
+            f"CREATE INDEX IF NOT EXISTS {table}_ledger_month"
+            f" ON {table} (ledger_id, month)",
+            f"CREATE INDEX IF NOT EXISTS {table}_user_month"
+            f" ON {table} (user_id, month)",
+            f"CREATE TABLE IF NOT EXISTS {table}_entries (entry_id TEXT PRIMARY KEY,"
+            " chunk_id TEXT NOT NULL)",
+            f"CREATE INDEX IF NOT EXISTS {table}_entries_chunk"
+            f" ON {table}_entries (chunk_id)",
+            f"CREATE TABLE IF NOT EXISTS {table}_hashes (user_id TEXT,"
+            " import_hash TEXT NOT NULL, chunk_id TEXT NOT NULL)",
+            f"CREATE INDEX IF NOT EXISTS {table}_hashes_user"
+            f" ON {table}_hashes (user_id, import_hash)",
+            f"CREATE INDEX IF NOT EXISTS {table}_hashes_chunk"
+            f" ON {table}_hashes (chunk_id)",
+        ]
+
+        def create(connection: sqlite3.Connection) -> None:
+            with write_transaction(connection):
+                for statement in statements:
+                    connection.execute(statement)
+
+        await self.pool.run(create)
+        self._ready = True
+
+
+def cold_store(name: str) -> ColdStore:
+    """
+    Get the archive of a transaction collection, next to its hot storage: in
+    SQLite with the SQLite backend, in MongoDB otherwise.
+    """
+    if settings.storage_backend == "sqlite":
+        return SQLiteArchive(name)
+
+    return DocumentArchive(name)
@@ -0,0 +1,230 @@
+import asyncio
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Any
+
+from app.models import as_utc
+from app.settings import settings
+from app.utilities.changes import ChangeLog, change_log
+from app.utilities.log import logger
+from app.utilities.money import amount_of
+from app.utilities.transactions import plan_store, transaction_store
+
+stores = {
+    "expenses": transaction_store("expenses"),
+    "bills": transaction_store("bills"),
+    "budgets": plan_store("budgets"),
+    "wishlists": plan_store("wishlists"),
+}
+
+# Reads of a user's documents for a baseline, while writes keep coming in.
+BASELINE_ATTEMPTS = 3
+
+# Amounts in minor units per collection and currency.
+Balances = dict[tuple[str, str], dict[str, int]]
+
+
+class NoHistory(Exception):
+    """
+    A balance was asked for before the user's change history starts.
+    """
+
+    def __init__(self, starts_at: datetime) -> None:
+        super().__init__(f"No balance history before {as_utc(starts_at).isoformat()}.")
+        self.starts_at = starts_at
+
+
+@dataclass
+class BalanceAt:
+    """
+    A user's balances at a time, and how they were found: the snapshot they
+    start from and the number of changes replayed on top.
+    """
+
+    at: datetime
+    snapshot_at: datetime
+    replayed: int
+    balances: list[dict[str, Any]]
+
+
+def add(balances: Balances, collection: str, doc: dict[str, Any], sign: int) -> None:
+    amount_minor, currency = amount_of(doc)
+    row = balances.setdefault(
+        (collection, currency), {"amount_minor": 0, "saved_minor": 0}
+    )
+    row["amount_minor"] += sign * amount_minor
+    row["saved_minor"] += sign * (doc.get("saved_minor") or 0)
+
+
+def apply(balances: Balances, change: dict[str, Any]) -> None:
+    """
+    Fold one change into balances: take out the document as it was and add
+    it as it is now.
+    """
+    if change["before"] is not None:
+        add(balances, change["collection"], change["before"], -1)
+    if change["after"] is not None:
+        add(balances, change["collection"], change["after"], 1)
+
+
+def to_rows(balances: Balances) -> list[dict[str, Any]]:
+    return [
+        {"collection": collection, "currency": currency} | amounts
+        for (collection, currency), amounts in sorted(balances.items())
+        if any(amounts.values())
+    ]
+
+
+def from_rows(rows: list[dict[str, Any]]) -> Balances:
+    return {
+        (row["collection"], row["currency"]): {
+            "amount_minor": row["amount_minor"],
+            "saved_minor": row["saved_minor"],
+        }
+        for row in rows
+    }
+
+
+async def current_balances(user_id: str | None) -> Balances:
+    """
+    A user's balances read from their documents as they are now.
+    """
+    balances: Balances = {}
+    for collection, store in stores.items():
+        fields = ["total", "amount_minor", "currency"]
+        if collection == "wishlists":
+            fields.append("saved_minor")
+        async for doc in store.project(user_id, fields):
+            add(balances, collection, doc, 1)
+
+    return balances
+
+
+async def take_baseline(log: ChangeLog, user_id: str | None) -> dict[str, Any]:
+    """
+    Snapshot a user's balances from their documents, where their change
+    history starts.
+
+    Writes made while the documents are read may or may not be in what was
+    read, so they are read again when changes show up in the meantime.
+    """
+    for _ in range(BASELINE_ATTEMPTS):
+        started = datetime.now(timezone.utc)
+        balances = await current_balances(user_id)
+        if not await log.count(user_id, started, datetime.now(timezone.utc)):
+            break
+    else:
+        logger.warning("Balance baseline of user %s taken during writes", user_id)
+
+    # Rounded up to what MongoDB stores, so the changes replayed after it are
+    # all from after the read started.
+    at = started.replace(microsecond=started.microsecond // 1000 * 1000) + timedelta(
+        milliseconds=1
+    )
+
+    snapshot = {
+        "user_id": user_id,
+        "at": at,
+        "balances": to_rows(balances),
+        "baseline": True,
+    }
+    await log.save_snapshot(snapshot)
+    return snapshot
+
+
+async def balance_at(user_id: str | None, at: datetime | None) -> BalanceAt:
+    """
+    A user's balances at a time, now if not given, replaying the changes
+    after the latest snapshot before it.
+
+    The first balance asked for, or the first snapshot run to see a user,
+    takes a baseline from their documents. History starts there.
+    """
+    log = change_log()
+    assert log is not None
+
+    snapshot = await log.latest_snapshot(user_id, at)
+    if snapshot is None:
+        snapshot = await log.first_snapshot(user_id) or await take_baseline(
+            log, user_id
+        )
+        if at is not None and as_utc(snapshot["at"]) > as_utc(at):
+            raise NoHistory(snapshot["at"])
+
+    until = at or max(datetime.now(timezone.utc), as_utc(snapshot["at"]))
+    balances = from_rows(snapshot["balances"])
+    replayed = 0
+    async for change in log.since(user_id, snapshot["at"], until):
+        apply(balances, change)
+        replayed += 1
+
+    return BalanceAt(
+        at=until,
+        snapshot_at=as_utc(snapshot["at"]),
+        replayed=replayed,
+        balances=to_rows(balances),
+    )
+
+
+def snapshot_time() -> datetime:
+    """
+    Time the next periodic snapshots are taken at: the last interval boundary
+    that changes have settled before, the same in every worker.
+    """
+    interval = settings.change_snapshot_interval_seconds
+    settled = datetime.now(timezone.utc).timestamp() - settings.change_settle_seconds
+    return datetime.fromtimestamp(settled // interval * interval, timezone.utc)
+
+
+async def snapshot_user(log: ChangeLog, user_id: str | None, until: datetime) -> None:
+    """
+    Snapshot a user's balances at a time if enough changes came since their
+    latest snapshot, or take their baseline if they have none.
+    """
+    latest = await log.latest_snapshot(user_id, None)
+    if latest is None:
+        await take_baseline(log, user_id)
+        return
+
+    if as_utc(latest["at"]) >= until:
+        return
+
+    changes = await log.count(user_id, latest["at"], until)
+    if changes < settings.change_snapshot_every:
+        return
+
+    balances = from_rows(latest["balances"])
+    async for change in log.since(user_id, latest["at"], until):
+        apply(balances, change)
+
+    await log.save_snapshot(
+        {
+            "user_id": user_id,
+            "at": until,
+            "balances": to_rows(balances),
+            "baseline": False,
+        }
+    )
+
+
+async def run_snapshots() -> None:
+    """
+    Keep snapshotting the balances of users with changes, until cancelled.
+
+    Only changes from before the settle delay are folded in, so a write still
+    being logged when a snapshot is taken is not left out of it.
+    """
+    log = change_log()
+    assert log is not None
+
+    checked_until = None
+    while True:
+        until = snapshot_time()
+        try:
+            for user_id in await log.user_ids(checked_until, until):
+                await snapshot_user(log, user_id, until)
+            checked_until = until
+        except Exception:
+            logger.exception("Snapshotting balances failed")
+
+        await asyncio.sleep(settings.change_snapshot_interval_seconds)
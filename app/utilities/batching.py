@@ -0,0 +1,134 @@
+import asyncio
+from typing import Any
+
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorCollection
+from pymongo.errors import BulkWriteError, DuplicateKeyError, WriteError
+
+from app.settings import settings
+from app.utilities.log import logger
+
+
+class InsertBatcher:
+    """
+    Coalesces single inserts into insert_many calls.
+
+    A batch is written once it holds `max_docs` documents or `max_delay_ms` after
+    its first document, whichever comes first. Each caller is answered only after
+    the batch holding its document was written.
+    """
+
+    def __init__(
+        self,
+        collection: AsyncIOMotorCollection[Any],
+        max_docs: int,
+        max_delay_ms: int,
+    ) -> None:
+        self.collection = collection
+        self.max_docs = max_docs
+        self.max_delay = max_delay_ms / 1000
+        self._pending: list[tuple[dict[str, Any], asyncio.Future[None]]] = []
+        self._timer: asyncio.TimerHandle | None = None
+        self._writes: set[asyncio.Task[None]] = set()
+        self._closed = False
+
+    async def insert(self, doc: dict[str, Any]) -> ObjectId:
+        """
+        Queue a document and wait for its batch to be written.
+        """
+        if self._closed:
+            raise RuntimeError("Insert batcher is closed")
+
+        loop = asyncio.get_running_loop()
+        doc.setdefault("_id", ObjectId())
+        future: asyncio.Future[None] = loop.create_future()
+        self._pending.append((doc, future))
+
+        if len(self._pending) >= self.max_docs:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_delay, self._flush)
+
+        # The write goes ahead even if this request is cancelled.
+        await asyncio.shield(future)
+
+        inserted_id: ObjectId = doc["_id"]
+        return inserted_id
+
+    def _flush(self) -> None:
+        """
+        Start writing the pending batch.
+        """
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        if not self._pending:
+            return
+
+        batch, self._pending = self._pending, []
+        task = asyncio.ensure_future(self._write(batch))
+        self._writes.add(task)
+        task.add_done_callback(self._writes.discard)
+
+    async def _write(
+        self, batch: list[tuple[dict[str, Any], asyncio.Future[None]]]
+    ) -> None:
+        errors: dict[int, Exception] = {}
+        try:
+            await self.collection.insert_many([doc for doc, _ in batch], ordered=False)
+        except BulkWriteError as e:
+            for error in e.details.get("writeErrors", []):
+                error_type = DuplicateKeyError if error["code"] == 11000 else WriteError
+                errors[error["index"]] = error_type(
+                    error["errmsg"], error["code"], error
+                )
+        except Exception as e:
+            logger.exception("Batch insert into %s failed", self.collection.name)
+            errors = {index: e for index in range(len(batch))}
+
+        for index, (_, future) in enumerate(batch):
+            if future.done():
+                continue
+            if index in errors:
+                future.set_exception(errors[index])
+            else:
+                future.set_result(None)
+
+    async def close(self) -> None:
+        """
+        Write everything queued and refuse new documents.
+        """
+        self._closed = True
+        self._flush()
+        if self._writes:
+            await asyncio.gather(*self._writes, return_exceptions=True)
+
+
+_batchers: dict[str, InsertBatcher] = {}
+
+
+def insert_batcher(collection: AsyncIOMotorCollection[Any]) -> InsertBatcher:
+    """
+    Shared batcher of a collection.
+    """
+    batcher = _batchers.get(collection.name)
+    if batcher is None:
+        batcher = InsertBatcher(
+            collection,
+            max_docs=settings.write_batch_max_docs,
+            max_delay_ms=settings.write_batch_max_delay_ms,
+        )
+        _batchers[collection.name] = batcher
+
+    return batcher
+
+
+async def close_batchers() -> None:
+    """
+    Drain all batchers, on shutdown.
+    """
+    for batcher in _batchers.values():
+        await batcher.close()
+
+    _batchers.clear()
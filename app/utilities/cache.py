@@ -0,0 +1,127 @@
+import asyncio
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Generic, Hashable, TypeVar
+
+from app.utilities.invalidation import bus
+
+T = TypeVar("T")
+
+_caches: list["UserCache[Any] | SingleFlight[Any]"] = []
+flights: list["SingleFlight[Any]"] = []
+
+
+class UserCache(Generic[T]):
+    """
+    Per-user values that are dropped whenever the user writes.
+
+    Each user has a generation that every write bumps, so a value computed
+    while a write happened is not stored.
+    """
+
+    def __init__(self, max_users: int) -> None:
+        self.max_users = max_users
+        self._values: OrderedDict[str | None, T] = OrderedDict()
+        self._generations: dict[str | None, int] = {}
+        _caches.append(self)
+
+    def generation(self, user_id: str | None) -> int:
+        return self._generations.get(user_id, 0)
+
+    def get(self, user_id: str | None) -> T | None:
+        value = self._values.get(user_id)
+        if value is not None:
+            self._values.move_to_end(user_id)
+
+        return value
+
+    def set(self, user_id: str | None, value: T, generation: int) -> None:
+        """
+        Store a value computed at a generation, unless the user wrote since.
+        """
+        if generation != self.generation(user_id):
+            return
+
+        self._values[user_id] = value
+        self._values.move_to_end(user_id)
+        while len(self._values) > self.max_users:
+            evicted, _ = self._values.popitem(last=False)
+            self._generations.pop(evicted, None)
+
+    def invalidate(self, user_id: str | None) -> None:
+        self._values.pop(user_id, None)
+        self._generations[user_id] = self.generation(user_id) + 1
+
+
+class SingleFlight(Generic[T]):
+    """
+    Concurrent identical reads of a user share one call and its result.
+
+    The call runs in its own task, so a caller going away does not cancel it
+    for the others, only the last one leaving does. Once the user writes,
+    reads start a new call instead of joining one that may have read before
+    the write.
+    """
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.calls = 0
+        self.coalesced = 0
+        self._tasks: dict[tuple[str | None, Hashable], asyncio.Task[T]] = {}
+        self._waiting: dict[asyncio.Task[T], int] = {}
+        _caches.append(self)
+        flights.append(self)
+
+    async def run(
+        self, user_id: str | None, key: Hashable, fn: Callable[[], Awaitable[T]]
+    ) -> T:
+        """
+        Result of the call in flight for a key, or of a new call.
+        """
+        self.calls += 1
+        flight_key = (user_id, key)
+        task = self._tasks.get(flight_key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._tasks[flight_key] = task
+            task.add_done_callback(lambda task: self._forget(flight_key, task))
+        else:
+            self.coalesced += 1
+
+        self._waiting[task] = self._waiting.get(task, 0) + 1
+        try:
+            return await asyncio.shield(task)
+        finally:
+            self._waiting[task] -= 1
+            if not self._waiting[task]:
+                del self._waiting[task]
+                task.cancel()
+
+    def _forget(
+        self, flight_key: tuple[str | None, Hashable], task: asyncio.Task[T]
+    ) -> None:
+        if self._tasks.get(flight_key) is task:
+            del self._tasks[flight_key]
+        # Retrieve the exception when every caller has gone away.
+        if not task.cancelled():
+            task.exception()
+
+    def invalidate(self, user_id: str | None) -> None:
+        for flight_key in [key for key in self._tasks if key[0] == user_id]:
+            del self._tasks[flight_key]
+
+
+def drop_users(user_ids: list[str | None]) -> None:
+    for user_id in user_ids:
+        for cache in _caches:
+            cache.invalidate(user_id)
+
+
+def invalidate_user(user_id: str | None) -> None:
+    """
+    Drop everything cached for a user, after a write, in every worker.
+    """
+    drop_users([user_id])
+    bus.publish("user", [user_id])
+
+
+bus.subscribe("user", drop_users)
@@ -0,0 +1,127 @@
+import asyncio
+import hashlib
+import os
+import random
+import time
+from typing import Any
+
+import orjson
+from anyio.to_thread import run_sync
+from starlette.requests import Request
+from starlette.responses import Response
+
+from app.settings import settings
+from app.utilities.log import logger
+
+# Scope key of the user a request was validated for.
+REQUEST_USER = "budget_app.user"
+
+# Records kept in memory before they are appended to the file.
+FLUSH_RECORDS = 100
+FLUSH_SECONDS = 1.0
+
+
+def user_bucket(user_id: str | None) -> int | None:
+    """
+    Stable bucket of a user, so requests of the same user replay as one user
+    without the capture holding their id.
+    """
+    if user_id is None:
+        return None
+
+    digest = hashlib.blake2b(user_id.encode(), digest_size=8).digest()
+    return int.from_bytes(digest) % settings.capture_user_buckets
+
+
+def route_of(request: Request) -> str | None:
+    """
+    Path template of the route that handled a request, never the path itself,
+    which holds ids.
+    """
+    route = request.scope.get("route")
+    path: str | None = getattr(route, "path", None)
+    return path
+
+
+def shape(request: Request, response: Response, seconds: float) -> dict[str, Any]:
+    """
+    What a request looked like without what it held: its route, the names of
+    its query parameters, sizes, status, timing and user bucket.
+    """
+    return {
+        "at": round(time.time() - seconds, 3),
+        "method": request.method,
+        "route": route_of(request),
+        "query": sorted(set(request.query_params.keys())),
+        "request_bytes": int(request.headers.get("content-length", 0)),
+        "response_bytes": int(response.headers.get("content-length", 0)),
+        "status": response.status_code,
+        "ms": round(seconds * 1000, 2),
+        "user": user_bucket(request.scope.get(REQUEST_USER)),
+    }
+
+
+class TrafficCapture:
+    """
+    Appends the shapes of a sample of requests to a JSON lines file, for
+    replaying the traffic against a local instance.
+
+    Records are buffered and appended a batch at a time with a single write,
+    so workers sharing the file never interleave within a line. Batches are
+    written from a worker thread, one at a time, so a slow disk does not hold
+    up the event loop.
+    """
+
+    def __init__(self) -> None:
+        self._fd: int | None = None
+        self._pending: list[bytes] = []
+        self._flushed_at = 0.0
+        self._flushing: asyncio.Task[None] | None = None
+
+    @property
+    def enabled(self) -> bool:
+        return settings.capture_path is not None
+
+    def record(self, request: Request, response: Response, seconds: float) -> None:
+        if not self.enabled or random.random() >= settings.capture_sample_rate:
+            return
+
+        self._pending.append(orjson.dumps(shape(request, response, seconds)) + b"\n")
+        now = time.monotonic()
+        if self._flushing is None and (
+            len(self._pending) >= FLUSH_RECORDS
+            or now - self._flushed_at > FLUSH_SECONDS
+        ):
+            # Records arriving meanwhile wait for the next batch.
+            self._flushing = asyncio.create_task(self.flush())
+            self._flushing.add_done_callback(self._flushed)
+            self._flushed_at = now
+
+    def _flushed(self, task: asyncio.Task[None]) -> None:
+        self._flushing = None
+
+    async def flush(self) -> None:
+        if not self._pending or settings.capture_path is None:
+            return
+
+        lines, self._pending = b"".join(self._pending), []
+        await run_sync(self._write, settings.capture_path, lines)
+
+    def _write(self, path: str, lines: bytes) -> None:
+        try:
+            if self._fd is None:
+                self._fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+            os.write(self._fd, lines)
+        except OSError:
+            logger.exception("Writing captured traffic failed")
+
+    async def close(self) -> None:
+        if self._flushing is not None:
+            await self._flushing
+        await self.flush()
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+capture = TrafficCapture()
@@ -0,0 +1,470 @@
+import asyncio
+import functools
+import json
+import sqlite3
+from datetime import datetime, timezone
+from typing import (
+    Any,
+    AsyncIterator,
+    Callable,
+    Coroutine,
+    ParamSpec,
+    Protocol,
+    TypeVar,
+)
+
+import bson
+from bson import ObjectId
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import DuplicateKeyError
+
+from app.models import epoch_micros
+from app.settings import settings
+from app.utilities import sqlite
+from app.utilities.clients import db
+from app.utilities.deadlines import max_time_ms
+from app.utilities.sqlite import write_transaction
+
+T = TypeVar("T")
+P = ParamSpec("P")
+
+# Fields an update keeps from before and after it even when unchanged, so a
+# balance can follow it without the rest of the document.
+BALANCE_FIELDS = ("total", "amount_minor", "currency", "saved_minor")
+
+
+def change(
+    collection: str, before: dict[str, Any] | None, after: dict[str, Any] | None
+) -> dict[str, Any]:
+    """
+    An entry of the change log for a document as it was and as it is now,
+    None when it did not or no longer exists.
+
+    Creates and deletes keep the whole document, updates only the fields that
+    changed and the balance fields.
+    """
+    doc = after if after is not None else before
+    assert doc is not None
+
+    op = "create" if before is None else "delete" if after is None else "update"
+    if before is not None and after is not None:
+        fields = {
+            field
+            for field in before.keys() | after.keys()
+            if before.get(field) != after.get(field)
+        }
+        fields.update(BALANCE_FIELDS)
+        before = {field: before[field] for field in sorted(fields) if field in before}
+        after = {field: after[field] for field in sorted(fields) if field in after}
+
+    return {
+        "_id": ObjectId(),
+        "at": datetime.now(timezone.utc),
+        "user_id": doc.get("user_id"),
+        "ledger_id": doc.get("ledger_id"),
+        "collection": collection,
+        "entity_id": doc["_id"],
+        "op": op,
+        "before": before,
+        "after": after,
+    }
+
+
+_logged_writes: set[asyncio.Future[Any]] = set()
+
+
+def logged_write(
+    method: Callable[P, Coroutine[Any, Any, T]],
+) -> Callable[P, Coroutine[Any, Any, T]]:
+    """
+    Run a write and the append of its changes as a task of its own that goes
+    ahead when the caller is cancelled, so a committed write is never left
+    out of the change log.
+
+    MongoDB writes are logged right after themselves rather than in a
+    transaction, which needs a replica set.
+    """
+
+    @functools.wraps(method)
+    async def shielded(*args: P.args, **kwargs: P.kwargs) -> T:
+        task = asyncio.ensure_future(method(*args, **kwargs))
+        _logged_writes.add(task)
+        task.add_done_callback(_logged_writes.discard)
+        return await asyncio.shield(task)
+
+    return shielded
+
+
+async def drain_logged_writes() -> None:
+    """
+    Wait for writes whose callers were cancelled to be logged.
+    """
+    if _logged_writes:
+        await asyncio.gather(*_logged_writes, return_exceptions=True)
+
+
+class ChangeLog(Protocol):
+    """
+    Append-only log of the writes to documents of the four document
+    collections, and snapshots of users' balances folded from it.
+    """
+
+    async def append(self, changes: list[dict[str, Any]]) -> None: ...
+
+    def since(
+        self, user_id: str | None, after: datetime | None, until: datetime
+    ) -> AsyncIterator[dict[str, Any]]: ...
+
+    async def count(
+        self, user_id: str | None, after: datetime | None, until: datetime
+    ) -> int: ...
+
+    async def user_ids(
+        self, after: datetime | None, until: datetime
+    ) -> list[str | None]: ...
+
+    async def history(
+        self,
+        ledger_ids: list[str | None],
+        collection: str | None,
+        entity_id: ObjectId | None,
+        limit: int,
+    ) -> list[dict[str, Any]]: ...
+
+    async def latest_snapshot(
+        self, user_id: str | None, until: datetime | None
+    ) -> dict[str, Any] | None: ...
+
+    async def first_snapshot(self, user_id: str | None) -> dict[str, Any] | None: ...
+
+    async def save_snapshot(self, snapshot: dict[str, Any]) -> None: ...
+
+    async def create_indexes(self) -> None: ...
+
+
+class DocumentChanges:
+    """
+    Changes and snapshots in MongoDB collections.
+    """
+
+    def __init__(self) -> None:
+        self.collection = db.changes
+        self.snapshots = db.change_snapshots
+
+    @staticmethod
+    def _range(
+        user_id: str | None, after: datetime | None, until: datetime
+    ) -> dict[str, Any]:
+        at: dict[str, Any] = {"$lte": until}
+        if after is not None:
+            at["$gt"] = after
+
+        return {"user_id": user_id, "at": at}
+
+    async def append(self, changes: list[dict[str, Any]]) -> None:
+        if changes:
+            await self.collection.insert_many(changes)
+
+    async def since(
+        self, user_id: str | None, after: datetime | None, until: datetime
+    ) -> AsyncIterator[dict[str, Any]]:
+        """
+        A user's changes after one time up to another, oldest first.
+        """
+        async for doc in (
+            self.collection.find(self._range(user_id, after, until))
+            .sort([("at", ASCENDING), ("_id", ASCENDING)])
+            .max_time_ms(max_time_ms())
+        ):
+            yield doc
+
+    async def count(
+        self, user_id: str | None, after: datetime | None, until: datetime
+    ) -> int:
+        counted: int = await self.collection.count_documents(
+            self._range(user_id, after, until), maxTimeMS=max_time_ms()
+        )
+        return counted
+
+    async def user_ids(
+        self, after: datetime | None, until: datetime
+    ) -> list[str | None]:
+        """
+        Users with changes after one time up to another.
+        """
+        at: dict[str, Any] = {"$lte": until}
+        if after is not None:
+            at["$gt"] = after
+
+        user_ids: list[str | None] = await self.collection.distinct(
+            "user_id", {"at": at}
+        )
+        return user_ids
+
+    async def history(
+        self,
+        ledger_ids: list[str | None],
+        collection: str | None,
+        entity_id: ObjectId | None,
+        limit: int,
+    ) -> list[dict[str, Any]]:
+        """
+        Changes to the documents of some ledgers, newest first.
+        """
+        query: dict[str, Any] = {"ledger_id": {"$in": ledger_ids}}
+        if collection is not None:
+            query["collection"] = collection
+        if entity_id is not None:
+            query["entity_id"] = entity_id
+
+        return await (
+            self.collection.find(query)
+            .sort([("at", DESCENDING), ("_id", DESCENDING)])
+            .limit(limit)
+            .max_time_ms(max_time_ms())
+            .to_list(None)
+        )
+
+    async def latest_snapshot(
+        self, user_id: str | None, until: datetime | None
+    ) -> dict[str, Any] | None:
+        query: dict[str, Any] = {"user_id": user_id}
+        if until is not None:
+            query["at"] = {"$lte": until}
+
+        snapshot: dict[str, Any] | None = await self.snapshots.find_one(
+            query, sort=[("at", DESCENDING)], max_time_ms=max_time_ms()
+        )
+        return snapshot
+
+    async def first_snapshot(self, user_id: str | None) -> dict[str, Any] | None:
+        snapshot: dict[str, Any] | None = await self.snapshots.find_one(
+            {"user_id": user_id}, sort=[("at", ASCENDING)], max_time_ms=max_time_ms()
+        )
+        return snapshot
+
+    async def save_snapshot(self, snapshot: dict[str, Any]) -> None:
+        """
+        Store a snapshot, unless another worker stored one for the same time.
+        """
+        try:
+            await self.snapshots.insert_one(snapshot)
+        except DuplicateKeyError:
+            pass
+
+    async def create_indexes(self) -> None:
+        await self.collection.create_index(
+            [("user_id", ASCENDING), ("at", ASCENDING), ("_id", ASCENDING)]
+        )
+        await self.collection.create_index(
+            [("ledger_id", ASCENDING), ("at", DESCENDING)]
+        )
+        await self.collection.create_index(
+            [("entity_id", ASCENDING), ("at", DESCENDING)]
+        )
+        await self.collection.create_index("at")
+        await self.snapshots.create_index(
+            [("user_id", ASCENDING), ("at", DESCENDING)], unique=True
+        )
+
+
+class SQLiteChanges:
+    """
+    Changes and snapshots in SQLite tables, one BSON row each.
+
+    The SQLite store writes a document's change in the same transaction as the
+    document itself.
+    """
+
+    def __init__(self) -> None:
+        self.pool = sqlite.pool
+        self._ready = False
+
+    async def _run(self, fn: Callable[[sqlite3.Connection], T]) -> T:
+        if not self._ready:
+            await self.create_indexes()
+
+        return await self.pool.run(fn)
+
+    @staticmethod
+    def write(connection: sqlite3.Connection, changes: list[dict[str, Any]]) -> None:
+        """
+        Append changes within the caller's transaction.
+        """
+        connection.executemany(
+            "INSERT INTO changes (id, user_id, ledger_id, collection, entity_id, at,"
+            " doc) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [
+                (
+                    str(doc["_id"]),
+                    doc["user_id"],
+                    doc["ledger_id"],
+                    doc["collection"],
+                    str(doc["entity_id"]),
+                    epoch_micros(doc["at"]),
+                    bson.encode(doc),
+                )
+                for doc in changes
+            ],
+        )
+
+    async def append(self, changes: list[dict[str, Any]]) -> None:
+        def insert(connection: sqlite3.Connection) -> None:
+            with write_transaction(connection):
+                self.write(connection, changes)
+
+        if changes:
+            await self._run(insert)
+
+    @staticmethod
+    def _range(
+        user_id: str | None, after: datetime | None, until: datetime
+    ) -> tuple[str, list[Any]]:
+        return "user_id IS ? AND at > ? AND at <= ?", [
+            user_id,
+            epoch_micros(after) if after is not None else -1,
+            epoch_micros(until),
+        ]
+
+    async def since(
+        self, user_id: str | None, after: datetime | None, until: datetime
+    ) -> AsyncIterator[dict[str, Any]]:
+        condition, params = self._range(user_id, after, until)
+
+        def select(connection: sqlite3.Connection) -> list[dict[str, Any]]:
+            rows = connection.execute(
+                f"SELECT doc FROM changes WHERE {condition} ORDER BY at, id", params
+            )
+            return [bson.decode(doc) for doc, in rows]
+
+        for doc in await self._run(select):
+            yield doc
+
+    async def count(
+        self, user_id: str | None, after: datetime | None, until: datetime
+    ) -> int:
+        condition, params = self._range(user_id, after, until)
+
+        def select(connection: sqlite3.Connection) -> int:
+            (counted,) = connection.execute(
+                f"SELECT count(*) FROM changes WHERE {condition}", params
+            ).fetchone()
+            return int(counted)
+
+        return await self._run(select)
+
+    async def user_ids(
+        self, after: datetime | None, until: datetime
+    ) -> list[str | None]:
+        def select(connection: sqlite3.Connection) -> list[str | None]:
+            rows = connection.execute(
+                "SELECT DISTINCT user_id FROM changes WHERE at > ? AND at <= ?",
+                (
+                    epoch_micros(after) if after is not None else -1,
+                    epoch_micros(until),
+                ),
+            )
+            return [user_id for user_id, in rows]
+
+        return await self._run(select)
+
+    async def history(
+        self,
+        ledger_ids: list[str | None],
+        collection: str | None,
+        entity_id: ObjectId | None,
+        limit: int,
+    ) -> list[dict[str, Any]]:
+        conditions = ["ledger_id IN (SELECT value FROM json_each(?))"]
+        params: list[Any] = [json.dumps(ledger_ids)]
+        if collection is not None:
+            conditions.append("collection = ?")
+            params.append(collection)
+        if entity_id is not None:
+            conditions.append("entity_id = ?")
+            params.append(str(entity_id))
+
+        def select(connection: sqlite3.Connection) -> list[dict[str, Any]]:
+            rows = connection.execute(
+                f"SELECT doc FROM changes WHERE {' AND '.join(conditions)}"
+                " ORDER BY at DESC, id DESC LIMIT ?",
+                [*params, limit],
+            )
+            return [bson.decode(doc) for doc, in rows]
+
+        return await self._run(select)
+
+    async def _snapshot(
+        self, condition: str, params: list[Any], order: str
+    ) -> dict[str, Any] | None:
+        def select(connection: sqlite3.Connection) -> dict[str, Any] | None:
+            row = connection.execute(
+                f"SELECT doc FROM change_snapshots WHERE {condition}"
+                f" ORDER BY at {order} LIMIT 1",
+                params,
+            ).fetchone()
+            return bson.decode(row[0]) if row else None
+
+        return await self._run(select)
+
+    async def latest_snapshot(
+        self, user_id: str | None, until: datetime | None
+    ) -> dict[str, Any] | None:
+        if until is None:
+            return await self._snapshot("user_id IS ?", [user_id], "DESC")
+
+        return await self._snapshot(
+            "user_id IS ? AND at <= ?", [user_id, epoch_micros(until)], "DESC"
+        )
+
+    async def first_snapshot(self, user_id: str | None) -> dict[str, Any] | None:
+        return await self._snapshot("user_id IS ?", [user_id], "ASC")
+
+    async def save_snapshot(self, snapshot: dict[str, Any]) -> None:
+        row = (snapshot["user_id"], epoch_micros(snapshot["at"]), bson.encode(snapshot))
+        await self._run(
+            lambda connection: connection.execute(
+                "INSERT OR IGNORE INTO change_snapshots (user_id, at, doc)"
+                " VALUES (?, ?, ?)",
+                row,
+            )
+        )
+
+    async def create_indexes(self) -> None:
+        statements = [
+            "CREATE TABLE IF NOT EXISTS changes (id TEXT PRIMARY KEY, user_id TEXT,"
+            " ledger_id TEXT, collection TEXT NOT NULL, entity_id TEXT NOT NULL,"
+            " at INTEGER NOT NULL, doc BLOB NOT NULL)",
+            "CREATE INDEX IF NOT EXISTS changes_user_at ON changes (user_id, at, id)",
+            "CREATE INDEX IF NOT EXISTS changes_ledger_at ON changes (ledger_id, at)",
+            "CREATE INDEX IF NOT EXISTS changes_entity_at ON changes (entity_id, at)",
+            "CREATE INDEX IF NOT EXISTS changes_at ON changes (at)",
+            "CREATE TABLE IF NOT EXISTS change_snapshots (user_id TEXT,"
+            " at INTEGER NOT NULL, doc BLOB NOT NULL, PRIMARY KEY (user_id, at))",
+        ]
+
+        def create(connection: sqlite3.Connection) -> None:
+            with write_transaction(connection):
+                for statement in statements:
+                    connection.execute(statement)
+
+        await self.pool.run(create)
+        self._ready = True
+
+
+document_changes = DocumentChanges()
+sqlite_changes = SQLiteChanges()
+
+
+def change_log() -> ChangeLog | None:
+    """
+    Get the change log in the configured backend, None when changes are not
+    logged. The memory backend logs to its in-process MongoDB.
+    """
+    if not settings.change_log:
+        return None
+
+    if settings.storage_backend == "sqlite":
+        return sqlite_changes
+
+    return document_changes
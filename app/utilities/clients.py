@@ -2,6 +2,7 @@ from typing import Any
 
 import firebase_admin
 from firebase_admin import credentials
+from mongomock_motor import AsyncMongoMockClient
 from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
 
 from app.settings import settings
@@ -9,11 +10,19 @@ from app.settings import settings
 
 def get_db() -> AsyncIOMotorDatabase[Any]:
     """
-    Get MongoDB
+    Get MongoDB, or an in-process mock of it with the memory and SQLite storage
+    backends. The SQLite backend keeps every collection in SQLite, so nothing
+    is stored in its mock
     """
-    return AsyncIOMotorClient(settings.mongo_uri, tlsAllowInvalidCertificates=True)[
-        "Budget-app"
-    ]
+    if settings.storage_backend in ("memory", "sqlite"):
+        return AsyncMongoMockClient()["Budget-app"]
+
+    return AsyncIOMotorClient(
+        settings.mongo_uri,
+        tlsAllowInvalidCertificates=True,
+        minPoolSize=settings.mongo_min_pool_size,
+        maxPoolSize=settings.mongo_max_pool_size,
+    )["Budget-app"]
 
 
 db = get_db()
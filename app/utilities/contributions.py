@@ -0,0 +1,142 @@
+import sqlite3
+from datetime import datetime
+from typing import Any, Protocol
+
+import bson
+from bson import ObjectId
+from pymongo import ASCENDING, DESCENDING
+
+from app.models import epoch_micros
+from app.settings import settings
+from app.utilities.clients import db
+from app.utilities.deadlines import max_time_ms
+from app.utilities.sqlite import SQLiteTables, decode
+
+
+class ContributionStore(Protocol):
+    """
+    Storage for the log of contributions to wishlists.
+    """
+
+    async def insert(self, contribution: dict[str, Any]) -> None: ...
+
+    async def of_wishlist(self, wishlist_id: ObjectId) -> list[dict[str, Any]]: ...
+
+    async def create_indexes(self) -> None: ...
+
+
+class DocumentContributions:
+    """
+    One MongoDB document per contribution.
+    """
+
+    def __init__(self) -> None:
+        self.collection = db.wishlist_contributions
+
+    async def insert(self, contribution: dict[str, Any]) -> None:
+        await self.collection.insert_one(contribution)
+
+    async def of_wishlist(self, wishlist_id: ObjectId) -> list[dict[str, Any]]:
+        return await (
+            self.collection.find({"wishlist_id": wishlist_id})
+            .sort("created_at", DESCENDING)
+            .max_time_ms(max_time_ms())
+            .to_list(None)
+        )
+
+    async def create_indexes(self) -> None:
+        await self.collection.create_index(
+            [("wishlist_id", ASCENDING), ("created_at", DESCENDING)]
+        )
+
+
+class SQLiteContributions(SQLiteTables):
+    """
+    One BSON row per contribution in a SQLite table.
+    """
+
+    statements = (
+        "CREATE TABLE IF NOT EXISTS wishlist_contributions (id TEXT PRIMARY KEY,"
+        " wishlist_id TEXT NOT NULL, created_at INTEGER NOT NULL,"
+        " doc BLOB NOT NULL)",
+        "CREATE INDEX IF NOT EXISTS wishlist_contributions_wishlist_created"
+        " ON wishlist_contributions (wishlist_id, created_at)",
+    )
+
+    async def insert(self, contribution: dict[str, Any]) -> None:
+        contribution.setdefault("_id", ObjectId())
+        row = (
+            str(contribution["_id"]),
+            str(contribution["wishlist_id"]),
+            epoch_micros(contribution["created_at"]),
+            bson.encode(contribution),
+        )
+        await self.write(
+            lambda connection: connection.execute(
+                "INSERT INTO wishlist_contributions (id, wishlist_id, created_at, doc)"
+                " VALUES (?, ?, ?, ?)",
+                row,
+            )
+        )
+
+    async def of_wishlist(self, wishlist_id: ObjectId) -> list[dict[str, Any]]:
+        def select(connection: sqlite3.Connection) -> list[dict[str, Any]]:
+            rows = connection.execute(
+                "SELECT doc FROM wishlist_contributions WHERE wishlist_id = ?"
+                " ORDER BY created_at DESC",
+                (str(wishlist_id),),
+            )
+            return [decode(doc) for doc, in rows]
+
+        return await self.run(select)
+
+
+document_contributions = DocumentContributions()
+sqlite_contributions = SQLiteContributions()
+
+
+def contribution_store() -> ContributionStore:
+    """
+    Get the contributions in the configured backend: in SQLite with the SQLite
+    backend, in MongoDB otherwise.
+    """
+    if settings.storage_backend == "sqlite":
+        return sqlite_contributions
+
+    return document_contributions
+
+
+async def record_contribution(
+    wishlist: dict[str, Any],
+    user_id: str | None,
+    amount_minor: int,
+    created_at: datetime,
+) -> None:
+    """
+    Append a contribution to a wishlist's log, with the saved amount it led to.
+
+    The log is written after the saved amount changed, so a crash in between
+    leaves the amount right and the log one entry short.
+    """
+    await contribution_store().insert(
+        {
+            "wishlist_id": wishlist["_id"],
+            "ledger_id": wishlist.get("ledger_id"),
+            "user_id": user_id,
+            "amount_minor": amount_minor,
+            "currency": wishlist.get("currency"),
+            "saved_minor": wishlist.get("saved_minor", 0),
+            "created_at": created_at,
+        }
+    )
+
+
+async def contributions(wishlist_id: ObjectId) -> list[Any]:
+    """
+    A wishlist's contributions, newest first.
+    """
+    return await contribution_store().of_wishlist(wishlist_id)
+
+
+async def create_indexes() -> None:
+    await contribution_store().create_indexes()
@@ -0,0 +1,203 @@
+import asyncio
+import contextlib
+import time
+from contextvars import ContextVar
+
+import orjson
+from pymongo.errors import ExecutionTimeout
+from starlette.datastructures import Headers
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.settings import settings
+
+_deadline: ContextVar[float | None] = ContextVar("deadline", default=None)
+
+# Methods of requests that only read, and so can be stopped part way.
+READ_METHODS = frozenset({"GET", "HEAD", "OPTIONS"})
+
+
+class DeadlineExceeded(Exception):
+    """
+    A request ran out of its time budget.
+    """
+
+
+class DeadlineStats:
+    timed_out = 0
+    disconnected = 0
+
+
+stats = DeadlineStats()
+
+
+def budget_ms(path: str) -> int:
+    """
+    Time budget of a route, from the longest matching prefix in
+    `route_timeouts_ms`.
+    """
+    prefixes = [
+        prefix for prefix in settings.route_timeouts_ms if path.startswith(prefix)
+    ]
+    if not prefixes:
+        return settings.request_timeout_ms
+
+    return settings.route_timeouts_ms[max(prefixes, key=len)]
+
+
+def current_deadline() -> float | None:
+    """
+    Monotonic time the current request has to finish by.
+    """
+    return _deadline.get()
+
+
+def max_time_ms(cap: int | None = None) -> int | None:
+    """
+    maxTimeMS for a MongoDB operation: what is left of the request's budget,
+    at most `cap`.
+    """
+    deadline = _deadline.get()
+    if deadline is None:
+        return cap
+
+    remaining = max(1, int((deadline - time.monotonic()) * 1000))
+    return remaining if cap is None else min(remaining, cap)
+
+
+def time_limit() -> dict[str, int]:
+    """
+    maxTimeMS option for aggregations, which do not accept None.
+    """
+    limit = max_time_ms()
+    return {} if limit is None else {"maxTimeMS": limit}
+
+
+def is_read(scope: Scope) -> bool:
+    """
+    Whether a request only reads: by its method, or its path for reads sent
+    as POST, like batches.
+    """
+    return scope["method"] in READ_METHODS or scope["path"] in settings.read_paths
+
+
+def has_body(scope: Scope) -> bool:
+    headers = Headers(scope=scope)
+    return "transfer-encoding" in headers or headers.get("content-length", "0") != "0"
+
+
+class DeadlineMiddleware:
+    """
+    Run each read, batches included, within its route's time budget, and
+    cancel it when the budget runs out or the client disconnects, so
+    abandoned requests stop using the database.
+
+    Requests out of time get a 504 if their response has not started. Once
+    the request body is read, the client connection is watched for a
+    disconnect.
+
+    Writes always run to completion. Stopped after their document is
+    committed, they would skip saving their idempotency result and
+    invalidating caches, and a retry of the 504 would apply them again.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not is_read(scope):
+            await self.app(scope, receive, send)
+            return
+
+        deadline = time.monotonic() + budget_ms(scope["path"]) / 1000
+        body_read = asyncio.Event()
+        pending: list[Message] = []
+        started = False
+        finished = False
+
+        if not has_body(scope):
+            pending.append(await receive())
+            body_read.set()
+
+        async def receive_request() -> Message:
+            if pending:
+                return pending.pop()
+
+            message = await receive()
+            if message["type"] == "http.disconnect" or not message.get("more_body"):
+                body_read.set()
+            return message
+
+        async def send_response(message: Message) -> None:
+            nonlocal started, finished
+            if message["type"] == "http.response.start":
+                started = True
+            elif message["type"] == "http.response.body":
+                finished = not message.get("more_body", False)
+            await send(message)
+
+        async def watch_disconnect() -> None:
+            await body_read.wait()
+            while (await receive())["type"] != "http.disconnect":
+                pass
+            if finished:
+                # Sent in full, what runs after the response is not abandoned.
+                await asyncio.Event().wait()
+
+        token = _deadline.set(deadline)
+        try:
+            handler: asyncio.Future[None] = asyncio.ensure_future(
+                self.app(scope, receive_request, send_response)
+            )
+        finally:
+            _deadline.reset(token)
+        watcher = asyncio.create_task(watch_disconnect())
+
+        try:
+            done, _ = await asyncio.wait(
+                (handler, watcher),
+                timeout=max(0.0, deadline - time.monotonic()),
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+        except asyncio.CancelledError:
+            handler.cancel()
+            raise
+        finally:
+            watcher.cancel()
+
+        if handler not in done:
+            handler.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await handler
+            if watcher in done:
+                stats.disconnected += 1
+                if not started:
+                    # Never reaches the client, but shows up in access logs.
+                    await self.reply(send, 499, "Client closed the request.")
+                return
+
+            stats.timed_out += 1
+            if not started:
+                await self.reply(send, 504, "Request took too long.")
+            return
+
+        try:
+            handler.result()
+        except (DeadlineExceeded, ExecutionTimeout):
+            stats.timed_out += 1
+            if started:
+                raise
+            await self.reply(send, 504, "Request took too long.")
+
+    async def reply(self, send: Send, status_code: int, detail: str) -> None:
+        body = orjson.dumps({"detail": detail})
+        await send(
+            {
+                "type": "http.response.start",
+                "status": status_code,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode()),
+                ],
+            }
+        )
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,198 @@
+import calendar
+from dataclasses import dataclass
+from datetime import date, datetime
+
+import numpy as np
+import numpy.typing as npt
+
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+
+@dataclass
+class Columns:
+    """
+    A user's transactions as columns.
+
+    `days` are days since the epoch, `categories` index into `names`.
+    """
+
+    days: npt.NDArray[np.int64]
+    totals: npt.NDArray[np.float64]
+    categories: npt.NDArray[np.intp]
+    names: list[str]
+
+    @classmethod
+    def from_rows(
+        cls, created_at: list[datetime], totals: list[float], categories: list[str]
+    ) -> "Columns":
+        codes, names = encode(categories)
+        return cls(
+            days=epoch_days(created_at),
+            totals=np.array(totals, dtype=np.float64),
+            categories=codes,
+            names=names,
+        )
+
+
+def epoch_days(created_at: list[datetime]) -> npt.NDArray[np.int64]:
+    # Much faster than letting numpy convert datetime objects.
+    return np.fromiter(
+        (when.toordinal() - EPOCH_ORDINAL for when in created_at),
+        dtype=np.int64,
+        count=len(created_at),
+    )
+
+
+def encode(values: list[str]) -> tuple[npt.NDArray[np.intp], list[str]]:
+    """
+    Values as indexes into a list of distinct values.
+    """
+    codes: dict[str, int] = {}
+    return (
+        np.fromiter(
+            (codes.setdefault(value, len(codes)) for value in values),
+            dtype=np.intp,
+            count=len(values),
+        ),
+        list(codes),
+    )
+
+
+@dataclass
+class CategoryProjection:
+    category: str
+    spent: float
+    daily_mean_7: float
+    daily_mean_30: float
+    seasonality: float
+    projected: float
+    budget: float | None
+
+
+def epoch_day(day: date) -> int:
+    return int(np.datetime64(day, "D").astype(np.int64))
+
+
+def epoch_month(day: date) -> int:
+    return (day.year - 1970) * 12 + day.month - 1
+
+
+def project_month(
+    columns: Columns, budgets: dict[str, float], today: date
+) -> list[CategoryProjection]:
+    """
+    End-of-month projection per category.
+
+    The rest of the month is projected from the 30 day rolling daily mean, scaled
+    by how this calendar month compared to an average month in earlier years.
+    """
+    names = sorted(set(columns.names) | set(budgets))
+    index = np.array([names.index(name) for name in columns.names], dtype=np.intp)
+    categories = index[columns.categories]
+    n_categories = len(names)
+
+    today_day = epoch_day(today)
+    month_start = epoch_day(today.replace(day=1))
+    days_in_month = calendar.monthrange(today.year, today.month)[1]
+    remaining_days = days_in_month - today.day
+
+    keep = columns.days <= today_day
+    days, totals, categories = (
+        columns.days[keep],
+        columns.totals[keep],
+        categories[keep],
+    )
+
+    # Daily totals of the last 30 days, one row per category.
+    window = 30
+    recent = days > today_day - window
+    daily = np.bincount(
+        categories[recent] * window + (days[recent] - (today_day - window + 1)),
+        weights=totals[recent],
+        minlength=n_categories * window,
+    ).reshape(n_categories, window)
+    daily_mean_30 = daily.mean(axis=1)
+    daily_mean_7 = daily[:, -7:].mean(axis=1)
+
+    spent = np.bincount(
+        categories[days >= month_start],
+        weights=totals[days >= month_start],
+        minlength=n_categories,
+    )
+
+    # Monthly totals of complete months, one row per category.
+    months = days.astype("datetime64[D]").astype("datetime64[M]").astype(np.int64)
+    current_month = epoch_month(today)
+    seasonality = np.ones(n_categories)
+    if len(months) and months.min() < current_month:
+        first_month = int(months.min())
+        n_months = current_month - first_month
+        past = months < current_month
+        monthly = np.bincount(
+            categories[past] * n_months + (months[past] - first_month),
+            weights=totals[past],
+            minlength=n_categories * n_months,
+        ).reshape(n_categories, n_months)
+
+        same_month = (np.arange(first_month, current_month) % 12) == (
+            current_month % 12
+        )
+        if same_month.any():
+            average = monthly.mean(axis=1)
+            same_month_average = monthly[:, same_month].mean(axis=1)
+            seasonality = np.divide(
+                same_month_average,
+                average,
+                out=np.ones(n_categories),
+                where=average > 0,
+            )
+
+    projected = spent + daily_mean_30 * remaining_days * seasonality
+
+    return [
+        CategoryProjection(
+            category=name,
+            spent=float(spent[i]),
+            daily_mean_7=float(daily_mean_7[i]),
+            daily_mean_30=float(daily_mean_30[i]),
+            seasonality=float(seasonality[i]),
+            projected=float(projected[i]),
+            budget=budgets.get(name),
+        )
+        for i, name in enumerate(names)
+    ]
+
+
+@dataclass
+class CategoryYear:
+    category: str
+    months: list[float]
+    total: float
+
+
+def year_totals(columns: Columns, year: int) -> list[CategoryYear]:
+    """
+    Monthly totals per category over a calendar year.
+    """
+    first_month = epoch_month(date(year, 1, 1))
+    months = (
+        columns.days.astype("datetime64[D]").astype("datetime64[M]").astype(np.int64)
+        - first_month
+    )
+    in_year = (months >= 0) & (months < 12)
+    n_categories = len(columns.names)
+    monthly = np.bincount(
+        columns.categories[in_year] * 12 + months[in_year],
+        weights=columns.totals[in_year],
+        minlength=n_categories * 12,
+    ).reshape(n_categories, 12)
+
+    return [
+        CategoryYear(
+            category=name,
+            months=monthly[i].tolist(),
+            total=float(monthly[i].sum()),
+        )
+        for i, name in enumerate(columns.names)
+        if monthly[i].any()
+    ]
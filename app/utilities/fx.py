@@ -0,0 +1,142 @@
+import csv
+from dataclasses import dataclass, field
+from datetime import date
+
+import numpy as np
+import numpy.typing as npt
+
+from app.settings import settings
+from app.utilities.forecast import EPOCH_ORDINAL
+from app.utilities.log import logger
+from app.utilities.money import exponent
+
+
+class UnknownCurrency(ValueError):
+    def __init__(self, currency: str) -> None:
+        super().__init__(f"No exchange rate for {currency}")
+        self.currency = currency
+
+
+@dataclass
+class RateSeries:
+    """
+    Rates of one currency, `days` since the epoch in ascending order.
+    """
+
+    days: npt.NDArray[np.int64]
+    rates: npt.NDArray[np.float64]
+
+
+@dataclass
+class FxRates:
+    """
+    Daily exchange rates, as units of each currency per unit of `quote`.
+
+    A day without a rate, such as a weekend, uses the latest earlier rate,
+    found by binary search.
+    """
+
+    quote: str
+    series: dict[str, RateSeries] = field(default_factory=dict)
+
+    @classmethod
+    def from_csv(cls, path: str, quote: str) -> "FxRates":
+        """
+        Load a table with a date column followed by one column per currency,
+        as in the ECB's historical reference rates. Empty and N/A cells are
+        skipped.
+        """
+        columns: dict[str, tuple[list[int], list[float]]] = {}
+        with open(path, newline="") as file:
+            reader = csv.reader(file)
+            header = [name.strip() for name in next(reader)]
+            currencies = header[1:]
+            for currency in currencies:
+                if currency:
+                    columns[currency] = ([], [])
+
+            for row in reader:
+                if not row or not row[0].strip():
+                    continue
+                day = date.fromisoformat(row[0].strip()).toordinal() - EPOCH_ORDINAL
+                for currency, cell in zip(currencies, row[1:]):
+                    try:
+                        rate = float(cell)
+                    except ValueError:
+                        continue
+                    if currency:
+                        columns[currency][0].append(day)
+                        columns[currency][1].append(rate)
+
+        series = {}
+        for currency, (days, rates) in columns.items():
+            order = np.argsort(days, kind="stable")
+            series[currency] = RateSeries(
+                days=np.asarray(days, dtype=np.int64)[order],
+                rates=np.asarray(rates, dtype=np.float64)[order],
+            )
+
+        return cls(quote=quote, series=series)
+
+    def knows(self, currency: str) -> bool:
+        return currency == self.quote or currency in self.series
+
+    def rates(
+        self, currency: str, days: npt.NDArray[np.int64]
+    ) -> npt.NDArray[np.float64]:
+        """
+        Rate of a currency on each day.
+        """
+        if currency == self.quote:
+            return np.ones(len(days))
+
+        series = self.series.get(currency)
+        if series is None or not len(series.days):
+            raise UnknownCurrency(currency)
+
+        index = np.searchsorted(series.days, days, side="right") - 1
+        # Days before the first rate use the first rate.
+        return series.rates[np.clip(index, 0, None)]
+
+    def convert(
+        self,
+        amounts_minor: npt.NDArray[np.int64],
+        currencies: npt.NDArray[np.intp],
+        names: list[str],
+        days: npt.NDArray[np.int64],
+        to: str,
+    ) -> npt.NDArray[np.float64]:
+        """
+        Amounts in minor units of several currencies as major units of one,
+        each at the rate of its day. `currencies` index into `names`.
+        """
+        converted = np.empty(len(amounts_minor), dtype=np.float64)
+        target: npt.NDArray[np.float64] | None = None
+        for code, currency in enumerate(names):
+            rows = currencies == code
+            if not rows.any():
+                continue
+
+            major = amounts_minor[rows] / 10 ** exponent(currency)
+            if currency == to:
+                converted[rows] = major
+                continue
+
+            if target is None:
+                target = self.rates(to, days)
+            converted[rows] = major / self.rates(currency, days[rows]) * target[rows]
+
+        return converted
+
+
+fx_rates = FxRates(quote=settings.fx_quote_currency)
+
+
+def load_fx_rates() -> None:
+    """
+    Load the configured rate table, if any.
+    """
+    if settings.fx_rates_path:
+        loaded = FxRates.from_csv(settings.fx_rates_path, settings.fx_quote_currency)
+        fx_rates.series = loaded.series
+        logger.info("Loaded exchange rates of %s currencies", len(fx_rates.series))
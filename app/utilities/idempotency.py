@@ -0,0 +1,369 @@
+import asyncio
+import hashlib
+import sqlite3
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Any, AsyncIterator, Protocol
+
+import bson
+from fastapi import HTTPException, status
+from pydantic import BaseModel
+from pymongo.errors import DuplicateKeyError
+
+from app.models import epoch_micros
+from app.settings import settings
+from app.utilities.clients import db
+from app.utilities.sqlite import SQLiteTables, decode
+
+IDEMPOTENCY_COLLECTION = "idempotency_keys"
+
+
+class KeyStore(Protocol):
+    """
+    Storage for reserved Idempotency-Keys and the results of their requests,
+    which expire after the configured TTL.
+    """
+
+    async def reserve(self, key: str, fingerprint: str, now: datetime) -> bool: ...
+
+    async def get(self, key: str) -> dict[str, Any] | None: ...
+
+    async def take_over(
+        self, key: str, stale_before: datetime, now: datetime
+    ) -> bool: ...
+
+    async def save(self, key: str, result: dict[str, Any]) -> None: ...
+
+    async def release(self, key: str) -> None: ...
+
+    async def create_indexes(self) -> None: ...
+
+
+class DocumentKeys:
+    """
+    One MongoDB document per key, removed by a TTL index.
+    """
+
+    def __init__(self) -> None:
+        self.collection = db[IDEMPOTENCY_COLLECTION]
+
+    async def reserve(self, key: str, fingerprint: str, now: datetime) -> bool:
+        """
+        Reserve a key for a request, False if it is already taken.
+        """
+        try:
+            await self.collection.insert_one(
+                {
+                    "_id": key,
+                    "status": "pending",
+                    "fingerprint": fingerprint,
+                    "created_at": now,
+                }
+            )
+        except DuplicateKeyError:
+            return False
+
+        return True
+
+    async def get(self, key: str) -> dict[str, Any] | None:
+        doc: dict[str, Any] | None = await self.collection.find_one({"_id": key})
+        return doc
+
+    async def take_over(self, key: str, stale_before: datetime, now: datetime) -> bool:
+        """
+        Reserve a key again whose request has been pending since before a time.
+        """
+        update_result = await self.collection.update_one(
+            {"_id": key, "status": "pending", "created_at": {"$lt": stale_before}},
+            {"$set": {"created_at": now}},
+        )
+        return bool(update_result.matched_count)
+
+    async def save(self, key: str, result: dict[str, Any]) -> None:
+        await self.collection.update_one(
+            {"_id": key}, {"$set": {"status": "done", "result": result}}
+        )
+
+    async def release(self, key: str) -> None:
+        """
+        Give up a reservation whose request failed.
+        """
+        await self.collection.delete_one({"_id": key, "status": "pending"})
+
+    async def create_indexes(self) -> None:
+        await self.collection.create_index(
+            "created_at", expireAfterSeconds=settings.idempotency_ttl_seconds
+        )
+
+
+class SQLiteKeys(SQLiteTables):
+    """
+    One row per key in a SQLite table. Expired keys are deleted by the next
+    reservation and skipped until then.
+    """
+
+    statements = (
+        f"CREATE TABLE IF NOT EXISTS {IDEMPOTENCY_COLLECTION} (key TEXT PRIMARY KEY,"
+        " status TEXT NOT NULL, fingerprint TEXT NOT NULL,"
+        " created_at INTEGER NOT NULL, result BLOB)",
+        f"CREATE INDEX IF NOT EXISTS {IDEMPOTENCY_COLLECTION}_created"
+        f" ON {IDEMPOTENCY_COLLECTION} (created_at)",
+    )
+
+    @staticmethod
+    def _expired_before() -> int:
+        return epoch_micros(
+            datetime.now(timezone.utc)
+            - timedelta(seconds=settings.idempotency_ttl_seconds)
+        )
+
+    async def reserve(self, key: str, fingerprint: str, now: datetime) -> bool:
+        def reserve(connection: sqlite3.Connection) -> bool:
+            connection.execute(
+                f"DELETE FROM {IDEMPOTENCY_COLLECTION} WHERE created_at < ?",
+                (self._expired_before(),),
+            )
+            cursor = connection.execute(
+                f"INSERT OR IGNORE INTO {IDEMPOTENCY_COLLECTION}"
+                " (key, status, fingerprint, created_at) VALUES (?, 'pending', ?, ?)",
+                (key, fingerprint, epoch_micros(now)),
+            )
+            return cursor.rowcount > 0
+
+        return await self.write(reserve)
+
+    async def get(self, key: str) -> dict[str, Any] | None:
+        def select(connection: sqlite3.Connection) -> dict[str, Any] | None:
+            row = connection.execute(
+                f"SELECT status, fingerprint, result FROM {IDEMPOTENCY_COLLECTION}"
+                " WHERE key = ? AND created_at >= ?",
+                (key, self._expired_before()),
+            ).fetchone()
+            if row is None:
+                return None
+
+            key_status, fingerprint, result = row
+            return {
+                "_id": key,
+                "status": key_status,
+                "fingerprint": fingerprint,
+                "result": decode(result) if result is not None else None,
+            }
+
+        return await self.run(select)
+
+    async def take_over(self, key: str, stale_before: datetime, now: datetime) -> bool:
+        def take_over(connection: sqlite3.Connection) -> bool:
+            cursor = connection.execute(
+                f"UPDATE {IDEMPOTENCY_COLLECTION} SET created_at = ?"
+                " WHERE key = ? AND status = 'pending' AND created_at < ?",
+                (epoch_micros(now), key, epoch_micros(stale_before)),
+            )
+            return cursor.rowcount > 0
+
+        return await self.write(take_over)
+
+    async def save(self, key: str, result: dict[str, Any]) -> None:
+        await self.write(
+            lambda connection: connection.execute(
+                f"UPDATE {IDEMPOTENCY_COLLECTION} SET status = 'done', result = ?"
+                " WHERE key = ?",
+                (bson.encode(result), key),
+            )
+        )
+
+    async def release(self, key: str) -> None:
+        await self.write(
+            lambda connection: connection.execute(
+                f"DELETE FROM {IDEMPOTENCY_COLLECTION}"
+                " WHERE key = ? AND status = 'pending'",
+                (key,),
+            )
+        )
+
+
+document_keys = DocumentKeys()
+sqlite_keys = SQLiteKeys()
+
+
+def key_store() -> KeyStore:
+    """
+    Get the Idempotency-Keys in the configured backend: in SQLite with the
+    SQLite backend, in MongoDB otherwise.
+    """
+    if settings.storage_backend == "sqlite":
+        return sqlite_keys
+
+    return document_keys
+
+
+@dataclass
+class IdempotencySlot:
+    """
+    Reservation for one Idempotency-Key.
+
+    `result` is set when the key was already used and holds the original result.
+    """
+
+    key: str | None = None
+    fingerprint: str = ""
+    result: dict[str, Any] | None = None
+
+    async def save(self, result: dict[str, Any]) -> None:
+        """
+        Store the result so retries of the same key return it.
+        """
+        if self.key is None:
+            return
+
+        await key_store().save(self.key, result)
+        _remember(self.key, self.fingerprint, result)
+
+
+@dataclass
+class _KeyLock:
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+    users: int = 0
+
+
+_cache: OrderedDict[str, tuple[float, str, dict[str, Any]]] = OrderedDict()
+_locks: dict[str, _KeyLock] = {}
+
+
+def _remember(key: str, fingerprint: str, result: dict[str, Any]) -> None:
+    """
+    Put a result in the in-process front cache.
+    """
+    expires_at = time.monotonic() + settings.idempotency_ttl_seconds
+    _cache[key] = (expires_at, fingerprint, result)
+    _cache.move_to_end(key)
+    while len(_cache) > settings.idempotency_cache_size:
+        _cache.popitem(last=False)
+
+
+def _recall(key: str, fingerprint: str) -> dict[str, Any] | None:
+    """
+    Get a result from the in-process front cache.
+    """
+    cached = _cache.get(key)
+    if cached is None:
+        return None
+
+    expires_at, cached_fingerprint, result = cached
+    if expires_at < time.monotonic():
+        del _cache[key]
+        return None
+
+    if cached_fingerprint != fingerprint:
+        raise _fingerprint_mismatch()
+
+    return result
+
+
+def _fingerprint(payload: BaseModel, ledger_id: str | None) -> str:
+    content = payload.model_dump_json().encode()
+    if ledger_id is not None:
+        content += b"\n" + ledger_id.encode()
+    return hashlib.sha256(content).hexdigest()
+
+
+def _fingerprint_mismatch() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+        detail="Idempotency-Key was used with a different request.",
+    )
+
+
+async def _reserve(key: str, fingerprint: str) -> dict[str, Any] | None:
+    """
+    Reserve a key, or return the stored result of an earlier request.
+
+    Raises a 409 HTTPException if another request holds the key and a 422
+    HTTPException if the key was used for a different payload.
+    """
+    now = datetime.now(timezone.utc)
+    if await key_store().reserve(key, fingerprint, now):
+        return None
+
+    doc = await key_store().get(key)
+    if doc is None:
+        # Expired between the insert and the lookup, try once more.
+        return await _reserve(key, fingerprint)
+
+    if doc.get("fingerprint") != fingerprint:
+        raise _fingerprint_mismatch()
+
+    if doc.get("status") == "done":
+        result: dict[str, Any] = doc["result"]
+        return result
+
+    # A reservation left behind by a crashed worker can be taken over.
+    stale_before = now - timedelta(seconds=settings.idempotency_pending_timeout)
+    if not await key_store().take_over(key, stale_before, now):
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="A request with this Idempotency-Key is in progress.",
+        )
+
+    return None
+
+
+@asynccontextmanager
+async def idempotency_slot(
+    user_id: str | None,
+    scope: str,
+    idempotency_key: str | None,
+    payload: BaseModel,
+    ledger_id: str | None = None,
+) -> AsyncIterator[IdempotencySlot]:
+    """
+    Guard a create call with an Idempotency-Key.
+
+    The key must be retried with the same payload and, for calls that take
+    one, the same ledger, or it is rejected with a 422.
+
+    Concurrent retries of the same key in this process wait for the first one
+    and are answered from the front cache, so only one insert is made.
+    """
+    if not idempotency_key:
+        yield IdempotencySlot()
+        return
+
+    key = f"{scope}:{user_id}:{idempotency_key}"
+    fingerprint = _fingerprint(payload, ledger_id)
+    cached = _recall(key, fingerprint)
+    if cached is not None:
+        yield IdempotencySlot(key, fingerprint, cached)
+        return
+
+    key_lock = _locks.setdefault(key, _KeyLock())
+    key_lock.users += 1
+    try:
+        async with key_lock.lock:
+            cached = _recall(key, fingerprint)
+            if cached is not None:
+                yield IdempotencySlot(key, fingerprint, cached)
+                return
+
+            stored = await _reserve(key, fingerprint)
+            if stored is not None:
+                _remember(key, fingerprint, stored)
+                yield IdempotencySlot(key, fingerprint, stored)
+                return
+
+            try:
+                yield IdempotencySlot(key, fingerprint)
+            except BaseException:
+                await key_store().release(key)
+                raise
+    finally:
+        key_lock.users -= 1
+        if key_lock.users == 0:
+            _locks.pop(key, None)
+
+
+async def create_indexes() -> None:
+    await key_store().create_indexes()
@@ -0,0 +1,37 @@
+from app.utilities import (
+    alerts,
+    contributions,
+    idempotency,
+    jobs,
+    ledgers,
+    profiles,
+    schedule,
+)
+from app.utilities.changes import change_log
+from app.utilities.transactions import plan_store, transaction_store
+
+
+async def create_indexes() -> None:
+    """
+    Create the indexes queries rely on.
+
+    List routes filter on ledgers and optionally category, newest first, and
+    search uses one text index per collection.
+    """
+    for name in ("expenses", "bills"):
+        await transaction_store(name).create_indexes()
+
+    for name in ("budgets", "wishlists"):
+        await plan_store(name).create_indexes()
+
+    await idempotency.create_indexes()
+    await schedule.create_indexes()
+    await jobs.create_indexes()
+    await ledgers.create_indexes()
+    await contributions.create_indexes()
+    await alerts.create_indexes()
+    await profiles.create_indexes()
+
+    log = change_log()
+    if log is not None:
+        await log.create_indexes()
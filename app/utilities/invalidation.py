@@ -0,0 +1,94 @@
+import asyncio
+import contextlib
+import os
+import socket
+from typing import Any, Callable
+
+import orjson
+
+from app.utilities.log import logger
+
+InvalidationHandler = Callable[[list[Any]], None]
+
+
+class InvalidationBus:
+    """
+    Tells the other workers on this host which cached entries to drop.
+
+    Every worker binds a unix datagram socket in a shared directory and
+    publishing sends to every other socket there. Without a directory there is
+    only one worker, and nothing is sent. Delivery is best effort: a message
+    that does not fit a peer's buffer is dropped and logged.
+    """
+
+    def __init__(self) -> None:
+        self._handlers: dict[str, InvalidationHandler] = {}
+        self._socket: socket.socket | None = None
+        self._directory: str | None = None
+        self._path: str | None = None
+
+    def subscribe(self, kind: str, handler: InvalidationHandler) -> None:
+        """
+        Drop local entries when another worker publishes a kind of change.
+        """
+        self._handlers[kind] = handler
+
+    def start(self, directory: str | None) -> None:
+        if directory is None:
+            return
+
+        os.makedirs(directory, exist_ok=True)
+        self._directory = directory
+        self._path = os.path.join(directory, f"{os.getpid()}.sock")
+        # Left behind by an earlier process with the same pid.
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(self._path)
+
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._socket.setblocking(False)
+        self._socket.bind(self._path)
+        asyncio.get_running_loop().add_reader(self._socket.fileno(), self._receive)
+
+    def close(self) -> None:
+        if self._socket is None:
+            return
+
+        asyncio.get_running_loop().remove_reader(self._socket.fileno())
+        self._socket.close()
+        self._socket = None
+        if self._path is not None:
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(self._path)
+
+    def publish(self, kind: str, ids: list[Any]) -> None:
+        if self._socket is None or self._directory is None:
+            return
+
+        message = orjson.dumps({"kind": kind, "ids": ids})
+        for entry in os.scandir(self._directory):
+            if not entry.name.endswith(".sock") or entry.path == self._path:
+                continue
+            try:
+                self._socket.sendto(message, entry.path)
+            except (ConnectionRefusedError, FileNotFoundError):
+                # Left behind by a worker that exited.
+                with contextlib.suppress(FileNotFoundError):
+                    os.unlink(entry.path)
+            except BlockingIOError:
+                logger.warning("Dropped %s invalidation for %s", kind, entry.name)
+
+    def _receive(self) -> None:
+        assert self._socket is not None
+        while True:
+            try:
+                data = self._socket.recv(65536)
+            except BlockingIOError:
+                return
+
+            message = orjson.loads(data)
+            handler = self._handlers.get(message["kind"])
+            if handler is not None:
+                handler(message["ids"])
+
+
+bus = InvalidationBus()
@@ -0,0 +1,556 @@
+import asyncio
+import contextlib
+import multiprocessing
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Any, AsyncIterator, Awaitable, Callable, Protocol, TypeVar
+
+import bson
+from bson import ObjectId
+from pymongo import ASCENDING, DESCENDING, ReturnDocument
+
+from app.models import epoch_micros
+from app.settings import settings
+from app.utilities.clients import db
+from app.utilities.log import logger
+from app.utilities.sqlite import SQLiteTables, decode
+
+T = TypeVar("T")
+
+FINISHED = ("succeeded", "failed", "cancelled")
+
+
+class JobStore(Protocol):
+    """
+    Storage for jobs and their progress.
+    """
+
+    async def insert(self, job: dict[str, Any]) -> ObjectId: ...
+
+    async def get(self, job_id: ObjectId) -> dict[str, Any] | None: ...
+
+    async def latest(self, user_id: str | None, limit: int) -> list[dict[str, Any]]: ...
+
+    async def queued(self) -> list[ObjectId]: ...
+
+    async def set(self, job_id: ObjectId, fields: dict[str, Any]) -> bool: ...
+
+    async def set_if(
+        self, job_id: ObjectId, job_status: str, fields: dict[str, Any]
+    ) -> dict[str, Any] | None: ...
+
+    async def requeue(self, stale_before: datetime, now: datetime) -> None: ...
+
+    async def create_indexes(self) -> None: ...
+
+
+class DocumentJobs:
+    """
+    One MongoDB document per job.
+    """
+
+    def __init__(self) -> None:
+        self.collection = db.jobs
+
+    async def insert(self, job: dict[str, Any]) -> ObjectId:
+        insert_result = await self.collection.insert_one(job)
+        job_id: ObjectId = insert_result.inserted_id
+        return job_id
+
+    async def get(self, job_id: ObjectId) -> dict[str, Any] | None:
+        job: dict[str, Any] | None = await self.collection.find_one({"_id": job_id})
+        return job
+
+    async def latest(self, user_id: str | None, limit: int) -> list[dict[str, Any]]:
+        """
+        A user's jobs, newest first.
+        """
+        return await (
+            self.collection.find({"user_id": user_id})
+            .sort("created_at", DESCENDING)
+            .limit(limit)
+            .to_list(None)
+        )
+
+    async def queued(self) -> list[ObjectId]:
+        """
+        Ids of the queued jobs, oldest first.
+        """
+        return [
+            doc["_id"]
+            async for doc in self.collection.find(
+                {"status": "queued"}, {"_id": 1}
+            ).sort("created_at", ASCENDING)
+        ]
+
+    async def set(self, job_id: ObjectId, fields: dict[str, Any]) -> bool:
+        """
+        Set fields of a job, returns whether cancelling it was requested.
+        """
+        doc = await self.collection.find_one_and_update(
+            {"_id": job_id}, {"$set": fields}, projection={"cancel_requested": 1}
+        )
+        return bool(doc and doc.get("cancel_requested"))
+
+    async def set_if(
+        self, job_id: ObjectId, job_status: str, fields: dict[str, Any]
+    ) -> dict[str, Any] | None:
+        """
+        Set fields of a job in a status, returns the job as it is now or None
+        if it is not in that status.
+        """
+        doc: dict[str, Any] | None = await self.collection.find_one_and_update(
+            {"_id": job_id, "status": job_status},
+            {"$set": fields},
+            return_document=ReturnDocument.AFTER,
+        )
+        return doc
+
+    async def requeue(self, stale_before: datetime, now: datetime) -> None:
+        """
+        Queue jobs again whose worker stopped heartbeating, and fail tracked
+        ones, which ran inside a request that is gone.
+        """
+        stale = {"status": "running", "updated_at": {"$lt": stale_before}}
+        await self.collection.update_many(
+            stale | {"tracked": {"$ne": True}},
+            {"$set": {"status": "queued", "updated_at": now}},
+        )
+        await self.collection.update_many(
+            stale | {"tracked": True},
+            {
+                "$set": {
+                    "status": "failed",
+                    "error": "Interrupted",
+                    "finished_at": now,
+                    "updated_at": now,
+                }
+            },
+        )
+
+    async def create_indexes(self) -> None:
+        await self.collection.create_index(
+            [("user_id", ASCENDING), ("created_at", DESCENDING)]
+        )
+        await self.collection.create_index(
+            [("status", ASCENDING), ("created_at", ASCENDING)]
+        )
+
+
+class SQLiteJobs(SQLiteTables):
+    """
+    One row per job in a SQLite table, its document kept whole as BSON next to
+    copies of the fields jobs are looked up by.
+    """
+
+    statements = (
+        "CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, user_id TEXT,"
+        " status TEXT NOT NULL, tracked INTEGER NOT NULL,"
+        " created_at INTEGER NOT NULL, updated_at INTEGER NOT NULL,"
+        " doc BLOB NOT NULL)",
+        "CREATE INDEX IF NOT EXISTS jobs_user_created ON jobs (user_id, created_at)",
+        "CREATE INDEX IF NOT EXISTS jobs_status_created"
+        " ON jobs (status, created_at)",
+    )
+
+    @staticmethod
+    def _write(connection: sqlite3.Connection, doc: dict[str, Any]) -> None:
+        connection.execute(
+            "INSERT OR REPLACE INTO jobs (id, user_id, status, tracked, created_at,"
+            " updated_at, doc) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                str(doc["_id"]),
+                doc["user_id"],
+                doc["status"],
+                bool(doc.get("tracked")),
+                epoch_micros(doc["created_at"]),
+                epoch_micros(doc["updated_at"]),
+                bson.encode(doc),
+            ),
+        )
+
+    @staticmethod
+    def _read(
+        connection: sqlite3.Connection, condition: str, params: list[Any]
+    ) -> list[dict[str, Any]]:
+        rows = connection.execute(f"SELECT doc FROM jobs WHERE {condition}", params)
+        return [decode(doc) for doc, in rows]
+
+    async def insert(self, job: dict[str, Any]) -> ObjectId:
+        job.setdefault("_id", ObjectId())
+        await self.write(lambda connection: self._write(connection, job))
+        job_id: ObjectId = job["_id"]
+        return job_id
+
+    async def get(self, job_id: ObjectId) -> dict[str, Any] | None:
+        jobs = await self.run(
+            lambda connection: self._read(connection, "id = ?", [str(job_id)])
+        )
+        return jobs[0] if jobs else None
+
+    async def latest(self, user_id: str | None, limit: int) -> list[dict[str, Any]]:
+        return await self.run(
+            lambda connection: self._read(
+                connection,
+                "user_id IS ? ORDER BY created_at DESC LIMIT ?",
+                [user_id, limit],
+            )
+        )
+
+    async def queued(self) -> list[ObjectId]:
+        def select(connection: sqlite3.Connection) -> list[ObjectId]:
+            rows = connection.execute(
+                "SELECT id FROM jobs WHERE status = 'queued' ORDER BY created_at"
+            )
+            return [ObjectId(job_id) for job_id, in rows]
+
+        return await self.run(select)
+
+    def _update(
+        self,
+        connection: sqlite3.Connection,
+        condition: str,
+        params: list[Any],
+        fields: dict[str, Any],
+    ) -> list[dict[str, Any]]:
+        docs = [doc | fields for doc in self._read(connection, condition, params)]
+        for doc in docs:
+            self._write(connection, doc)
+        return docs
+
+    async def set(self, job_id: ObjectId, fields: dict[str, Any]) -> bool:
+        docs = await self.write(
+            lambda connection: self._update(connection, "id = ?", [str(job_id)], fields)
+        )
+        return bool(docs and docs[0].get("cancel_requested"))
+
+    async def set_if(
+        self, job_id: ObjectId, job_status: str, fields: dict[str, Any]
+    ) -> dict[str, Any] | None:
+        docs = await self.write(
+            lambda connection: self._update(
+                connection, "id = ? AND status = ?", [str(job_id), job_status], fields
+            )
+        )
+        return docs[0] if docs else None
+
+    async def requeue(self, stale_before: datetime, now: datetime) -> None:
+        stale = "status = 'running' AND updated_at < ? AND tracked = ?"
+
+        def requeue(connection: sqlite3.Connection) -> None:
+            self._update(
+                connection,
+                stale,
+                [epoch_micros(stale_before), False],
+                {"status": "queued", "updated_at": now},
+            )
+            self._update(
+                connection,
+                stale,
+                [epoch_micros(stale_before), True],
+                {
+                    "status": "failed",
+                    "error": "Interrupted",
+                    "finished_at": now,
+                    "updated_at": now,
+                },
+            )
+
+        await self.write(requeue)
+
+
+document_jobs = DocumentJobs()
+sqlite_jobs = SQLiteJobs()
+
+
+def job_store() -> JobStore:
+    """
+    Get the jobs in the configured backend: in SQLite with the SQLite backend,
+    in MongoDB otherwise.
+    """
+    if settings.storage_backend == "sqlite":
+        return sqlite_jobs
+
+    return document_jobs
+
+
+class JobCancelled(Exception):
+    """
+    Raised at a progress update once cancellation was requested.
+    """
+
+
+@dataclass
+class JobContext:
+    """
+    What a job handler gets to work with.
+    """
+
+    id: ObjectId
+    user_id: str | None
+    params: dict[str, Any]
+    runner: "JobRunner"
+    result: dict[str, Any] | None = None
+
+    async def progress(self, done: int, total: int | None = None, **info: Any) -> None:
+        """
+        Record how far the job got, raises JobCancelled if it should stop.
+        """
+        if await job_store().set(
+            self.id,
+            {
+                "progress": {"done": done, "total": total, **info},
+                "updated_at": datetime.now(timezone.utc),
+            },
+        ):
+            raise JobCancelled()
+
+    async def run_cpu(self, fn: Callable[..., T], *args: Any) -> T:
+        """
+        Run a CPU bound step in the process pool.
+
+        The function and its arguments must be picklable.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.runner.process_pool(), fn, *args)
+
+
+JobHandler = Callable[[JobContext], Awaitable[dict[str, Any] | None]]
+
+_handlers: dict[str, JobHandler] = {}
+
+
+def job_handler(kind: str) -> Callable[[JobHandler], JobHandler]:
+    """
+    Register the handler of a kind of job.
+    """
+
+    def register(handler: JobHandler) -> JobHandler:
+        _handlers[kind] = handler
+        return handler
+
+    return register
+
+
+class JobRunner:
+    """
+    In-process job queue backed by the `jobs` collection.
+
+    Jobs are stored before they are queued, so jobs still queued, or running
+    in a process that died, are picked up again on start. A bounded number of
+    workers run jobs concurrently, and running jobs heartbeat so that
+    cancellation requested from another process reaches them.
+    """
+
+    def __init__(self) -> None:
+        self._queue: asyncio.Queue[ObjectId] | None = None
+        self._workers: list[asyncio.Task[None]] = []
+        self._running: dict[ObjectId, asyncio.Task[None]] = {}
+        self._pool: ProcessPoolExecutor | None = None
+        self._closing = False
+
+    def process_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                max_workers=settings.job_process_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+
+        return self._pool
+
+    async def start(self) -> None:
+        """
+        Requeue unfinished jobs and start the workers.
+        """
+        self._closing = False
+        self._queue = asyncio.Queue()
+        now = datetime.now(timezone.utc)
+        await job_store().requeue(
+            now - timedelta(seconds=settings.job_stale_seconds), now
+        )
+        for job_id in await job_store().queued():
+            self._queue.put_nowait(job_id)
+
+        self._workers = [
+            asyncio.create_task(self._work()) for _ in range(settings.job_workers)
+        ]
+
+    async def close(self) -> None:
+        """
+        Stop the workers, jobs that were running are queued again.
+        """
+        self._closing = True
+        for task in [*self._workers, *self._running.values()]:
+            task.cancel()
+        await asyncio.gather(
+            *self._workers, *self._running.values(), return_exceptions=True
+        )
+        self._workers = []
+
+        if self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+            self._pool = None
+
+    async def submit(
+        self, user_id: str | None, kind: str, params: dict[str, Any]
+    ) -> ObjectId:
+        """
+        Store and queue a job.
+        """
+        if kind not in _handlers:
+            raise ValueError(f"Unknown job kind {kind}")
+        if self._queue is None:
+            raise RuntimeError("Job runner is not started")
+
+        now = datetime.now(timezone.utc)
+        job_id = await job_store().insert(
+            {
+                "user_id": user_id,
+                "kind": kind,
+                "params": params,
+                "status": "queued",
+                "created_at": now,
+                "updated_at": now,
+            }
+        )
+        self._queue.put_nowait(job_id)
+
+        return job_id
+
+    @asynccontextmanager
+    async def track(
+        self, user_id: str | None, kind: str, params: dict[str, Any]
+    ) -> AsyncIterator[JobContext]:
+        """
+        Record work done in the current task, such as a request, as a job.
+
+        The job's result is what the block stores in `result` on the context.
+        """
+        now = datetime.now(timezone.utc)
+        job_id = await job_store().insert(
+            {
+                "user_id": user_id,
+                "kind": kind,
+                "params": params,
+                "status": "running",
+                "tracked": True,
+                "created_at": now,
+                "started_at": now,
+                "updated_at": now,
+            }
+        )
+        context = JobContext(id=job_id, user_id=user_id, params=params, runner=self)
+
+        update: dict[str, Any]
+        try:
+            yield context
+            update = {"status": "succeeded", "result": context.result}
+        except (JobCancelled, asyncio.CancelledError):
+            update = {"status": "cancelled"}
+            raise
+        except Exception as e:
+            update = {"status": "failed", "error": str(e)}
+            raise
+        finally:
+            now = datetime.now(timezone.utc)
+            await job_store().set(
+                context.id, update | {"finished_at": now, "updated_at": now}
+            )
+
+    async def cancel(self, user_id: str | None, job_id: ObjectId) -> Any:
+        """
+        Cancel a job, returns the job or None if the user has no such job.
+        """
+        doc = await job_store().get(job_id)
+        if doc is None or doc["user_id"] != user_id:
+            return None
+
+        now = datetime.now(timezone.utc)
+        cancelled = await job_store().set_if(
+            job_id,
+            "queued",
+            {"status": "cancelled", "finished_at": now, "updated_at": now},
+        )
+        if cancelled:
+            return cancelled
+
+        cancel_requested = await job_store().set_if(
+            job_id, "running", {"cancel_requested": True}
+        )
+        if cancel_requested:
+            task = self._running.get(job_id)
+            if task is not None:
+                task.cancel()
+            return cancel_requested
+
+        return await job_store().get(job_id)
+
+    async def _work(self) -> None:
+        assert self._queue is not None
+        while True:
+            job_id = await self._queue.get()
+            now = datetime.now(timezone.utc)
+            doc = await job_store().set_if(
+                job_id,
+                "queued",
+                {"status": "running", "started_at": now, "updated_at": now},
+            )
+            if doc is None:
+                # Cancelled while queued, or claimed by another process.
+                continue
+
+            task = asyncio.create_task(self._run(doc))
+            self._running[job_id] = task
+            try:
+                # Unlike awaiting the task, this does not cancel the job when
+                # the worker is cancelled.
+                await asyncio.wait([task])
+            finally:
+                self._running.pop(job_id, None)
+
+    async def _run(self, doc: Any) -> None:
+        context = JobContext(
+            id=doc["_id"], user_id=doc["user_id"], params=doc["params"], runner=self
+        )
+        task = asyncio.current_task()
+        assert task is not None
+        heartbeat = asyncio.create_task(self._heartbeat(doc["_id"], task))
+
+        update: dict[str, Any]
+        try:
+            result = await _handlers[doc["kind"]](context)
+            update = {"status": "succeeded", "result": result}
+        except (JobCancelled, asyncio.CancelledError):
+            update = {"status": "queued" if self._closing else "cancelled"}
+        except Exception as e:
+            logger.exception("Job %s of kind %s failed", doc["_id"], doc["kind"])
+            update = {"status": "failed", "error": str(e)}
+        finally:
+            heartbeat.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await heartbeat
+
+        now = datetime.now(timezone.utc)
+        update["updated_at"] = now
+        if update["status"] in FINISHED:
+            update["finished_at"] = now
+        await job_store().set(doc["_id"], update)
+
+    async def _heartbeat(self, job_id: ObjectId, task: asyncio.Task[Any]) -> None:
+        while True:
+            await asyncio.sleep(settings.job_heartbeat_seconds)
+            if await job_store().set(
+                job_id, {"updated_at": datetime.now(timezone.utc)}
+            ):
+                task.cancel()
+                return
+
+
+async def create_indexes() -> None:
+    await job_store().create_indexes()
+
+
+runner = JobRunner()
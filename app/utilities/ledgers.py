@@ -0,0 +1,438 @@
+import sqlite3
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any, Iterable, Protocol
+
+import bson
+from bson import ObjectId
+from fastapi import HTTPException, status
+from pymongo import ASCENDING
+
+from app.settings import settings
+from app.utilities.clients import db
+from app.utilities.invalidation import bus
+from app.utilities.log import logger
+from app.utilities.sqlite import SQLiteTables, decode
+
+ROLES = ("owner", "editor", "viewer")
+WRITE_ROLES = ("owner", "editor")
+
+# Collections whose documents belong to a ledger.
+LEDGER_COLLECTIONS = (
+    "expenses",
+    "bills",
+    "budgets",
+    "wishlists",
+    "bill_schedules",
+    "bill_occurrences",
+)
+
+# Marks the ledger id backfill as done in the migrations collection.
+LEDGER_IDS_MIGRATION = "ledger_ids"
+
+
+@dataclass(frozen=True)
+class Access:
+    """
+    Ledgers a user can read and write.
+
+    Every user has a personal ledger whose id is the user's id, shared ledgers
+    have the id of their `ledgers` document.
+    """
+
+    user_id: str | None
+    readable: list[str | None]
+    writable: list[str | None]
+
+    def ledger(self, ledger_id: str | None) -> str | None:
+        """
+        Ledger to write a new document to, the personal one by default.
+        """
+        if ledger_id is None:
+            return self.user_id
+
+        if ledger_id not in self.writable:
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="No write access to ledger.",
+            )
+
+        return ledger_id
+
+
+class LedgerStore(Protocol):
+    """
+    Storage for shared ledgers and their members.
+    """
+
+    async def roles(self, user_id: str | None) -> dict[str, str]: ...
+
+    async def member_of(self, user_id: str | None) -> list[dict[str, Any]]: ...
+
+    async def insert(self, ledger: dict[str, Any]) -> ObjectId: ...
+
+    async def put_member(
+        self,
+        ledger_id: ObjectId,
+        owner_id: str | None,
+        member_id: str,
+        role: str,
+    ) -> bool: ...
+
+    async def remove_member(
+        self, ledger_id: ObjectId, user_id: str | None, member_id: str
+    ) -> bool: ...
+
+    async def is_member(self, ledger_id: ObjectId, user_id: str | None) -> bool: ...
+
+    async def create_indexes(self) -> None: ...
+
+
+class DocumentLedgers:
+    """
+    One MongoDB document per ledger, with its members in an array.
+    """
+
+    def __init__(self) -> None:
+        self.collection = db.ledgers
+
+    @staticmethod
+    def owned_by(ledger_id: ObjectId, user_id: str | None) -> dict[str, Any]:
+        """
+        Filter for a ledger the user owns.
+        """
+        return {
+            "_id": ledger_id,
+            "members": {"$elemMatch": {"user_id": user_id, "role": "owner"}},
+        }
+
+    async def roles(self, user_id: str | None) -> dict[str, str]:
+        """
+        The user's role in each ledger they are a member of.
+        """
+        return {
+            str(ledger["_id"]): ledger["members"][0]["role"]
+            async for ledger in self.collection.find(
+                {"members.user_id": user_id},
+                {"members": {"$elemMatch": {"user_id": user_id}}},
+            )
+        }
+
+    async def member_of(self, user_id: str | None) -> list[dict[str, Any]]:
+        return await self.collection.find({"members.user_id": user_id}).to_list(None)
+
+    async def insert(self, ledger: dict[str, Any]) -> ObjectId:
+        insert_result = await self.collection.insert_one(ledger)
+        ledger_id: ObjectId = insert_result.inserted_id
+        return ledger_id
+
+    async def put_member(
+        self,
+        ledger_id: ObjectId,
+        owner_id: str | None,
+        member_id: str,
+        role: str,
+    ) -> bool:
+        """
+        Add a member to a ledger the owner owns or change their role, False if
+        there is no such ledger.
+        """
+        update_result = await self.collection.update_one(
+            self.owned_by(ledger_id, owner_id)
+            | {"members.user_id": {"$ne": member_id}},
+            {"$push": {"members": {"user_id": member_id, "role": role}}},
+        )
+        if update_result.matched_count == 0:
+            update_result = await self.collection.update_one(
+                self.owned_by(ledger_id, owner_id) | {"members.user_id": member_id},
+                {"$set": {"members.$[member].role": role}},
+                array_filters=[{"member.user_id": member_id}],
+            )
+
+        return bool(update_result.matched_count)
+
+    async def remove_member(
+        self, ledger_id: ObjectId, user_id: str | None, member_id: str
+    ) -> bool:
+        """
+        Remove a member, False if there is no such member the user can remove.
+
+        Owners remove others, members other than owners remove themselves.
+        """
+        if member_id == user_id:
+            query: dict[str, Any] = {
+                "_id": ledger_id,
+                "members": {
+                    "$elemMatch": {"user_id": user_id, "role": {"$ne": "owner"}}
+                },
+            }
+        else:
+            query = self.owned_by(ledger_id, user_id) | {"members.user_id": member_id}
+
+        update_result = await self.collection.update_one(
+            query, {"$pull": {"members": {"user_id": member_id}}}
+        )
+        return bool(update_result.matched_count)
+
+    async def is_member(self, ledger_id: ObjectId, user_id: str | None) -> bool:
+        ledger = await self.collection.find_one(
+            {"_id": ledger_id, "members.user_id": user_id}, {"_id": 1}
+        )
+        return ledger is not None
+
+    async def create_indexes(self) -> None:
+        await self.collection.create_index([("members.user_id", ASCENDING)])
+
+
+class SQLiteLedgers(SQLiteTables):
+    """
+    Ledgers in a SQLite table and their members in another, one row each.
+    """
+
+    statements = (
+        "CREATE TABLE IF NOT EXISTS ledgers (id TEXT PRIMARY KEY, doc BLOB NOT NULL)",
+        "CREATE TABLE IF NOT EXISTS ledger_members (ledger_id TEXT NOT NULL,"
+        " user_id TEXT, role TEXT NOT NULL, PRIMARY KEY (ledger_id, user_id))",
+        "CREATE INDEX IF NOT EXISTS ledger_members_user"
+        " ON ledger_members (user_id, ledger_id)",
+    )
+
+    @staticmethod
+    def _role(
+        connection: sqlite3.Connection, ledger_id: ObjectId, user_id: str | None
+    ) -> str | None:
+        row = connection.execute(
+            "SELECT role FROM ledger_members WHERE ledger_id = ? AND user_id IS ?",
+            (str(ledger_id), user_id),
+        ).fetchone()
+        return row[0] if row else None
+
+    async def roles(self, user_id: str | None) -> dict[str, str]:
+        def select(connection: sqlite3.Connection) -> dict[str, str]:
+            rows = connection.execute(
+                "SELECT ledger_id, role FROM ledger_members WHERE user_id IS ?",
+                (user_id,),
+            )
+            return dict(rows.fetchall())
+
+        return await self.run(select)
+
+    async def member_of(self, user_id: str | None) -> list[dict[str, Any]]:
+        def select(connection: sqlite3.Connection) -> list[dict[str, Any]]:
+            ledgers = {
+                ledger_id: decode(doc) | {"members": []}
+                for ledger_id, doc in connection.execute(
+                    "SELECT id, doc FROM ledgers WHERE id IN"
+                    " (SELECT ledger_id FROM ledger_members WHERE user_id IS ?)"
+                    " ORDER BY id",
+                    (user_id,),
+                )
+            }
+            for ledger_id, member_id, role in connection.execute(
+                "SELECT ledger_id, user_id, role FROM ledger_members WHERE ledger_id"
+                " IN (SELECT ledger_id FROM ledger_members WHERE user_id IS ?)"
+                " ORDER BY rowid",
+                (user_id,),
+            ):
+                ledgers[ledger_id]["members"].append(
+                    {"user_id": member_id, "role": role}
+                )
+            return list(ledgers.values())
+
+        return await self.run(select)
+
+    async def insert(self, ledger: dict[str, Any]) -> ObjectId:
+        ledger_id = ObjectId()
+        doc = {"_id": ledger_id} | {
+            field: value for field, value in ledger.items() if field != "members"
+        }
+
+        def insert(connection: sqlite3.Connection) -> None:
+            connection.execute(
+                "INSERT INTO ledgers (id, doc) VALUES (?, ?)",
+                (str(ledger_id), bson.encode(doc)),
+            )
+            connection.executemany(
+                "INSERT INTO ledger_members (ledger_id, user_id, role)"
+                " VALUES (?, ?, ?)",
+                [
+                    (str(ledger_id), member["user_id"], member["role"])
+                    for member in ledger["members"]
+                ],
+            )
+
+        await self.write(insert)
+        return ledger_id
+
+    async def put_member(
+        self,
+        ledger_id: ObjectId,
+        owner_id: str | None,
+        member_id: str,
+        role: str,
+    ) -> bool:
+        def put(connection: sqlite3.Connection) -> bool:
+            if self._role(connection, ledger_id, owner_id) != "owner":
+                return False
+            connection.execute(
+                "INSERT INTO ledger_members (ledger_id, user_id, role) VALUES (?, ?, ?)"
+                " ON CONFLICT (ledger_id, user_id) DO UPDATE SET role = excluded.role",
+                (str(ledger_id), member_id, role),
+            )
+            return True
+
+        return await self.write(put)
+
+    async def remove_member(
+        self, ledger_id: ObjectId, user_id: str | None, member_id: str
+    ) -> bool:
+        def remove(connection: sqlite3.Connection) -> bool:
+            role = self._role(connection, ledger_id, member_id)
+            if role is None:
+                return False
+            if member_id == user_id:
+                if role == "owner":
+                    return False
+            elif self._role(connection, ledger_id, user_id) != "owner":
+                return False
+            connection.execute(
+                "DELETE FROM ledger_members WHERE ledger_id = ? AND user_id IS ?",
+                (str(ledger_id), member_id),
+            )
+            return True
+
+        return await self.write(remove)
+
+    async def is_member(self, ledger_id: ObjectId, user_id: str | None) -> bool:
+        role = await self.run(
+            lambda connection: self._role(connection, ledger_id, user_id)
+        )
+        return role is not None
+
+
+document_ledgers = DocumentLedgers()
+sqlite_ledgers = SQLiteLedgers()
+
+
+def ledger_store() -> LedgerStore:
+    """
+    Get the ledgers in the configured backend: in SQLite with the SQLite
+    backend, in MongoDB otherwise.
+    """
+    if settings.storage_backend == "sqlite":
+        return sqlite_ledgers
+
+    return document_ledgers
+
+
+_access: OrderedDict[str | None, tuple[float, Access]] = OrderedDict()
+
+
+async def ledger_access(user_id: str | None) -> Access:
+    """
+    A user's ledgers, cached for a short while.
+    """
+    cached = _access.get(user_id)
+    if cached is not None and cached[0] > time.monotonic():
+        _access.move_to_end(user_id)
+        return cached[1]
+
+    readable = [user_id]
+    writable = [user_id]
+    for ledger_id, role in (await ledger_store().roles(user_id)).items():
+        readable.append(ledger_id)
+        if role in WRITE_ROLES:
+            writable.append(ledger_id)
+
+    access = Access(user_id=user_id, readable=readable, writable=writable)
+    _access[user_id] = (time.monotonic() + settings.access_cache_seconds, access)
+    while len(_access) > settings.access_cache_users:
+        _access.popitem(last=False)
+
+    return access
+
+
+def drop_access(user_ids: Iterable[str | None]) -> None:
+    for user_id in user_ids:
+        _access.pop(user_id, None)
+
+
+def invalidate_access(user_ids: Iterable[str | None]) -> None:
+    """
+    Forget the cached ledgers of users whose memberships changed, in every
+    worker.
+    """
+    user_ids = list(user_ids)
+    drop_access(user_ids)
+    bus.publish("access", user_ids)
+
+
+bus.subscribe("access", drop_access)
+
+
+async def backfill_ledger_ids() -> dict[str, int]:
+    """
+    Put documents written before ledgers existed into their owner's personal
+    ledger. Documents that already have a ledger are left alone.
+    """
+    personal_ledger: list[dict[str, Any]] = [{"$set": {"ledger_id": "$user_id"}}]
+    updated = {}
+    for name in LEDGER_COLLECTIONS:
+        update_result = await db[name].update_many(
+            {"ledger_id": {"$exists": False}}, personal_ledger
+        )
+        updated[name] = update_result.modified_count
+
+    for name in ("expenses", "bills"):
+        update_result = await db[f"{name}_buckets"].update_many(
+            {"entries": {"$elemMatch": {"ledger_id": {"$exists": False}}}},
+            [
+                {
+                    "$set": {
+                        "entries": {
+                            "$map": {
+                                "input": "$entries",
+                                "in": {
+                                    "$mergeObjects": [
+                                        {"ledger_id": "$user_id"},
+                                        "$$this",
+                                    ]
+                                },
+                            }
+                        }
+                    }
+                }
+            ],
+        )
+        updated[f"{name}_buckets"] = update_result.modified_count
+
+    return updated
+
+
+async def ensure_ledger_ids() -> None:
+    """
+    Backfill ledger ids on startup, unless an earlier start already finished
+    it for this database, so documents from before ledgers never drop out of
+    their owner's lists. Only MongoDB databases can have such documents.
+    """
+    if settings.storage_backend != "mongo":
+        return
+
+    if await db.migrations.find_one({"_id": LEDGER_IDS_MIGRATION}) is not None:
+        return
+
+    for name, updated in (await backfill_ledger_ids()).items():
+        if updated:
+            logger.info("Put %s %s into personal ledgers", updated, name)
+
+    await db.migrations.update_one(
+        {"_id": LEDGER_IDS_MIGRATION},
+        {"$set": {"done_at": datetime.now(timezone.utc)}},
+        upsert=True,
+    )
+
+
+async def create_indexes() -> None:
+    await ledger_store().create_indexes()
@@ -0,0 +1,120 @@
+import asyncio
+import time
+from collections import deque
+
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from app.settings import settings
+from app.utilities.responses import ORJSONResponse
+
+
+class AdaptiveLimiter:
+    """
+    Limit on requests handled at once, adjusted by AIMD on their latency.
+
+    Every request finishing within the latency target raises the limit by
+    1 / limit, so about one per limit's worth of requests. A slower one cuts
+    it by the backoff factor, at most once per target interval, so a burst of
+    slow requests counts as one signal. Requests over the limit wait in a
+    queue, and are shed once the queue is full.
+    """
+
+    def __init__(self) -> None:
+        self.limit = float(settings.limiter_initial_limit)
+        self.in_flight = 0
+        self.shed = 0
+        self.priority = 0
+        self._waiters: deque[asyncio.Future[None]] = deque()
+        self._last_decrease = 0.0
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self) -> bool:
+        """
+        Wait for a slot, False when the request should be shed instead.
+        """
+        if self.in_flight < int(self.limit) and not self._waiters:
+            self.in_flight += 1
+            return True
+
+        if len(self._waiters) >= settings.limiter_max_queue:
+            self.shed += 1
+            return False
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # Handed a slot just as the request went away.
+                self._release()
+            else:
+                self._waiters.remove(waiter)
+            raise
+
+        return True
+
+    def release(self, latency: float) -> None:
+        """
+        Free a slot and adjust the limit to the request's latency.
+        """
+        target = settings.limiter_latency_target_ms / 1000
+        if latency <= target:
+            self.limit = min(settings.limiter_max_limit, self.limit + 1 / self.limit)
+        elif time.monotonic() - self._last_decrease > target:
+            self.limit = max(
+                settings.limiter_min_limit, self.limit * settings.limiter_backoff
+            )
+            self._last_decrease = time.monotonic()
+
+        self._release()
+
+    def _release(self) -> None:
+        self.in_flight -= 1
+        while self._waiters and self.in_flight < int(self.limit):
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+
+
+limiter = AdaptiveLimiter()
+
+
+class ConcurrencyLimitMiddleware:
+    """
+    Admit requests through the adaptive limiter, answering 503 with
+    Retry-After to the ones it sheds. Priority paths, like health checks and
+    login, bypass it.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        if scope["path"] in settings.limiter_priority_paths:
+            limiter.priority += 1
+            await self.app(scope, receive, send)
+            return
+
+        if not await limiter.acquire():
+            response = ORJSONResponse(
+                {"detail": "Server is overloaded, retry later."},
+                status_code=503,
+                headers={"Retry-After": str(settings.limiter_retry_after_seconds)},
+            )
+            await response(scope, receive, send)
+            return
+
+        start = time.monotonic()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limiter.release(time.monotonic() - start)
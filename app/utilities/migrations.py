@@ -0,0 +1,150 @@
+from collections import defaultdict
+from datetime import datetime
+from typing import Any
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from app.settings import settings
+from app.utilities.archive import (
+    ColdStore,
+    archive_cutoff,
+    cold_store,
+    pack,
+)
+from app.utilities.log import logger
+from app.utilities.stores.base import (
+    TransactionStore,
+    month_of,
+)
+from app.utilities.stores.bucket import BucketStore
+from app.utilities.stores.document import DocumentStore
+from app.utilities.transactions import hot_store
+
+
+async def migrate_to_buckets(name: str, batch_size: int = 1000) -> int:
+    """
+    Move documents of a collection into buckets.
+
+    Entries keep their ids and documents are only removed once their bucket
+    write succeeded, so an interrupted migration can simply be run again.
+    """
+    documents = DocumentStore(name)
+    buckets = BucketStore(name)
+    moved = 0
+
+    while True:
+        batch = await documents.collection.find().limit(batch_size).to_list(None)
+        if not batch:
+            break
+
+        ids = [doc["_id"] for doc in batch]
+        already_moved = {
+            entry["_id"]
+            async for bucket in buckets.collection.find(
+                {"entries._id": {"$in": ids}}, {"entries._id": 1}
+            )
+            for entry in bucket["entries"]
+        }
+
+        grouped: dict[tuple[Any, ...], list[dict[str, Any]]] = defaultdict(list)
+        for doc in batch:
+            if doc["_id"] not in already_moved:
+                key = buckets.bucket_key(doc)
+                grouped[tuple(key.values())].append(buckets.to_entry(doc))
+
+        operations = [
+            UpdateOne(
+                dict(zip(("user_id", "month", "category"), key)),
+                {
+                    "$push": {"entries": {"$each": entries}},
+                    "$inc": {
+                        "count": len(entries),
+                        "total": sum(entry.get("total", 0) for entry in entries),
+                    },
+                },
+                upsert=True,
+            )
+            for key, entries in grouped.items()
+        ]
+        if operations:
+            await buckets.collection.bulk_write(operations, ordered=False)
+
+        await documents.collection.delete_many({"_id": {"$in": ids}})
+        moved += len(batch)
+        logger.info("Moved %s %s documents into buckets", moved, name)
+
+    return moved
+
+
+async def migrate_to_documents(name: str) -> int:
+    """
+    Move bucket entries back into one document per transaction.
+
+    Entries keep their ids, so an interrupted migration can simply be run again.
+    """
+    documents = DocumentStore(name)
+    buckets = BucketStore(name)
+    moved = 0
+
+    async for bucket in buckets.collection.find():
+        docs = [buckets.flatten(bucket, entry) for entry in bucket.get("entries", [])]
+        if docs:
+            try:
+                await documents.collection.insert_many(docs, ordered=False)
+            except BulkWriteError as e:
+                # Entries copied by an earlier, interrupted run.
+                if any(error["code"] != 11000 for error in e.details["writeErrors"]):
+                    raise
+
+        await buckets.collection.delete_one({"_id": bucket["_id"]})
+        moved += len(docs)
+        logger.info("Moved %s %s entries out of buckets", moved, name)
+
+    return moved
+
+
+async def archive_transactions(name: str) -> int:
+    """
+    Move transactions from before the archive cutoff into compressed chunks
+    per user, ledger and month.
+    """
+    cold = cold_store(name)
+    await cold.create_indexes()
+    return await move_to_archive(hot_store(name), cold, archive_cutoff())
+
+
+async def move_to_archive(
+    hot: TransactionStore, cold: ColdStore, before: datetime
+) -> int:
+    """
+    Move transactions from before a date from one store into another's
+    archive.
+
+    Chunks are written before their transactions are deleted, and
+    transactions already in a chunk are not archived again, so an interrupted
+    run can simply be run again.
+    """
+    moved = 0
+    while batch := await hot.older_than(before, settings.archive_batch_size):
+        ids = [doc["_id"] for doc in batch]
+        archived = await cold.archived_ids(ids)
+
+        grouped: dict[tuple[Any, ...], list[dict[str, Any]]] = defaultdict(list)
+        for doc in batch:
+            if doc["_id"] not in archived:
+                key = (
+                    doc.get("user_id"),
+                    doc.get("ledger_id"),
+                    month_of(doc["created_at"]),
+                )
+                grouped[key].append(doc)
+
+        for docs in grouped.values():
+            await cold.insert(pack(docs))
+
+        await hot.delete_many(ids)
+        moved += len(batch) - len(archived)
+        logger.info("Archived %s transactions", moved)
+
+    return moved
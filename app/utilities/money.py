@@ -0,0 +1,98 @@
+from decimal import ROUND_HALF_EVEN, Decimal
+from typing import Any
+
+from app.settings import settings
+from app.utilities.profiles import profile_store
+
+# ISO 4217 currencies whose minor unit is not a hundredth.
+MINOR_UNIT_EXPONENTS = {
+    "BHD": 3,
+    "BIF": 0,
+    "CLP": 0,
+    "DJF": 0,
+    "GNF": 0,
+    "IQD": 3,
+    "ISK": 0,
+    "JOD": 3,
+    "JPY": 0,
+    "KMF": 0,
+    "KRW": 0,
+    "KWD": 3,
+    "LYD": 3,
+    "OMR": 3,
+    "PYG": 0,
+    "RWF": 0,
+    "TND": 3,
+    "UGX": 0,
+    "UYI": 0,
+    "VND": 0,
+    "VUV": 0,
+    "XAF": 0,
+    "XOF": 0,
+    "XPF": 0,
+}
+
+
+def exponent(currency: str) -> int:
+    return MINOR_UNIT_EXPONENTS.get(currency, 2)
+
+
+def to_minor(total: float, currency: str) -> int:
+    """
+    Exact amount in minor units, e.g. cents, rounding half to even.
+    """
+    return int(
+        Decimal(str(total))
+        .scaleb(exponent(currency))
+        .quantize(Decimal(1), rounding=ROUND_HALF_EVEN)
+    )
+
+
+def from_minor(amount_minor: int, currency: str) -> float:
+    return float(Decimal(amount_minor).scaleb(-exponent(currency)))
+
+
+def with_money(data: dict[str, Any]) -> dict[str, Any]:
+    """
+    Add the currency, the default one if not given, and the exact amount of a
+    document's total.
+    """
+    if data.get("total") is None:
+        return data
+
+    currency = data.get("currency") or settings.default_currency
+    return data | {
+        "currency": currency,
+        "amount_minor": to_minor(data["total"], currency),
+    }
+
+
+def with_money_update(update: dict[str, Any], doc: dict[str, Any]) -> dict[str, Any]:
+    """
+    An update that changes a document's total or currency, with the exact
+    amount recomputed from the document's current values.
+    """
+    return with_money(
+        {"total": doc.get("total"), "currency": doc.get("currency")} | update
+    )
+
+
+def amount_of(doc: dict[str, Any]) -> tuple[int, str]:
+    """
+    Minor units and currency of a document, also for ones stored before
+    documents had a currency.
+    """
+    currency = doc.get("currency") or settings.default_currency
+    amount_minor = doc.get("amount_minor")
+    if amount_minor is None:
+        amount_minor = to_minor(doc.get("total") or 0.0, currency)
+
+    return amount_minor, currency
+
+
+async def base_currency(user_id: str | None) -> str:
+    """
+    Currency a user's reports are in.
+    """
+    currency = await profile_store().base_currency(user_id)
+    return currency or settings.default_currency
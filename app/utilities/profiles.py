@@ -0,0 +1,89 @@
+import sqlite3
+from typing import Protocol
+
+from app.settings import settings
+from app.utilities.clients import db
+from app.utilities.sqlite import SQLiteTables
+
+
+class ProfileStore(Protocol):
+    """
+    Storage for users' settings.
+    """
+
+    async def base_currency(self, user_id: str | None) -> str | None: ...
+
+    async def set_base_currency(self, user_id: str | None, currency: str) -> None: ...
+
+    async def create_indexes(self) -> None: ...
+
+
+class DocumentProfiles:
+    """
+    One MongoDB document per user, with the user's id as its id.
+    """
+
+    def __init__(self) -> None:
+        self.collection = db.profiles
+
+    async def base_currency(self, user_id: str | None) -> str | None:
+        profile = await self.collection.find_one({"_id": user_id}, {"base_currency": 1})
+        currency: str | None = profile.get("base_currency") if profile else None
+        return currency
+
+    async def set_base_currency(self, user_id: str | None, currency: str) -> None:
+        await self.collection.update_one(
+            {"_id": user_id}, {"$set": {"base_currency": currency}}, upsert=True
+        )
+
+    async def create_indexes(self) -> None:
+        pass
+
+
+class SQLiteProfiles(SQLiteTables):
+    """
+    One row per user in a SQLite table.
+    """
+
+    statements = (
+        "CREATE TABLE IF NOT EXISTS profiles (user_id TEXT PRIMARY KEY,"
+        " base_currency TEXT)",
+    )
+
+    async def base_currency(self, user_id: str | None) -> str | None:
+        def select(connection: sqlite3.Connection) -> str | None:
+            row = connection.execute(
+                "SELECT base_currency FROM profiles WHERE user_id IS ?", (user_id,)
+            ).fetchone()
+            return row[0] if row else None
+
+        return await self.run(select)
+
+    async def set_base_currency(self, user_id: str | None, currency: str) -> None:
+        await self.run(
+            lambda connection: connection.execute(
+                "INSERT INTO profiles (user_id, base_currency) VALUES (?, ?)"
+                " ON CONFLICT (user_id) DO UPDATE"
+                " SET base_currency = excluded.base_currency",
+                (user_id, currency),
+            )
+        )
+
+
+document_profiles = DocumentProfiles()
+sqlite_profiles = SQLiteProfiles()
+
+
+def profile_store() -> ProfileStore:
+    """
+    Get the profiles in the configured backend: in SQLite with the SQLite
+    backend, in MongoDB otherwise.
+    """
+    if settings.storage_backend == "sqlite":
+        return sqlite_profiles
+
+    return document_profiles
+
+
+async def create_indexes() -> None:
+    await profile_store().create_indexes()
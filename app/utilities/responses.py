@@ -0,0 +1,167 @@
+import functools
+from contextvars import ContextVar
+from datetime import date, datetime, timezone
+from typing import Any, Callable, Coroutine
+
+import cbor2
+import msgpack
+import orjson
+from bson import ObjectId
+from fastapi import Request, Response
+from fastapi.responses import JSONResponse
+from fastapi.routing import APIRoute
+from pydantic import TypeAdapter
+
+from app.models import as_utc
+
+
+class ORJSONResponse(JSONResponse):
+    """
+    JSON response encoded with orjson, several times faster than the standard
+    library on large lists.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(
+            content, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+        )
+
+
+def msgpack_default(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return msgpack.Timestamp.from_datetime(as_utc(value))
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, ObjectId):
+        return str(value)
+
+    raise TypeError(f"Cannot encode {type(value).__name__} as MessagePack")
+
+
+def cbor_default(encoder: cbor2.CBOREncoder, value: Any) -> None:
+    if isinstance(value, ObjectId):
+        encoder.encode(str(value))
+        return
+
+    raise TypeError(f"Cannot encode {type(value).__name__} as CBOR")
+
+
+class MessagePackResponse(Response):
+    """
+    MessagePack response, datetimes are timestamp extension values.
+    """
+
+    media_type = "application/msgpack"
+
+    def render(self, content: Any) -> bytes:
+        packed: bytes = msgpack.packb(content, default=msgpack_default)
+        return packed
+
+
+class CBORResponse(Response):
+    """
+    CBOR response, datetimes are epoch timestamps (tag 1) and dates are tagged.
+    """
+
+    media_type = "application/cbor"
+
+    def render(self, content: Any) -> bytes:
+        return cbor2.dumps(
+            content,
+            default=cbor_default,
+            datetime_as_timestamp=True,
+            timezone=timezone.utc,
+        )
+
+
+BINARY_FORMATS: dict[str, type[MessagePackResponse] | type[CBORResponse]] = {
+    "application/msgpack": MessagePackResponse,
+    "application/x-msgpack": MessagePackResponse,
+    "application/vnd.msgpack": MessagePackResponse,
+    "application/cbor": CBORResponse,
+}
+
+
+def negotiate_format(
+    accept: str,
+) -> type[MessagePackResponse] | type[CBORResponse] | None:
+    """
+    Binary response class an Accept header prefers over JSON, None for JSON.
+    """
+    best = None
+    best_weight = 0.0
+    json_weight = 0.0
+    for part in accept.split(","):
+        media_type, _, params = part.strip().partition(";")
+        media_type = media_type.strip().lower()
+        weight = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+
+        if media_type in BINARY_FORMATS:
+            if weight > best_weight:
+                best, best_weight = BINARY_FORMATS[media_type], weight
+        elif media_type in ("application/json", "application/*", "*/*"):
+            json_weight = max(json_weight, weight)
+
+    # JSON wins ties, so clients have to ask for binary explicitly.
+    return best if best_weight > json_weight else None
+
+
+_binary_format: ContextVar[type[MessagePackResponse] | type[CBORResponse] | None] = (
+    ContextVar("binary_format", default=None)
+)
+
+
+class NegotiatedRoute(APIRoute):
+    """
+    Route that serves its response model as MessagePack or CBOR when the
+    Accept header asks for it, and as JSON otherwise.
+
+    Binary responses are built from the model's Python values, so datetimes
+    keep their type instead of becoming strings. Error responses stay JSON.
+    """
+
+    def __init__(self, path: str, endpoint: Callable[..., Any], **kwargs: Any) -> None:
+        @functools.wraps(endpoint)
+        async def negotiated_endpoint(*args: Any, **call_kwargs: Any) -> Any:
+            result = await endpoint(*args, **call_kwargs)
+            response_class = _binary_format.get()
+            if (
+                response_class is None
+                or self.response_adapter is None
+                or isinstance(result, Response)
+            ):
+                return result
+
+            content = self.response_adapter.dump_python(
+                self.response_adapter.validate_python(result)
+            )
+            return response_class(content, status_code=self.status_code or 200)
+
+        super().__init__(path, negotiated_endpoint, **kwargs)
+        self.response_adapter: TypeAdapter[Any] | None = (
+            TypeAdapter(self.response_model) if self.response_model else None
+        )
+
+    def get_route_handler(self) -> Callable[[Request], Coroutine[Any, Any, Response]]:
+        handler = super().get_route_handler()
+
+        async def negotiated_handler(request: Request) -> Response:
+            token = _binary_format.set(
+                negotiate_format(request.headers.get("accept", ""))
+            )
+            try:
+                response = await handler(request)
+            finally:
+                _binary_format.reset(token)
+
+            response.headers.add_vary_header("Accept")
+            return response
+
+        return negotiated_handler
@@ -0,0 +1,438 @@
+import asyncio
+import calendar
+import json
+import sqlite3
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Any, Protocol
+
+import bson
+from bson import ObjectId
+from pymongo import ASCENDING
+from pymongo.errors import BulkWriteError
+
+from app.models import epoch_micros
+from app.settings import settings
+from app.utilities.clients import db
+from app.utilities.log import logger
+from app.utilities.sqlite import SQLiteTables, decode
+
+SCHEDULE_FIELDS = (
+    "recurrence",
+    "total",
+    "currency",
+    "amount_minor",
+    "category",
+    "place",
+    "ledger_id",
+)
+
+
+class ScheduleStore(Protocol):
+    """
+    Storage for recurring bills' schedules and their materialized occurrences.
+    """
+
+    async def save(self, schedule: dict[str, Any]) -> None: ...
+
+    async def delete(self, bill_id: ObjectId) -> None: ...
+
+    async def advance(
+        self, schedule: dict[str, Any], materialized_until: datetime
+    ) -> None: ...
+
+    async def behind(self, before: datetime) -> list[dict[str, Any]]: ...
+
+    async def add_occurrences(self, docs: list[dict[str, Any]]) -> None: ...
+
+    async def delete_occurrences(
+        self, bill_id: ObjectId, since: datetime | None = None
+    ) -> None: ...
+
+    async def due(
+        self, ledger_ids: list[str | None], start: datetime, end: datetime
+    ) -> list[dict[str, Any]]: ...
+
+    async def create_indexes(self) -> None: ...
+
+
+class DocumentSchedules:
+    """
+    One MongoDB document per schedule and one per occurrence.
+    """
+
+    def __init__(self) -> None:
+        self.schedules = db.bill_schedules
+        self.occurrences = db.bill_occurrences
+
+    async def save(self, schedule: dict[str, Any]) -> None:
+        await self.schedules.replace_one(
+            {"_id": schedule["_id"]}, schedule, upsert=True
+        )
+
+    async def delete(self, bill_id: ObjectId) -> None:
+        await self.schedules.delete_one({"_id": bill_id})
+
+    async def advance(
+        self, schedule: dict[str, Any], materialized_until: datetime
+    ) -> None:
+        """
+        Move a schedule on, unless a concurrent extension already did.
+        """
+        await self.schedules.update_one(
+            {
+                "_id": schedule["_id"],
+                "materialized_until": schedule["materialized_until"],
+            },
+            {"$set": {"materialized_until": materialized_until}},
+        )
+
+    async def behind(self, before: datetime) -> list[dict[str, Any]]:
+        """
+        Schedules materialized only up to before a time.
+        """
+        return await self.schedules.find(
+            {"materialized_until": {"$lt": before}}
+        ).to_list(None)
+
+    async def add_occurrences(self, docs: list[dict[str, Any]]) -> None:
+        """
+        Insert occurrences, skipping ones a concurrent extension inserted.
+        """
+        try:
+            await self.occurrences.insert_many(docs, ordered=False)
+        except BulkWriteError as e:
+            if any(error["code"] != 11000 for error in e.details["writeErrors"]):
+                raise
+
+    async def delete_occurrences(
+        self, bill_id: ObjectId, since: datetime | None = None
+    ) -> None:
+        """
+        Delete a bill's occurrences, or those due from a time on.
+        """
+        query: dict[str, Any] = {"bill_id": bill_id}
+        if since is not None:
+            query["due"] = {"$gte": since}
+
+        await self.occurrences.delete_many(query)
+
+    async def due(
+        self, ledger_ids: list[str | None], start: datetime, end: datetime
+    ) -> list[dict[str, Any]]:
+        """
+        Occurrences of some ledgers due from one time until before another,
+        soonest first.
+        """
+        return await (
+            self.occurrences.find(
+                {"ledger_id": {"$in": ledger_ids}, "due": {"$gte": start, "$lt": end}}
+            )
+            .sort("due", ASCENDING)
+            .to_list(None)
+        )
+
+    async def create_indexes(self) -> None:
+        await self.occurrences.create_index(
+            [("bill_id", ASCENDING), ("due", ASCENDING)], unique=True
+        )
+        await self.occurrences.create_index(
+            [("ledger_id", ASCENDING), ("due", ASCENDING)]
+        )
+        await self.schedules.create_index("materialized_until")
+
+
+class SQLiteSchedules(SQLiteTables):
+    """
+    Schedules and occurrences in SQLite tables, one BSON row each next to
+    copies of the fields they are looked up by.
+    """
+
+    statements = (
+        "CREATE TABLE IF NOT EXISTS bill_schedules (id TEXT PRIMARY KEY,"
+        " materialized_until INTEGER NOT NULL, doc BLOB NOT NULL)",
+        "CREATE INDEX IF NOT EXISTS bill_schedules_materialized"
+        " ON bill_schedules (materialized_until)",
+        "CREATE TABLE IF NOT EXISTS bill_occurrences (bill_id TEXT NOT NULL,"
+        " due INTEGER NOT NULL, ledger_id TEXT, doc BLOB NOT NULL,"
+        " PRIMARY KEY (bill_id, due))",
+        "CREATE INDEX IF NOT EXISTS bill_occurrences_ledger_due"
+        " ON bill_occurrences (ledger_id, due)",
+    )
+
+    async def save(self, schedule: dict[str, Any]) -> None:
+        row = (
+            str(schedule["_id"]),
+            epoch_micros(schedule["materialized_until"]),
+            bson.encode(schedule),
+        )
+        await self.write(
+            lambda connection: connection.execute(
+                "INSERT OR REPLACE INTO bill_schedules (id, materialized_until, doc)"
+                " VALUES (?, ?, ?)",
+                row,
+            )
+        )
+
+    async def delete(self, bill_id: ObjectId) -> None:
+        await self.write(
+            lambda connection: connection.execute(
+                "DELETE FROM bill_schedules WHERE id = ?", (str(bill_id),)
+            )
+        )
+
+    async def advance(
+        self, schedule: dict[str, Any], materialized_until: datetime
+    ) -> None:
+        row = (
+            epoch_micros(materialized_until),
+            bson.encode(schedule | {"materialized_until": materialized_until}),
+            str(schedule["_id"]),
+            epoch_micros(schedule["materialized_until"]),
+        )
+        await self.write(
+            lambda connection: connection.execute(
+                "UPDATE bill_schedules SET materialized_until = ?, doc = ?"
+                " WHERE id = ? AND materialized_until = ?",
+                row,
+            )
+        )
+
+    async def behind(self, before: datetime) -> list[dict[str, Any]]:
+        def select(connection: sqlite3.Connection) -> list[dict[str, Any]]:
+            rows = connection.execute(
+                "SELECT doc FROM bill_schedules WHERE materialized_until < ?",
+                (epoch_micros(before),),
+            )
+            return [decode(doc) for doc, in rows]
+
+        return await self.run(select)
+
+    async def add_occurrences(self, docs: list[dict[str, Any]]) -> None:
+        rows = [
+            (
+                str(doc["bill_id"]),
+                epoch_micros(doc["due"]),
+                doc["ledger_id"],
+                bson.encode({"_id": ObjectId()} | doc),
+            )
+            for doc in docs
+        ]
+        await self.write(
+            lambda connection: connection.executemany(
+                "INSERT OR IGNORE INTO bill_occurrences (bill_id, due, ledger_id, doc)"
+                " VALUES (?, ?, ?, ?)",
+                rows,
+            )
+        )
+
+    async def delete_occurrences(
+        self, bill_id: ObjectId, since: datetime | None = None
+    ) -> None:
+        row = (str(bill_id), epoch_micros(since) if since is not None else -1)
+        await self.write(
+            lambda connection: connection.execute(
+                "DELETE FROM bill_occurrences WHERE bill_id = ? AND due >= ?", row
+            )
+        )
+
+    async def due(
+        self, ledger_ids: list[str | None], start: datetime, end: datetime
+    ) -> list[dict[str, Any]]:
+        def select(connection: sqlite3.Connection) -> list[dict[str, Any]]:
+            rows = connection.execute(
+                "SELECT doc FROM bill_occurrences"
+                " WHERE ledger_id IN (SELECT value FROM json_each(?))"
+                " AND due >= ? AND due < ? ORDER BY due",
+                (json.dumps(ledger_ids), epoch_micros(start), epoch_micros(end)),
+            )
+            return [decode(doc) for doc, in rows]
+
+        return await self.run(select)
+
+
+document_schedules = DocumentSchedules()
+sqlite_schedules = SQLiteSchedules()
+
+
+def schedule_store() -> ScheduleStore:
+    """
+    Get the bill schedules in the configured backend: in SQLite with the
+    SQLite backend, in MongoDB otherwise.
+    """
+    if settings.storage_backend == "sqlite":
+        return sqlite_schedules
+
+    return document_schedules
+
+
+def as_datetime(day: date) -> datetime:
+    """
+    Midnight UTC of a day, as dates are stored in MongoDB.
+    """
+    return datetime.combine(day, time.min, tzinfo=timezone.utc)
+
+
+def add_months(start: date, months: int) -> date:
+    """
+    Same day of a later month, clamped to that month's last day.
+    """
+    month_index = start.month - 1 + months
+    year, month = start.year + month_index // 12, month_index % 12 + 1
+    return date(year, month, min(start.day, calendar.monthrange(year, month)[1]))
+
+
+def occurrences(recurrence: dict[str, Any], after: date, through: date) -> list[date]:
+    """
+    Due dates of a recurrence after one day and up to another.
+    """
+    start = date.fromisoformat(recurrence["start"])
+    interval = recurrence.get("interval", 1)
+    frequency = recurrence["frequency"]
+    if recurrence.get("until"):
+        through = min(through, date.fromisoformat(recurrence["until"]))
+
+    def nth(n: int) -> date:
+        if frequency == "daily":
+            return start + timedelta(days=n * interval)
+        if frequency == "weekly":
+            return start + timedelta(weeks=n * interval)
+        if frequency == "monthly":
+            return add_months(start, n * interval)
+        return add_months(start, n * interval * 12)
+
+    # Skip straight to the first occurrence that can be after `after`.
+    if after < start:
+        n = 0
+    elif frequency in ("daily", "weekly"):
+        step = interval * (7 if frequency == "weekly" else 1)
+        n = (after - start).days // step
+    else:
+        step = interval * (12 if frequency == "yearly" else 1)
+        n = ((after.year - start.year) * 12 + after.month - start.month) // step
+
+    dates = []
+    while (due := nth(n)) <= through:
+        if due > after:
+            dates.append(due)
+        n += 1
+
+    return dates
+
+
+async def extend(schedule: dict[str, Any], through: date) -> None:
+    """
+    Materialize a bill's occurrences up to a day, continuing where the last
+    extension stopped.
+    """
+    materialized_until = schedule["materialized_until"].date()
+    if materialized_until >= through:
+        return
+
+    docs = [
+        {
+            "bill_id": schedule["_id"],
+            "user_id": schedule["user_id"],
+            "ledger_id": schedule.get("ledger_id"),
+            "due": as_datetime(due),
+            "total": schedule.get("total"),
+            "currency": schedule.get("currency"),
+            "amount_minor": schedule.get("amount_minor"),
+            "category": schedule.get("category"),
+            "place": schedule.get("place"),
+        }
+        for due in occurrences(schedule["recurrence"], materialized_until, through)
+    ]
+    if docs:
+        await schedule_store().add_occurrences(docs)
+
+    await schedule_store().advance(schedule, as_datetime(through))
+
+
+def horizon() -> date:
+    return datetime.now(timezone.utc).date() + timedelta(
+        days=settings.bill_horizon_days
+    )
+
+
+async def schedule_bill(
+    bill_id: ObjectId, user_id: str | None, bill: dict[str, Any]
+) -> None:
+    """
+    Start materializing the occurrences of a recurring bill.
+    """
+    start = date.fromisoformat(bill["recurrence"]["start"])
+    schedule = {field: bill.get(field) for field in SCHEDULE_FIELDS} | {
+        "_id": bill_id,
+        "user_id": user_id,
+        "materialized_until": as_datetime(start - timedelta(days=1)),
+    }
+    await schedule_store().save(schedule)
+    await extend(schedule, horizon())
+
+
+async def unschedule_bill(bill_id: ObjectId) -> None:
+    """
+    Remove a bill's schedule and occurrences.
+    """
+    await schedule_store().delete(bill_id)
+    await schedule_store().delete_occurrences(bill_id)
+
+
+async def reschedule_bill(
+    bill_id: ObjectId, user_id: str | None, bill: dict[str, Any]
+) -> None:
+    """
+    Regenerate a changed bill's occurrences from today on, past ones are kept.
+    """
+    today = as_datetime(datetime.now(timezone.utc).date())
+    await schedule_store().delete_occurrences(bill_id, today)
+
+    if not bill.get("recurrence"):
+        await schedule_store().delete(bill_id)
+        return
+
+    start = date.fromisoformat(bill["recurrence"]["start"])
+    schedule = {field: bill.get(field) for field in SCHEDULE_FIELDS} | {
+        "_id": bill_id,
+        "user_id": user_id,
+        "materialized_until": max(
+            today - timedelta(days=1), as_datetime(start - timedelta(days=1))
+        ),
+    }
+    await schedule_store().save(schedule)
+    await extend(schedule, horizon())
+
+
+async def extend_all() -> None:
+    """
+    Extend every schedule that is getting close to the end of its horizon.
+    """
+    through = horizon()
+    due_before = as_datetime(through - timedelta(days=settings.bill_extend_slack_days))
+    for schedule in await schedule_store().behind(due_before):
+        await extend(schedule, through)
+
+
+async def run_scheduler() -> None:
+    """
+    Keep extending schedules, until cancelled.
+    """
+    while True:
+        try:
+            await extend_all()
+        except Exception:
+            logger.exception("Extending bill schedules failed")
+
+        await asyncio.sleep(settings.bill_schedule_interval_seconds)
+
+
+async def upcoming(ledger_ids: list[str | None], days: int) -> list[Any]:
+    """
+    Bill occurrences of some ledgers due in the next days, soonest first.
+    """
+    today = as_datetime(datetime.now(timezone.utc).date())
+    return await schedule_store().due(ledger_ids, today, today + timedelta(days=days))
+
+
+async def create_indexes() -> None:
+    await schedule_store().create_indexes()
@@ -0,0 +1,194 @@
+from collections import OrderedDict, defaultdict
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Any
+
+import numpy as np
+
+from app.models import as_utc
+from app.settings import settings
+from app.utilities.forecast import encode, epoch_day, epoch_days
+from app.utilities.fx import fx_rates
+from app.utilities.invalidation import bus
+from app.utilities.money import amount_of, base_currency
+from app.utilities.transactions import plan_store, transaction_store
+
+TRANSACTION_FIELDS = ["created_at", "total", "amount_minor", "currency", "category"]
+
+stores = [transaction_store("expenses"), transaction_store("bills")]
+
+
+async def load_budgets(user_id: str | None, currency: str) -> dict[str, float]:
+    """
+    Budget totals per category, converted to one currency at today's rate.
+    """
+    amounts = []
+    currencies = []
+    categories = []
+    async for doc in plan_store("budgets").project(
+        user_id, ["category", "total", "amount_minor", "currency"]
+    ):
+        amount_minor, doc_currency = amount_of(doc)
+        amounts.append(amount_minor)
+        currencies.append(doc_currency)
+        categories.append(doc.get("category"))
+
+    currency_codes, currency_names = encode(currencies)
+    today = epoch_day(datetime.now(timezone.utc).date())
+    totals = fx_rates.convert(
+        np.asarray(amounts, dtype=np.int64),
+        currency_codes,
+        currency_names,
+        np.full(len(amounts), today, dtype=np.int64),
+        currency,
+    )
+
+    budgets: dict[str, float] = defaultdict(float)
+    for category, total in zip(categories, totals.tolist()):
+        budgets[category] += total
+
+    return budgets
+
+
+def month_of(when: datetime) -> str:
+    return as_utc(when).strftime("%Y-%m")
+
+
+def convert_docs(docs: list[dict[str, Any]], currency: str) -> list[float]:
+    """
+    Totals of transactions in one currency, each at the rate of its day.
+    """
+    amounts = []
+    currencies = []
+    for doc in docs:
+        amount_minor, doc_currency = amount_of(doc)
+        amounts.append(amount_minor)
+        currencies.append(doc_currency)
+
+    currency_codes, currency_names = encode(currencies)
+    totals = fx_rates.convert(
+        np.asarray(amounts, dtype=np.int64),
+        currency_codes,
+        currency_names,
+        epoch_days([as_utc(doc["created_at"]) for doc in docs]),
+        currency,
+    )
+    return list(totals.tolist())
+
+
+@dataclass
+class MonthSpending:
+    """
+    A user's spending and budgets per category in one month, in their base
+    currency, and the thresholds already alerted on.
+    """
+
+    month: str
+    currency: str
+    spent: dict[str, float]
+    budgets: dict[str, float]
+    alerted: set[tuple[str, float]] = field(default_factory=set)
+
+    def apply(self, changes: list[tuple[dict[str, Any], int]]) -> None:
+        """
+        Add transactions to the totals, with a sign of 1, or take them out,
+        with -1, if they are in the month. Their totals are converted together.
+        """
+        changes = [
+            (doc, sign)
+            for doc, sign in changes
+            if month_of(doc["created_at"]) == self.month
+        ]
+        if not changes:
+            return
+
+        docs = [doc for doc, _ in changes]
+        for (doc, sign), total in zip(changes, convert_docs(docs, self.currency)):
+            category = doc.get("category") or ""
+            self.spent[category] = self.spent.get(category, 0.0) + sign * total
+
+
+async def load_month(user_id: str | None, month: str) -> MonthSpending:
+    """
+    A user's spending per category in a month, read from all their
+    transactions.
+    """
+    currency = await base_currency(user_id)
+    since = datetime.strptime(month, "%Y-%m").replace(tzinfo=timezone.utc)
+    docs = []
+    for store in stores:
+        async for doc in store.project(user_id, TRANSACTION_FIELDS, since):
+            if month_of(doc["created_at"]) == month:
+                docs.append(doc)
+
+    spent: dict[str, float] = defaultdict(float)
+    for doc, total in zip(docs, convert_docs(docs, currency)):
+        spent[doc.get("category") or ""] += total
+
+    return MonthSpending(
+        month=month,
+        currency=currency,
+        spent=dict(spent),
+        budgets=dict(await load_budgets(user_id, currency)),
+    )
+
+
+class SpendingTotals:
+    """
+    Running totals of users' spending this month, kept up to date by their
+    writes instead of being read again.
+
+    Unlike a `UserCache`, writes to transactions update the totals rather than
+    drop them. Each write still bumps the user's generation, so totals loaded
+    while a write happened are not stored.
+    """
+
+    def __init__(self, max_users: int) -> None:
+        self.max_users = max_users
+        self._values: OrderedDict[str | None, MonthSpending] = OrderedDict()
+        self._generations: dict[str | None, int] = {}
+
+    def generation(self, user_id: str | None) -> int:
+        return self._generations.get(user_id, 0)
+
+    def bump(self, user_id: str | None) -> int:
+        self._generations[user_id] = self.generation(user_id) + 1
+        return self._generations[user_id]
+
+    def get(self, user_id: str | None, month: str) -> MonthSpending | None:
+        value = self._values.get(user_id)
+        if value is None or value.month != month:
+            return None
+
+        self._values.move_to_end(user_id)
+        return value
+
+    def set(self, user_id: str | None, value: MonthSpending, generation: int) -> None:
+        if generation != self.generation(user_id):
+            return
+
+        self._values[user_id] = value
+        self._values.move_to_end(user_id)
+        while len(self._values) > self.max_users:
+            evicted, _ = self._values.popitem(last=False)
+            self._generations.pop(evicted, None)
+
+    def drop(self, user_ids: list[str | None]) -> None:
+        for user_id in user_ids:
+            self._values.pop(user_id, None)
+            self.bump(user_id)
+
+
+totals = SpendingTotals(max_users=settings.alert_cache_users)
+
+
+def invalidate_spending(user_id: str | None) -> None:
+    """
+    Drop a user's running totals, in every worker, after a change they cannot
+    follow: budgets, base currency, or transactions written elsewhere.
+    """
+    totals.drop([user_id])
+    bus.publish("spending", [user_id])
+
+
+bus.subscribe("spending", totals.drop)
@@ -0,0 +1,176 @@
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import timezone
+from typing import Any, Callable, Iterator, TypeVar
+
+import bson
+from anyio.to_thread import run_sync
+from bson import CodecOptions
+
+from app.settings import settings
+from app.utilities.deadlines import DeadlineExceeded, current_deadline
+
+T = TypeVar("T")
+
+# Virtual machine instructions between deadline checks.
+PROGRESS_STEPS = 10000
+
+
+class ConnectionPool:
+    """
+    SQLite connections used from worker threads, one thread at a time each.
+
+    Connections are opened on first use, in WAL mode so reads are not blocked
+    by the writer, and keep their prepared statements cached.
+    """
+
+    def __init__(self, path: str, size: int) -> None:
+        self.path = path
+        self.size = size
+        self._idle: queue.SimpleQueue[sqlite3.Connection] = queue.SimpleQueue()
+        self._opened = 0
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(
+            self.path,
+            check_same_thread=False,
+            isolation_level=None,
+            cached_statements=settings.sqlite_cached_statements,
+        )
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute(f"PRAGMA busy_timeout={settings.sqlite_busy_timeout_ms}")
+        return connection
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        """
+        Borrow a connection, waiting for one when all are in use.
+        """
+        with self._lock:
+            open_new = self._idle.empty() and self._opened < self.size
+            if open_new:
+                self._opened += 1
+
+        if open_new:
+            try:
+                connection = self._connect()
+            except Exception:
+                with self._lock:
+                    self._opened -= 1
+                raise
+        else:
+            connection = self._idle.get()
+
+        try:
+            yield connection
+        finally:
+            self._idle.put(connection)
+
+    async def run(self, fn: Callable[[sqlite3.Connection], T]) -> T:
+        """
+        Call a function with a connection in a worker thread, interrupting its
+        statements once the request's deadline passes.
+        """
+        deadline = current_deadline()
+
+        def call() -> T:
+            with self.connection() as connection:
+                if deadline is None:
+                    return fn(connection)
+
+                connection.set_progress_handler(
+                    lambda: time.monotonic() > deadline, PROGRESS_STEPS
+                )
+                try:
+                    return fn(connection)
+                except sqlite3.OperationalError as e:
+                    if time.monotonic() > deadline:
+                        raise DeadlineExceeded() from e
+                    raise
+                finally:
+                    connection.set_progress_handler(None, 0)
+
+        return await run_sync(call)
+
+    def close(self) -> None:
+        """
+        Close the idle connections.
+        """
+        while not self._idle.empty():
+            self._idle.get_nowait().close()
+            with self._lock:
+                self._opened -= 1
+
+
+@contextmanager
+def write_transaction(connection: sqlite3.Connection) -> Iterator[None]:
+    """
+    Take the write lock up front, so a transaction that reads before writing
+    does not fail when another one commits in between.
+    """
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        yield
+    except BaseException:
+        # An interrupted transaction must still be able to roll back.
+        connection.set_progress_handler(None, 0)
+        connection.execute("ROLLBACK")
+        raise
+
+    connection.execute("COMMIT")
+
+
+pool = ConnectionPool(settings.sqlite_path, settings.sqlite_pool_size)
+
+
+# Dates come back aware, as from the memory backend.
+CODEC_OPTIONS: CodecOptions[dict[str, Any]] = CodecOptions(
+    tz_aware=True, tzinfo=timezone.utc
+)
+
+
+def decode(doc: bytes) -> dict[str, Any]:
+    return bson.decode(doc, CODEC_OPTIONS)
+
+
+class SQLiteTables:
+    """
+    Base of stores keeping a small collection in SQLite tables, which are
+    created by their first query.
+    """
+
+    statements: tuple[str, ...] = ()
+
+    def __init__(self) -> None:
+        self._ready = False
+
+    async def run(self, fn: Callable[[sqlite3.Connection], T]) -> T:
+        if not self._ready:
+            await self.create_indexes()
+
+        return await pool.run(fn)
+
+    async def write(self, fn: Callable[[sqlite3.Connection], T]) -> T:
+        """
+        Run a function in a write transaction.
+        """
+
+        def write(connection: sqlite3.Connection) -> T:
+            with write_transaction(connection):
+                return fn(connection)
+
+        return await self.run(write)
+
+    async def create_indexes(self) -> None:
+        def create(connection: sqlite3.Connection) -> None:
+            with write_transaction(connection):
+                for statement in self.statements:
+                    connection.execute(statement)
+
+        await pool.run(create)
+        self._ready = True
@@ -0,0 +1,307 @@
+import codecs
+import csv
+import hashlib
+import io
+import re
+from collections import Counter
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, AsyncIterator
+
+from app.models import ImportOptions
+from app.settings import settings
+from app.utilities.jobs import JobContext
+from app.utilities.money import with_money
+from app.utilities.stores.base import TransactionStore
+from app.utilities.suggestions import suggestions
+
+StatementRecord = tuple[int, dict[str, str]]
+
+OFX_TRANSACTION = re.compile(r"<STMTTRN>(.*?)</STMTTRN>", re.DOTALL | re.IGNORECASE)
+OFX_FIELD = re.compile(r"<(\w+)>([^<\r\n]*)")
+OFX_DATE = re.compile(
+    r"(\d{8})(\d{6})?(?:\.\d+)?(?:\[([+-]?\d+(?:\.\d+)?)(?::\w+)?\])?"
+)
+
+
+def record_boundary(text: str) -> int:
+    """
+    Index just past the last newline that is not inside a quoted CSV field.
+    """
+    boundary = 0
+    quotes = 0
+    start = 0
+    while (newline := text.find("\n", start)) != -1:
+        quotes += text.count('"', start, newline)
+        if quotes % 2 == 0:
+            boundary = newline + 1
+        start = newline + 1
+
+    return boundary
+
+
+async def decode(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """
+    Text of a byte stream, without splitting multi-byte characters.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="replace")
+    async for chunk in chunks:
+        yield decoder.decode(chunk)
+
+    yield decoder.decode(b"", final=True)
+
+
+def check_buffer(buffer: str) -> None:
+    if len(buffer) > settings.import_max_record_chars:
+        raise ValueError("Statement record is too long, is a quote left open?")
+
+
+async def csv_records(chunks: AsyncIterator[bytes]) -> AsyncIterator[StatementRecord]:
+    """
+    Rows of a CSV stream keyed by their lower-cased header, parsed as complete
+    records arrive.
+    """
+    header: list[str] | None = None
+    row_number = 0
+    buffer = ""
+
+    async for text in decode(chunks):
+        buffer += text
+        boundary = record_boundary(buffer)
+        complete, buffer = buffer[:boundary], buffer[boundary:]
+        check_buffer(buffer)
+
+        for row in csv.reader(io.StringIO(complete, newline="")):
+            if header is None:
+                header = [name.strip().casefold() for name in row]
+                continue
+            row_number += 1
+            if any(row):
+                yield row_number, dict(zip(header, row))
+
+    if buffer.strip() and header is not None:
+        for row in csv.reader(io.StringIO(buffer, newline="")):
+            row_number += 1
+            if any(row):
+                yield row_number, dict(zip(header, row))
+
+
+async def ofx_records(chunks: AsyncIterator[bytes]) -> AsyncIterator[StatementRecord]:
+    """
+    Transactions of an OFX stream, keyed by their lower-cased tags, parsed as
+    complete transactions arrive.
+    """
+    row_number = 0
+    buffer = ""
+
+    async for text in decode(chunks):
+        buffer += text
+        end = 0
+        for match in OFX_TRANSACTION.finditer(buffer):
+            row_number += 1
+            yield row_number, {
+                tag.casefold(): value.strip()
+                for tag, value in OFX_FIELD.findall(match.group(1))
+            }
+            end = match.end()
+
+        buffer = buffer[end:]
+        # Keep only what can still become part of a transaction.
+        start = buffer.upper().rfind("<STMTTRN>")
+        buffer = buffer[start:] if start != -1 else buffer[-len("<STMTTRN>") :]
+        check_buffer(buffer)
+
+
+def parse_amount(text: str, decimal_separator: str) -> float:
+    """
+    Amount with currency symbols and thousands separators, negative when
+    written in parentheses.
+    """
+    negative = text.strip().startswith("(") and text.strip().endswith(")")
+    thousands_separator = "," if decimal_separator == "." else "."
+    cleaned = re.sub(r"[^\d\-.,]", "", text).replace(thousands_separator, "")
+    if decimal_separator == ",":
+        cleaned = cleaned.replace(",", ".")
+
+    try:
+        amount = float(cleaned)
+    except ValueError:
+        raise ValueError(f"Invalid amount {text!r}")
+
+    return -abs(amount) if negative else amount
+
+
+def parse_date(text: str, date_format: str | None) -> datetime:
+    """
+    CSV date, ISO 8601 unless a strptime format is given.
+    """
+    try:
+        if date_format:
+            parsed = datetime.strptime(text.strip(), date_format)
+        else:
+            parsed = datetime.fromisoformat(text.strip())
+    except ValueError:
+        raise ValueError(f"Invalid date {text!r}")
+
+    if parsed.tzinfo is None:
+        return parsed.replace(tzinfo=timezone.utc)
+
+    return parsed.astimezone(timezone.utc)
+
+
+def parse_ofx_date(text: str) -> datetime:
+    """
+    OFX date, e.g. 20240115, 20240115120000 or 20240115120000.000[-5:EST].
+    """
+    match = OFX_DATE.match(text.strip())
+    if not match:
+        raise ValueError(f"Invalid date {text!r}")
+
+    day, time_of_day, offset = match.groups()
+    parsed = datetime.strptime(day + (time_of_day or "000000"), "%Y%m%d%H%M%S")
+    tz = timezone(timedelta(hours=float(offset))) if offset else timezone.utc
+
+    return parsed.replace(tzinfo=tz).astimezone(timezone.utc)
+
+
+def field(record: dict[str, str], name: str) -> str:
+    value = record.get(name.casefold())
+    if value is None:
+        raise ValueError(f"Missing column {name!r}")
+
+    return value
+
+
+def to_expense(
+    record: dict[str, str], statement_format: str, options: ImportOptions
+) -> dict[str, Any] | None:
+    """
+    Expense fields of a statement record, None for credits.
+
+    `import_key` identifies the transaction within the statement: OFX has
+    transaction ids, CSV rows are identified by their own values.
+    """
+    if statement_format == "ofx":
+        created_at = parse_ofx_date(field(record, "dtposted"))
+        amount = parse_amount(field(record, "trnamt"), ".")
+        place = record.get("name") or record.get("payee") or record.get("memo") or ""
+        category = options.default_category
+        debits_negative = True
+    else:
+        created_at = parse_date(field(record, options.date_column), options.date_format)
+        amount = parse_amount(
+            field(record, options.amount_column), options.decimal_separator
+        )
+        place = field(record, options.place_column).strip()
+        category = (
+            record.get(options.category_column.casefold(), "").strip()
+            if options.category_column
+            else ""
+        ) or options.default_category
+        debits_negative = options.debits_negative
+
+    if debits_negative:
+        if amount >= 0:
+            return None
+        amount = -amount
+
+    return with_money(
+        {
+            "total": abs(amount),
+            "currency": options.currency,
+            "category": category,
+            "place": place,
+            "created_at": created_at,
+            "import_key": record.get("fitid")
+            or f"{created_at.isoformat()}|{abs(amount)}|{place}",
+        }
+    )
+
+
+def import_hash(user_id: str | None, key: str) -> str:
+    return hashlib.sha256(f"{user_id}\x1f{key}".encode()).hexdigest()
+
+
+async def import_statement(
+    store: TransactionStore,
+    user_id: str | None,
+    ledger_id: str | None,
+    records: AsyncIterator[StatementRecord],
+    statement_format: str,
+    options: ImportOptions,
+    job: JobContext,
+) -> dict[str, Any]:
+    """
+    Insert the expenses of a statement in chunks, skipping ones imported before.
+
+    Identical CSV rows are told apart by how often they occurred earlier that
+    day, so statements are expected to list rows by date. Only a bounded number
+    of row errors is kept.
+    """
+    summary: dict[str, Any] = {
+        "rows": 0,
+        "inserted": 0,
+        "duplicates": 0,
+        "skipped": 0,
+        "error_count": 0,
+        "errors": [],
+    }
+    pending: list[dict[str, Any]] = []
+    seen_today: Counter[str] = Counter()
+    current_day: date | None = None
+
+    async def flush() -> None:
+        hashes = [doc["import_hash"] for doc in pending]
+        existing = await store.existing_import_hashes(user_id, hashes)
+        new = [doc for doc in pending if doc["import_hash"] not in existing]
+        inserted = await store.insert_many(new) if new else 0
+        for doc in new:
+            suggestions.record(user_id, doc)
+
+        summary["inserted"] += inserted
+        summary["duplicates"] += len(pending) - inserted
+        pending.clear()
+        await job.progress(
+            summary["rows"],
+            inserted=summary["inserted"],
+            duplicates=summary["duplicates"],
+            error_count=summary["error_count"],
+        )
+
+    async for row_number, record in records:
+        summary["rows"] += 1
+        try:
+            expense = to_expense(record, statement_format, options)
+        except ValueError as e:
+            summary["error_count"] += 1
+            if len(summary["errors"]) < settings.import_max_errors:
+                summary["errors"].append({"row": row_number, "error": str(e)})
+            continue
+
+        if expense is None:
+            summary["skipped"] += 1
+            continue
+
+        key = expense.pop("import_key")
+        if "fitid" not in record:
+            day = expense["created_at"].date()
+            if day != current_day:
+                seen_today.clear()
+                current_day = day
+            seen_today[key] += 1
+            key = f"{key}|{seen_today[key]}"
+
+        pending.append(
+            expense
+            | {
+                "user_id": user_id,
+                "ledger_id": ledger_id,
+                "import_hash": import_hash(user_id, key),
+                "imported_at": datetime.now(timezone.utc),
+            }
+        )
+        if len(pending) >= settings.import_batch_size:
+            await flush()
+
+    await flush()
+
+    return summary
@@ -0,0 +1,108 @@
+from datetime import datetime
+from typing import Any, AsyncIterator, Protocol
+
+from bson import ObjectId
+
+from app.models import CategoryFilters, as_utc
+
+# Documents are untyped, as in AsyncIOMotorDatabase[Any].
+Document = Any
+
+
+class TransactionStore(Protocol):
+    """
+    Storage for the collections of ledger documents: expenses and bills, and
+    budgets and wishlists, which only use the document layout.
+
+    With a change log, creates, updates and deletes are logged by the store
+    writing them. Moves in and out of the store, `delete_many` and
+    `restore_many`, are not changes and are not logged.
+    """
+
+    def find(
+        self, ledger_ids: list[str | None], filters: CategoryFilters
+    ) -> AsyncIterator[Document]: ...
+
+    async def find_one(
+        self, ledger_ids: list[str | None], entry_id: ObjectId
+    ) -> Document | None: ...
+
+    async def insert_one(self, data: dict[str, Any]) -> ObjectId: ...
+
+    async def insert_many(self, data: list[dict[str, Any]]) -> int: ...
+
+    async def existing_import_hashes(
+        self, user_id: str | None, hashes: list[str]
+    ) -> set[str]: ...
+
+    async def update_one(
+        self,
+        ledger_ids: list[str | None],
+        entry_id: ObjectId,
+        update_data: dict[str, Any],
+    ) -> bool: ...
+
+    async def delete_one(
+        self, ledger_ids: list[str | None], entry_id: ObjectId
+    ) -> bool: ...
+
+    async def monthly_totals(self, user_id: str | None) -> list[dict[str, Any]]: ...
+
+    async def search(
+        self, user_id: str | None, text: str, limit: int
+    ) -> list[Document]: ...
+
+    def project(
+        self, user_id: str | None, fields: list[str], since: datetime | None = None
+    ) -> AsyncIterator[Document]: ...
+
+    async def count_values(self, user_id: str | None, field: str) -> dict[str, int]: ...
+
+    async def older_than(self, before: datetime, limit: int) -> list[Document]: ...
+
+    async def delete_many(self, entry_ids: list[ObjectId]) -> int: ...
+
+    async def restore_many(self, data: list[dict[str, Any]]) -> int: ...
+
+    async def create_indexes(self) -> None: ...
+
+
+class PlanStore(TransactionStore, Protocol):
+    """
+    Storage for budgets and wishlists, which also keep running amounts.
+    """
+
+    async def increment(
+        self,
+        ledger_ids: list[str | None],
+        entry_id: ObjectId,
+        field: str,
+        amount: int,
+        update_data: dict[str, Any],
+    ) -> Document | None: ...
+
+
+def text_query(user_id: str | None, text: str) -> dict[str, Any]:
+    """
+    MongoDB text search within a user's documents.
+    """
+    return {"user_id": user_id, "$text": {"$search": text}}
+
+
+TEXT_SCORE = {"score": {"$meta": "textScore"}}
+
+
+def month_of(created_at: datetime) -> str:
+    """
+    Bucket month key in UTC, e.g. 2024-11.
+    """
+    return as_utc(created_at).strftime("%Y-%m")
+
+
+async def find_all(
+    store: TransactionStore, ledger_ids: list[str | None], filters: CategoryFilters
+) -> list[Document]:
+    """
+    Every document a find yields, as one value that requests can share.
+    """
+    return [doc async for doc in store.find(ledger_ids, filters)]
@@ -0,0 +1,449 @@
+import heapq
+from collections import defaultdict
+from datetime import datetime
+from typing import Any, AsyncIterator
+
+from bson import ObjectId
+from pymongo import ASCENDING, DESCENDING, TEXT, UpdateOne
+
+from app.models import CategoryFilters, TransactionFilters, as_utc
+from app.settings import settings
+from app.utilities.changes import (
+    ChangeLog,
+    change,
+    logged_write,
+)
+from app.utilities.clients import db
+from app.utilities.deadlines import max_time_ms, time_limit
+from app.utilities.stores.base import (
+    TEXT_SCORE,
+    Document,
+    month_of,
+    text_query,
+)
+
+# Fields that live on the bucket rather than on each entry.
+BUCKET_FIELDS = ("user_id", "category")
+
+
+class BucketStore:
+    """
+    One document per user, month and category holding the entries of that
+    bucket plus a precomputed count and total.
+    """
+
+    # Retries when an entry changes between reading and updating it.
+    max_update_attempts = 5
+
+    def __init__(self, name: str, changes: ChangeLog | None = None) -> None:
+        self.name = name
+        self.collection = db[f"{name}_buckets"]
+        self.changes = changes
+
+    async def _log(
+        self, before: dict[str, Any] | None, after: dict[str, Any] | None
+    ) -> None:
+        if self.changes is not None:
+            await self.changes.append([change(self.name, before, after)])
+
+    @staticmethod
+    def flatten(bucket: dict[str, Any], entry: dict[str, Any]) -> dict[str, Any]:
+        """
+        Turn a bucket entry back into a standalone transaction document.
+        """
+        return entry | {field: bucket.get(field) for field in BUCKET_FIELDS}
+
+    @staticmethod
+    def bucket_key(data: dict[str, Any]) -> dict[str, Any]:
+        return {
+            "user_id": data.get("user_id"),
+            "month": month_of(data["created_at"]),
+            "category": data.get("category"),
+        }
+
+    @staticmethod
+    def to_entry(data: dict[str, Any]) -> dict[str, Any]:
+        return {k: v for k, v in data.items() if k not in BUCKET_FIELDS}
+
+    async def find(
+        self, ledger_ids: list[str | None], filters: CategoryFilters
+    ) -> AsyncIterator[Document]:
+        # Buckets are per user, and a user's bucket can hold entries of
+        # several ledgers.
+        query: dict[str, Any] = {"entries.ledger_id": {"$in": ledger_ids}}
+        if filters.category is not None:
+            query["category"] = filters.category
+
+        month: dict[str, Any] = {}
+        if isinstance(filters, TransactionFilters):
+            if filters.start is not None:
+                month["$gte"] = month_of(filters.start)
+            if filters.end is not None:
+                month["$lte"] = month_of(filters.end)
+        if month:
+            query["month"] = month
+
+        buckets = (
+            self.collection.find(query)
+            .sort([("month", DESCENDING), ("category", ASCENDING)])
+            .max_time_ms(max_time_ms())
+        )
+        # Buckets of one month are merged, so entries come out newest first.
+        month_buckets: list[dict[str, Any]] = []
+        async for bucket in buckets:
+            if month_buckets and month_buckets[0]["month"] != bucket["month"]:
+                for doc in self._merge(month_buckets, ledger_ids, filters):
+                    yield doc
+                month_buckets = []
+            month_buckets.append(bucket)
+
+        for doc in self._merge(month_buckets, ledger_ids, filters):
+            yield doc
+
+    def _merge(
+        self,
+        buckets: list[dict[str, Any]],
+        ledger_ids: list[str | None],
+        filters: CategoryFilters,
+    ) -> list[Document]:
+        """
+        Matching entries of some buckets, newest first.
+        """
+        docs = [
+            self.flatten(bucket, entry)
+            for bucket in buckets
+            for entry in bucket.get("entries", [])
+        ]
+        return sorted(
+            (
+                doc
+                for doc in docs
+                if doc.get("ledger_id") in ledger_ids and filters.matches(doc)
+            ),
+            key=lambda doc: doc["created_at"],
+            reverse=True,
+        )
+
+    async def _find_bucket(
+        self, ledger_ids: list[str | None], entry_id: ObjectId
+    ) -> tuple[dict[str, Any], dict[str, Any]] | None:
+        """
+        Get the bucket holding an entry, and the entry itself.
+        """
+        bucket = await self.collection.find_one(
+            {
+                "entries": {
+                    "$elemMatch": {"_id": entry_id, "ledger_id": {"$in": ledger_ids}}
+                }
+            },
+            {
+                "user_id": 1,
+                "month": 1,
+                "category": 1,
+                "entries": {"$elemMatch": {"_id": entry_id}},
+            },
+            max_time_ms=max_time_ms(),
+        )
+        if not bucket or not bucket.get("entries"):
+            return None
+
+        return bucket, bucket["entries"][0]
+
+    async def find_one(
+        self, ledger_ids: list[str | None], entry_id: ObjectId
+    ) -> Document | None:
+        found = await self._find_bucket(ledger_ids, entry_id)
+        if found is None:
+            return None
+
+        bucket, entry = found
+        return self.flatten(bucket, entry)
+
+    async def _push(self, data: dict[str, Any]) -> ObjectId:
+        data.setdefault("_id", ObjectId())
+        entry = self.to_entry(data)
+        await self.collection.update_one(
+            self.bucket_key(data),
+            {
+                "$push": {"entries": entry},
+                "$inc": {"count": 1, "total": entry.get("total", 0)},
+            },
+            upsert=True,
+        )
+        inserted_id: ObjectId = entry["_id"]
+        return inserted_id
+
+    @logged_write
+    async def insert_one(self, data: dict[str, Any]) -> ObjectId:
+        inserted_id = await self._push(data)
+        await self._log(None, data)
+        return inserted_id
+
+    @logged_write
+    async def insert_many(self, data: list[dict[str, Any]]) -> int:
+        """
+        Insert entries with one bucket write per bucket.
+        """
+        grouped: dict[tuple[Any, ...], list[dict[str, Any]]] = defaultdict(list)
+        for doc in data:
+            doc.setdefault("_id", ObjectId())
+            grouped[tuple(self.bucket_key(doc).values())].append(self.to_entry(doc))
+
+        await self.collection.bulk_write(
+            [
+                UpdateOne(
+                    dict(zip(("user_id", "month", "category"), key)),
+                    {
+                        "$push": {"entries": {"$each": entries}},
+                        "$inc": {
+                            "count": len(entries),
+                            "total": sum(entry.get("total", 0) for entry in entries),
+                        },
+                    },
+                    upsert=True,
+                )
+                for key, entries in grouped.items()
+            ],
+            ordered=False,
+        )
+        if self.changes is not None:
+            await self.changes.append([change(self.name, None, doc) for doc in data])
+        return len(data)
+
+    async def existing_import_hashes(
+        self, user_id: str | None, hashes: list[str]
+    ) -> set[str]:
+        pipeline: list[dict[str, Any]] = [
+            {"$match": {"user_id": user_id, "entries.import_hash": {"$in": hashes}}},
+            {"$unwind": "$entries"},
+            {"$match": {"entries.import_hash": {"$in": hashes}}},
+            {"$project": {"_id": 0, "import_hash": "$entries.import_hash"}},
+        ]
+        return {
+            doc["import_hash"]
+            async for doc in self.collection.aggregate(pipeline, **time_limit())
+        }
+
+    async def _pull(self, bucket: dict[str, Any], entry: dict[str, Any]) -> bool:
+        """
+        Remove an entry from its bucket, if it is still unchanged.
+        """
+        pull_result = await self.collection.update_one(
+            {
+                "_id": bucket["_id"],
+                "entries": {
+                    "$elemMatch": {"_id": entry["_id"], "total": entry.get("total")}
+                },
+            },
+            {
+                "$pull": {"entries": {"_id": entry["_id"]}},
+                "$inc": {"count": -1, "total": -entry.get("total", 0)},
+            },
+        )
+        if pull_result.modified_count == 0:
+            return False
+
+        await self.collection.delete_one({"_id": bucket["_id"], "count": 0})
+        return True
+
+    @logged_write
+    async def update_one(
+        self,
+        ledger_ids: list[str | None],
+        entry_id: ObjectId,
+        update_data: dict[str, Any],
+    ) -> bool:
+        for _ in range(self.max_update_attempts):
+            found = await self._find_bucket(ledger_ids, entry_id)
+            if found is None:
+                return False
+
+            bucket, entry = found
+            before = self.flatten(bucket, entry)
+            category = update_data.get("category")
+            if category is not None and category != bucket.get("category"):
+                # Moving to another category means moving to another bucket.
+                if await self._pull(bucket, entry):
+                    after = before | update_data | {"_id": entry_id}
+                    await self._push(dict(after))
+                    await self._log(before, after)
+                    return True
+                continue
+
+            entry_update = self.to_entry(update_data)
+            total_change = entry_update.get("total", entry.get("total", 0)) - (
+                entry.get("total", 0)
+            )
+            update_result = await self.collection.update_one(
+                {
+                    "_id": bucket["_id"],
+                    "entries": {
+                        "$elemMatch": {"_id": entry_id, "total": entry.get("total")}
+                    },
+                },
+                {
+                    "$set": {f"entries.$.{k}": v for k, v in entry_update.items()},
+                    "$inc": {"total": total_change},
+                },
+            )
+            if update_result.matched_count > 0:
+                await self._log(before, before | update_data)
+                return True
+
+        return False
+
+    @logged_write
+    async def delete_one(
+        self, ledger_ids: list[str | None], entry_id: ObjectId
+    ) -> bool:
+        for _ in range(self.max_update_attempts):
+            found = await self._find_bucket(ledger_ids, entry_id)
+            if found is None:
+                return False
+
+            if await self._pull(*found):
+                await self._log(self.flatten(*found), None)
+                return True
+
+        return False
+
+    async def monthly_totals(self, user_id: str | None) -> list[dict[str, Any]]:
+        return [
+            {
+                "month": doc["month"],
+                "category": doc["category"],
+                "count": doc["count"],
+                "total": doc["total"],
+            }
+            async for doc in self.collection.find(
+                {"user_id": user_id}, {"entries": 0}, max_time_ms=max_time_ms()
+            ).sort([("month", ASCENDING), ("category", ASCENDING)])
+        ]
+
+    async def project(
+        self, user_id: str | None, fields: list[str], since: datetime | None = None
+    ) -> AsyncIterator[Document]:
+        query: dict[str, Any] = {"user_id": user_id}
+        if since is not None:
+            query["month"] = {"$gte": month_of(since)}
+        projection = {"_id": 0} | {
+            field if field in BUCKET_FIELDS else f"entries.{field}": 1
+            for field in fields + ["created_at"]
+        }
+        async for bucket in self.collection.find(
+            query, projection, max_time_ms=max_time_ms()
+        ):
+            for entry in bucket.get("entries", []):
+                if since is None or as_utc(entry["created_at"]) >= as_utc(since):
+                    yield {
+                        field: value
+                        for field, value in self.flatten(bucket, entry).items()
+                        if field in fields
+                    }
+
+    async def search(
+        self, user_id: str | None, text: str, limit: int
+    ) -> list[Document]:
+        """
+        Text search finds buckets, entries are then matched on word prefixes and
+        scored by the share of search words they contain.
+        """
+        terms = {term.casefold() for term in text.split()}
+        if not terms:
+            return []
+
+        cursor = (
+            self.collection.find(text_query(user_id, text), TEXT_SCORE)
+            .sort([("score", TEXT_SCORE["score"])])
+            .max_time_ms(max_time_ms(settings.search_timeout_ms))
+        )
+        hits = []
+        async for bucket in cursor:
+            for entry in bucket.get("entries", []):
+                doc = self.flatten(bucket, entry)
+                words = f"{doc.get('place', '')} {doc.get('category', '')}".split()
+                matched = sum(
+                    any(word.casefold().startswith(term) for word in words)
+                    for term in terms
+                )
+                if matched:
+                    hits.append(doc | {"score": bucket["score"] * matched / len(terms)})
+
+        return heapq.nlargest(limit, hits, key=lambda doc: doc["score"])
+
+    async def count_values(self, user_id: str | None, field: str) -> dict[str, int]:
+        pipeline: list[dict[str, Any]] = [{"$match": {"user_id": user_id}}]
+        if field in BUCKET_FIELDS:
+            pipeline.append(
+                {"$group": {"_id": f"${field}", "count": {"$sum": "$count"}}}
+            )
+        else:
+            pipeline += [
+                {"$unwind": "$entries"},
+                {"$group": {"_id": f"$entries.{field}", "count": {"$sum": 1}}},
+            ]
+
+        return {
+            doc["_id"]: doc["count"]
+            async for doc in self.collection.aggregate(pipeline, **time_limit())
+            if doc["_id"]
+        }
+
+    async def older_than(self, before: datetime, limit: int) -> list[Document]:
+        """
+        Entries of the oldest buckets from months before a date, for archiving
+        whole months.
+        """
+        docs: list[Document] = []
+        async for bucket in self.collection.find(
+            {"month": {"$lt": month_of(before)}}
+        ).sort("month", ASCENDING):
+            docs.extend(self.flatten(bucket, entry) for entry in bucket["entries"])
+            if len(docs) >= limit:
+                break
+
+        return docs
+
+    async def delete_many(self, entry_ids: list[ObjectId]) -> int:
+        wanted = set(entry_ids)
+        deleted = 0
+        async for bucket in self.collection.find({"entries._id": {"$in": entry_ids}}):
+            entries = [entry for entry in bucket["entries"] if entry["_id"] in wanted]
+            await self.collection.update_one(
+                {"_id": bucket["_id"]},
+                {
+                    "$pull": {"entries": {"_id": {"$in": entry_ids}}},
+                    "$inc": {
+                        "count": -len(entries),
+                        "total": -sum(entry.get("total", 0) for entry in entries),
+                    },
+                },
+            )
+            deleted += len(entries)
+
+        await self.collection.delete_many({"count": {"$lte": 0}})
+        return deleted
+
+    async def restore_many(self, data: list[dict[str, Any]]) -> int:
+        for doc in data:
+            await self._push(doc)
+
+        return len(data)
+
+    async def create_indexes(self) -> None:
+        await self.collection.create_index(
+            [("user_id", ASCENDING), ("month", DESCENDING), ("category", ASCENDING)],
+            unique=True,
+        )
+        await self.collection.create_index("month")
+        await self.collection.create_index("entries._id")
+        await self.collection.create_index(
+            [("entries.ledger_id", ASCENDING), ("month", DESCENDING)]
+        )
+        await self.collection.create_index(
+            [("user_id", ASCENDING), ("entries.import_hash", ASCENDING)], sparse=True
+        )
+        await self.collection.create_index(
+            [("user_id", ASCENDING), ("entries.place", TEXT), ("category", TEXT)],
+            weights={"entries.place": 2, "category": 1},
+        )
@@ -0,0 +1,298 @@
+from datetime import datetime
+from typing import Any, AsyncIterator
+
+from bson import ObjectId
+from pymongo import ASCENDING, DESCENDING, TEXT
+from pymongo.errors import BulkWriteError
+
+from app.models import CategoryFilters
+from app.settings import settings
+from app.utilities.batching import insert_batcher
+from app.utilities.changes import (
+    ChangeLog,
+    change,
+    logged_write,
+)
+from app.utilities.clients import db
+from app.utilities.deadlines import max_time_ms, time_limit
+from app.utilities.stores.base import (
+    TEXT_SCORE,
+    Document,
+    text_query,
+)
+
+
+class DocumentStore:
+    """
+    One document per transaction.
+
+    With `batched`, inserts are coalesced into insert_many calls. `text_field`
+    is searched along with the category. Changes are logged right after their
+    write, as MongoDB has no transactions across collections outside replica
+    sets, in a task that finishes both when the caller is cancelled. Updates
+    and deletes get the document as it was from the write itself.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        batched: bool = False,
+        text_field: str = "place",
+        changes: ChangeLog | None = None,
+    ) -> None:
+        self.name = name
+        self.collection = db[name]
+        self.batched = batched
+        self.text_field = text_field
+        self.changes = changes
+
+    async def find(
+        self, ledger_ids: list[str | None], filters: CategoryFilters
+    ) -> AsyncIterator[Document]:
+        async for doc in (
+            self.collection.find(filters.to_query(ledger_ids))
+            .sort("created_at", DESCENDING)
+            .max_time_ms(max_time_ms())
+        ):
+            yield doc
+
+    async def find_one(
+        self, ledger_ids: list[str | None], entry_id: ObjectId
+    ) -> Document | None:
+        return await self.collection.find_one(
+            {"_id": entry_id, "ledger_id": {"$in": ledger_ids}},
+            max_time_ms=max_time_ms(),
+        )
+
+    @logged_write
+    async def insert_one(self, data: dict[str, Any]) -> ObjectId:
+        inserted_id: ObjectId
+        if self.batched:
+            inserted_id = await insert_batcher(self.collection).insert(data)
+        else:
+            create_result = await self.collection.insert_one(data)
+            inserted_id = create_result.inserted_id
+
+        if self.changes is not None:
+            await self.changes.append(
+                [change(self.name, None, data | {"_id": inserted_id})]
+            )
+        return inserted_id
+
+    async def _insert_many(self, data: list[dict[str, Any]]) -> list[dict[str, Any]]:
+        """
+        Insert documents, skipping ones that are already stored, and get the
+        ones inserted.
+        """
+        for doc in data:
+            doc.setdefault("_id", ObjectId())
+        try:
+            await self.collection.insert_many(data, ordered=False)
+        except BulkWriteError as e:
+            if any(error["code"] != 11000 for error in e.details["writeErrors"]):
+                raise
+            failed = {error["index"] for error in e.details["writeErrors"]}
+            return [doc for index, doc in enumerate(data) if index not in failed]
+
+        return data
+
+    @logged_write
+    async def insert_many(self, data: list[dict[str, Any]]) -> int:
+        """
+        Insert documents, skipping ones whose import hash is already stored.
+        """
+        inserted = await self._insert_many(data)
+        if self.changes is not None:
+            await self.changes.append(
+                [change(self.name, None, doc) for doc in inserted]
+            )
+        return len(inserted)
+
+    async def existing_import_hashes(
+        self, user_id: str | None, hashes: list[str]
+    ) -> set[str]:
+        return {
+            doc["import_hash"]
+            async for doc in self.collection.find(
+                {"user_id": user_id, "import_hash": {"$in": hashes}},
+                {"_id": 0, "import_hash": 1},
+                max_time_ms=max_time_ms(),
+            )
+        }
+
+    @logged_write
+    async def update_one(
+        self,
+        ledger_ids: list[str | None],
+        entry_id: ObjectId,
+        update_data: dict[str, Any],
+    ) -> bool:
+        query = {"_id": entry_id, "ledger_id": {"$in": ledger_ids}}
+        if self.changes is None:
+            update_result = await self.collection.update_one(
+                query, {"$set": update_data}
+            )
+            return update_result.matched_count > 0
+
+        before = await self.collection.find_one_and_update(query, {"$set": update_data})
+        if before is None:
+            return False
+
+        await self.changes.append([change(self.name, before, before | update_data)])
+        return True
+
+    @logged_write
+    async def delete_one(
+        self, ledger_ids: list[str | None], entry_id: ObjectId
+    ) -> bool:
+        query = {"_id": entry_id, "ledger_id": {"$in": ledger_ids}}
+        if self.changes is None:
+            delete_result = await self.collection.delete_one(query)
+            return delete_result.deleted_count > 0
+
+        before = await self.collection.find_one_and_delete(query)
+        if before is None:
+            return False
+
+        await self.changes.append([change(self.name, before, None)])
+        return True
+
+    @logged_write
+    async def increment(
+        self,
+        ledger_ids: list[str | None],
+        entry_id: ObjectId,
+        field: str,
+        amount: int,
+        update_data: dict[str, Any],
+    ) -> Document | None:
+        """
+        Atomically add to a field that must not go below zero, and get the
+        updated document. None when it is not found or would go negative.
+        """
+        query: dict[str, Any] = {"_id": entry_id, "ledger_id": {"$in": ledger_ids}}
+        if amount < 0:
+            query[field] = {"$gte": -amount}
+
+        before = await self.collection.find_one_and_update(
+            query, {"$inc": {field: amount}, "$set": update_data}
+        )
+        if before is None:
+            return None
+
+        after = before | update_data | {field: before.get(field, 0) + amount}
+        if self.changes is not None:
+            await self.changes.append([change(self.name, before, after)])
+        return after
+
+    async def monthly_totals(self, user_id: str | None) -> list[dict[str, Any]]:
+        pipeline: list[dict[str, Any]] = [
+            {"$match": {"user_id": user_id}},
+            {
+                "$group": {
+                    "_id": {
+                        "month": {
+                            "$dateToString": {"format": "%Y-%m", "date": "$created_at"}
+                        },
+                        "category": "$category",
+                    },
+                    "count": {"$sum": 1},
+                    "total": {"$sum": "$total"},
+                }
+            },
+            {"$sort": {"_id.month": ASCENDING, "_id.category": ASCENDING}},
+        ]
+        return [
+            {
+                "month": doc["_id"]["month"],
+                "category": doc["_id"]["category"],
+                "count": doc["count"],
+                "total": doc["total"],
+            }
+            async for doc in self.collection.aggregate(pipeline, **time_limit())
+        ]
+
+    async def project(
+        self, user_id: str | None, fields: list[str], since: datetime | None = None
+    ) -> AsyncIterator[Document]:
+        """
+        A user's transactions with only some fields, for bulk reads, all of
+        them or those from a date on.
+        """
+        query: dict[str, Any] = {"user_id": user_id}
+        if since is not None:
+            query["created_at"] = {"$gte": since}
+        projection = {"_id": 0} | {field: 1 for field in fields}
+        async for doc in self.collection.find(
+            query,
+            projection,
+            batch_size=10000,
+            max_time_ms=max_time_ms(),
+        ):
+            yield doc
+
+    async def search(
+        self, user_id: str | None, text: str, limit: int
+    ) -> list[Document]:
+        cursor = (
+            self.collection.find(text_query(user_id, text), TEXT_SCORE)
+            .sort([("score", TEXT_SCORE["score"])])
+            .limit(limit)
+            .max_time_ms(max_time_ms(settings.search_timeout_ms))
+        )
+        return await cursor.to_list(None)
+
+    async def count_values(self, user_id: str | None, field: str) -> dict[str, int]:
+        pipeline: list[dict[str, Any]] = [
+            {"$match": {"user_id": user_id}},
+            {"$group": {"_id": f"${field}", "count": {"$sum": 1}}},
+        ]
+        return {
+            doc["_id"]: doc["count"]
+            async for doc in self.collection.aggregate(pipeline, **time_limit())
+            if doc["_id"]
+        }
+
+    async def older_than(self, before: datetime, limit: int) -> list[Document]:
+        """
+        Oldest documents from before a date, for archiving.
+        """
+        return await (
+            self.collection.find({"created_at": {"$lt": before}})
+            .sort("created_at", ASCENDING)
+            .limit(limit)
+            .to_list(None)
+        )
+
+    async def delete_many(self, entry_ids: list[ObjectId]) -> int:
+        delete_result = await self.collection.delete_many({"_id": {"$in": entry_ids}})
+        deleted: int = delete_result.deleted_count
+        return deleted
+
+    async def restore_many(self, data: list[dict[str, Any]]) -> int:
+        return len(await self._insert_many(data))
+
+    async def create_indexes(self) -> None:
+        await self.collection.create_index(
+            [("user_id", ASCENDING), ("created_at", DESCENDING)]
+        )
+        await self.collection.create_index("created_at")
+        await self.collection.create_index(
+            [("user_id", ASCENDING), (self.text_field, TEXT), ("category", TEXT)],
+            weights={self.text_field: 2, "category": 1},
+        )
+        await self.collection.create_index(
+            [("ledger_id", ASCENDING), ("created_at", DESCENDING)]
+        )
+        await self.collection.create_index(
+            [
+                ("ledger_id", ASCENDING),
+                ("category", ASCENDING),
+                ("created_at", DESCENDING),
+            ]
+        )
+        await self.collection.create_index(
+            [("user_id", ASCENDING), ("import_hash", ASCENDING)],
+            unique=True,
+            partialFilterExpression={"import_hash": {"$exists": True}},
+        )
@@ -0,0 +1,296 @@
+import bisect
+import heapq
+from collections import Counter, defaultdict
+from datetime import datetime
+from typing import Any, AsyncIterator
+
+from bson import ObjectId
+
+from app.models import CategoryFilters, TransactionFilters, as_utc
+from app.utilities.changes import (
+    ChangeLog,
+    change,
+    change_log,
+    logged_write,
+)
+from app.utilities.stores.base import (
+    Document,
+    month_of,
+)
+
+
+class MemoryStore:
+    """
+    Documents held in the process, for running the API and benchmarks without
+    MongoDB. Nothing is persisted.
+
+    Each ledger and each user has its documents' (created_at, _id) keys in
+    ascending order, so date ranges are found by bisection and lists come out
+    newest first without sorting.
+    """
+
+    def __init__(
+        self, name: str, text_field: str = "place", changes: ChangeLog | None = None
+    ) -> None:
+        self.name = name
+        self.text_field = text_field
+        self.changes = changes
+        self._docs: dict[ObjectId, dict[str, Any]] = {}
+        self._by_ledger: dict[str | None, list[tuple[datetime, ObjectId]]] = (
+            defaultdict(list)
+        )
+        self._by_user: dict[str | None, list[tuple[datetime, ObjectId]]] = defaultdict(
+            list
+        )
+        self._import_hashes: dict[str | None, set[str]] = defaultdict(set)
+
+    @staticmethod
+    def _key(doc: dict[str, Any]) -> tuple[datetime, ObjectId]:
+        return as_utc(doc["created_at"]), doc["_id"]
+
+    def _add(self, doc: dict[str, Any]) -> None:
+        key = self._key(doc)
+        bisect.insort(self._by_ledger[doc.get("ledger_id")], key)
+        bisect.insort(self._by_user[doc.get("user_id")], key)
+        if doc.get("import_hash"):
+            self._import_hashes[doc.get("user_id")].add(doc["import_hash"])
+        self._docs[doc["_id"]] = doc
+
+    def _remove(self, doc: dict[str, Any]) -> None:
+        key = self._key(doc)
+        for keys in (
+            self._by_ledger[doc.get("ledger_id")],
+            self._by_user[doc.get("user_id")],
+        ):
+            del keys[bisect.bisect_left(keys, key)]
+        if doc.get("import_hash"):
+            self._import_hashes[doc.get("user_id")].discard(doc["import_hash"])
+        del self._docs[doc["_id"]]
+
+    def _visible(
+        self, ledger_ids: list[str | None], entry_id: ObjectId
+    ) -> dict[str, Any] | None:
+        doc = self._docs.get(entry_id)
+        if doc is None or doc.get("ledger_id") not in ledger_ids:
+            return None
+
+        return doc
+
+    def _user_docs(self, user_id: str | None) -> list[dict[str, Any]]:
+        return [self._docs[entry_id] for _, entry_id in self._by_user.get(user_id, [])]
+
+    async def _log(
+        self, before: dict[str, Any] | None, after: dict[str, Any] | None
+    ) -> None:
+        if self.changes is not None:
+            await self.changes.append([change(self.name, before, after)])
+
+    async def find(
+        self, ledger_ids: list[str | None], filters: CategoryFilters
+    ) -> AsyncIterator[Document]:
+        start = end = None
+        if isinstance(filters, TransactionFilters):
+            start, end = filters.start, filters.end
+
+        ranges = []
+        for ledger_id in set(ledger_ids):
+            keys = self._by_ledger.get(ledger_id)
+            if not keys:
+                continue
+            # A one-element tuple sorts before every key with the same date.
+            low = bisect.bisect_left(keys, (as_utc(start),)) if start else 0
+            high = bisect.bisect_left(keys, (as_utc(end),)) if end else len(keys)
+            # Copied, as documents can be written while the caller iterates.
+            ranges.append(keys[low:high][::-1])
+
+        for _, entry_id in heapq.merge(*ranges, reverse=True):
+            doc = self._docs.get(entry_id)
+            if doc is not None and filters.matches(doc):
+                yield dict(doc)
+
+    async def find_one(
+        self, ledger_ids: list[str | None], entry_id: ObjectId
+    ) -> Document | None:
+        doc = self._visible(ledger_ids, entry_id)
+        return dict(doc) if doc is not None else None
+
+    @logged_write
+    async def insert_one(self, data: dict[str, Any]) -> ObjectId:
+        data.setdefault("_id", ObjectId())
+        self._add(dict(data))
+        await self._log(None, data)
+        inserted_id: ObjectId = data["_id"]
+        return inserted_id
+
+    async def insert_many(self, data: list[dict[str, Any]]) -> int:
+        """
+        Insert documents, skipping ones whose import hash is already stored.
+        """
+        inserted = 0
+        for doc in data:
+            import_hash = doc.get("import_hash")
+            if import_hash and import_hash in self._import_hashes[doc.get("user_id")]:
+                continue
+            await self.insert_one(doc)
+            inserted += 1
+
+        return inserted
+
+    async def existing_import_hashes(
+        self, user_id: str | None, hashes: list[str]
+    ) -> set[str]:
+        return self._import_hashes[user_id].intersection(hashes)
+
+    @logged_write
+    async def update_one(
+        self,
+        ledger_ids: list[str | None],
+        entry_id: ObjectId,
+        update_data: dict[str, Any],
+    ) -> bool:
+        doc = self._visible(ledger_ids, entry_id)
+        if doc is None:
+            return False
+
+        self._remove(doc)
+        self._add(doc | update_data)
+        await self._log(doc, doc | update_data)
+        return True
+
+    @logged_write
+    async def delete_one(
+        self, ledger_ids: list[str | None], entry_id: ObjectId
+    ) -> bool:
+        doc = self._visible(ledger_ids, entry_id)
+        if doc is None:
+            return False
+
+        self._remove(doc)
+        await self._log(doc, None)
+        return True
+
+    @logged_write
+    async def increment(
+        self,
+        ledger_ids: list[str | None],
+        entry_id: ObjectId,
+        field: str,
+        amount: int,
+        update_data: dict[str, Any],
+    ) -> Document | None:
+        doc = self._visible(ledger_ids, entry_id)
+        if doc is None or doc.get(field, 0) + amount < 0:
+            return None
+
+        before = dict(doc)
+        doc[field] = doc.get(field, 0) + amount
+        doc.update(update_data)
+        await self._log(before, doc)
+        return dict(doc)
+
+    async def monthly_totals(self, user_id: str | None) -> list[dict[str, Any]]:
+        groups: dict[tuple[str, Any], dict[str, Any]] = {}
+        for doc in self._user_docs(user_id):
+            month = month_of(doc["created_at"])
+            group = groups.setdefault(
+                (month, doc.get("category")),
+                {
+                    "month": month,
+                    "category": doc.get("category"),
+                    "count": 0,
+                    "total": 0,
+                },
+            )
+            group["count"] += 1
+            group["total"] += doc.get("total") or 0
+
+        return [
+            groups[key] for key in sorted(groups, key=lambda key: (key[0], str(key[1])))
+        ]
+
+    async def project(
+        self, user_id: str | None, fields: list[str], since: datetime | None = None
+    ) -> AsyncIterator[Document]:
+        keys = self._by_user.get(user_id, [])
+        low = bisect.bisect_left(keys, (as_utc(since),)) if since else 0
+        for _, entry_id in keys[low:]:
+            doc = self._docs[entry_id]
+            yield {field: doc[field] for field in fields if field in doc}
+
+    async def search(
+        self, user_id: str | None, text: str, limit: int
+    ) -> list[Document]:
+        """
+        Documents whose words start with the search words, weighted like the
+        MongoDB text indexes.
+        """
+        terms = {term.casefold() for term in text.split()}
+        if not terms:
+            return []
+
+        hits = []
+        for doc in self._user_docs(user_id):
+            text_words = str(doc.get(self.text_field) or "").casefold().split()
+            category_words = str(doc.get("category") or "").casefold().split()
+            score = 0
+            for term in terms:
+                if any(word.startswith(term) for word in text_words):
+                    score += 2
+                elif any(word.startswith(term) for word in category_words):
+                    score += 1
+            if score:
+                hits.append(doc | {"score": score / len(terms)})
+
+        return heapq.nlargest(limit, hits, key=lambda doc: doc["score"])
+
+    async def count_values(self, user_id: str | None, field: str) -> dict[str, int]:
+        counts: Counter[str] = Counter(
+            doc[field] for doc in self._user_docs(user_id) if doc.get(field)
+        )
+        return dict(counts)
+
+    async def older_than(self, before: datetime, limit: int) -> list[Document]:
+        return [
+            dict(doc)
+            for doc in heapq.nsmallest(
+                limit,
+                (
+                    doc
+                    for doc in self._docs.values()
+                    if as_utc(doc["created_at"]) < as_utc(before)
+                ),
+                key=self._key,
+            )
+        ]
+
+    async def delete_many(self, entry_ids: list[ObjectId]) -> int:
+        deleted = 0
+        for entry_id in entry_ids:
+            doc = self._docs.get(entry_id)
+            if doc is not None:
+                self._remove(doc)
+                deleted += 1
+
+        return deleted
+
+    async def restore_many(self, data: list[dict[str, Any]]) -> int:
+        restored = 0
+        for doc in data:
+            if doc["_id"] not in self._docs:
+                self._add(dict(doc))
+                restored += 1
+
+        return restored
+
+    async def create_indexes(self) -> None:
+        pass
+
+
+_memory_stores: dict[str, MemoryStore] = {}
+
+
+def memory_store(name: str, text_field: str = "place") -> MemoryStore:
+    if name not in _memory_stores:
+        _memory_stores[name] = MemoryStore(name, text_field, change_log())
+
+    return _memory_stores[name]
@@ -0,0 +1,384 @@
+import json
+import sqlite3
+from datetime import datetime
+from typing import Any, AsyncIterator, Callable, TypeVar
+
+import bson
+from bson import ObjectId
+
+from app.models import CategoryFilters, epoch_micros
+from app.utilities import sqlite
+from app.utilities.changes import (
+    SQLiteChanges,
+    change,
+)
+from app.utilities.sqlite import write_transaction
+from app.utilities.stores.base import (
+    Document,
+)
+
+T = TypeVar("T")
+
+
+class SQLiteStore:
+    """
+    One row per document in a SQLite table, for single-node installs.
+
+    Documents are kept whole as BSON next to copies of the fields queries
+    filter, group and sort on. Reports read only the covering
+    (user_id, created_at, category, total) index, and search uses an FTS5
+    index on `text_field` and the category. Changes are logged in the same
+    transaction as their write.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        text_field: str = "place",
+        changes: SQLiteChanges | None = None,
+    ) -> None:
+        self.name = name
+        self.text_field = text_field
+        self.changes = changes
+        self.pool = sqlite.pool
+        self._ready = False
+
+    def _row(self, doc: dict[str, Any]) -> tuple[Any, ...]:
+        return (
+            str(doc["_id"]),
+            doc.get("user_id"),
+            doc.get("ledger_id"),
+            epoch_micros(doc["created_at"]),
+            doc.get("category"),
+            doc.get(self.text_field),
+            doc.get("total"),
+            doc.get("import_hash"),
+            bson.encode(doc),
+        )
+
+    async def _run(self, fn: Callable[[sqlite3.Connection], T]) -> T:
+        if not self._ready:
+            await self.create_indexes()
+
+        return await self.pool.run(fn)
+
+    def _log(
+        self,
+        connection: sqlite3.Connection,
+        before: dict[str, Any] | None,
+        after: dict[str, Any] | None,
+    ) -> None:
+        if self.changes is not None:
+            self.changes.write(connection, [change(self.name, before, after)])
+
+    def _insert(self, verb: str) -> str:
+        return (
+            f"{verb} INTO {self.name} (id, user_id, ledger_id, created_at, category,"
+            " text, total, import_hash, doc) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"
+        )
+
+    async def find(
+        self, ledger_ids: list[str | None], filters: CategoryFilters
+    ) -> AsyncIterator[Document]:
+        condition, params = filters.to_sql(ledger_ids)
+
+        def select(connection: sqlite3.Connection) -> list[Document]:
+            rows = connection.execute(
+                f"SELECT doc FROM {self.name} WHERE {condition}"
+                " ORDER BY created_at DESC",
+                params,
+            )
+            return [bson.decode(doc) for doc, in rows]
+
+        for doc in await self._run(select):
+            yield doc
+
+    async def find_one(
+        self, ledger_ids: list[str | None], entry_id: ObjectId
+    ) -> Document | None:
+        def select(connection: sqlite3.Connection) -> Document | None:
+            row = connection.execute(
+                f"SELECT doc FROM {self.name} WHERE id = ?"
+                " AND ledger_id IN (SELECT value FROM json_each(?))",
+                (str(entry_id), json.dumps(ledger_ids)),
+            ).fetchone()
+            return bson.decode(row[0]) if row else None
+
+        return await self._run(select)
+
+    async def insert_one(self, data: dict[str, Any]) -> ObjectId:
+        data.setdefault("_id", ObjectId())
+        row = self._row(data)
+
+        def insert(connection: sqlite3.Connection) -> None:
+            with write_transaction(connection):
+                connection.execute(self._insert("INSERT"), row)
+                self._log(connection, None, data)
+
+        await self._run(insert)
+        inserted_id: ObjectId = data["_id"]
+        return inserted_id
+
+    async def insert_many(self, data: list[dict[str, Any]]) -> int:
+        """
+        Insert documents, skipping ones whose import hash is already stored.
+        """
+        for doc in data:
+            doc.setdefault("_id", ObjectId())
+        rows = [self._row(doc) for doc in data]
+
+        def insert(connection: sqlite3.Connection) -> int:
+            with write_transaction(connection):
+                if self.changes is None:
+                    cursor = connection.executemany(
+                        self._insert("INSERT OR IGNORE"), rows
+                    )
+                    return cursor.rowcount
+                inserted = [
+                    doc
+                    for doc, row in zip(data, rows)
+                    if connection.execute(
+                        self._insert("INSERT OR IGNORE"), row
+                    ).rowcount
+                ]
+                self.changes.write(
+                    connection, [change(self.name, None, doc) for doc in inserted]
+                )
+            return len(inserted)
+
+        return await self._run(insert)
+
+    async def existing_import_hashes(
+        self, user_id: str | None, hashes: list[str]
+    ) -> set[str]:
+        def select(connection: sqlite3.Connection) -> set[str]:
+            rows = connection.execute(
+                f"SELECT import_hash FROM {self.name} WHERE user_id = ?"
+                " AND import_hash IN (SELECT value FROM json_each(?))",
+                (user_id, json.dumps(hashes)),
+            )
+            return {import_hash for import_hash, in rows}
+
+        return await self._run(select)
+
+    async def update_one(
+        self,
+        ledger_ids: list[str | None],
+        entry_id: ObjectId,
+        update_data: dict[str, Any],
+    ) -> bool:
+        def update(connection: sqlite3.Connection) -> bool:
+            with write_transaction(connection):
+                row = connection.execute(
+                    f"SELECT doc FROM {self.name} WHERE id = ?"
+                    " AND ledger_id IN (SELECT value FROM json_each(?))",
+                    (str(entry_id), json.dumps(ledger_ids)),
+                ).fetchone()
+                if row is None:
+                    return False
+                before = bson.decode(row[0])
+                row = self._row(before | update_data)
+                connection.execute(
+                    f"UPDATE {self.name} SET user_id = ?, ledger_id = ?,"
+                    " created_at = ?, category = ?, text = ?, total = ?,"
+                    " import_hash = ?, doc = ? WHERE id = ?",
+                    (*row[1:], row[0]),
+                )
+                self._log(connection, before, before | update_data)
+            return True
+
+        return await self._run(update)
+
+    async def delete_one(
+        self, ledger_ids: list[str | None], entry_id: ObjectId
+    ) -> bool:
+        def delete(connection: sqlite3.Connection) -> bool:
+            with write_transaction(connection):
+                rows = connection.execute(
+                    f"DELETE FROM {self.name} WHERE id = ?"
+                    " AND ledger_id IN (SELECT value FROM json_each(?))"
+                    " RETURNING doc",
+                    (str(entry_id), json.dumps(ledger_ids)),
+                ).fetchall()
+                if not rows:
+                    return False
+                self._log(connection, bson.decode(rows[0][0]), None)
+            return True
+
+        return await self._run(delete)
+
+    async def increment(
+        self,
+        ledger_ids: list[str | None],
+        entry_id: ObjectId,
+        field: str,
+        amount: int,
+        update_data: dict[str, Any],
+    ) -> Document | None:
+        def update(connection: sqlite3.Connection) -> Document | None:
+            with write_transaction(connection):
+                row = connection.execute(
+                    f"SELECT doc FROM {self.name} WHERE id = ?"
+                    " AND ledger_id IN (SELECT value FROM json_each(?))",
+                    (str(entry_id), json.dumps(ledger_ids)),
+                ).fetchone()
+                if row is None:
+                    return None
+                before: Document = bson.decode(row[0])
+                if before.get(field, 0) + amount < 0:
+                    return None
+                doc = before | update_data | {field: before.get(field, 0) + amount}
+                connection.execute(
+                    f"UPDATE {self.name} SET doc = ? WHERE id = ?",
+                    (bson.encode(doc), str(entry_id)),
+                )
+                self._log(connection, before, doc)
+            return doc
+
+        return await self._run(update)
+
+    async def monthly_totals(self, user_id: str | None) -> list[dict[str, Any]]:
+        def select(connection: sqlite3.Connection) -> list[dict[str, Any]]:
+            rows = connection.execute(
+                "SELECT strftime('%Y-%m', created_at / 1000000, 'unixepoch') AS month,"
+                f" category, count(*), total(total) FROM {self.name}"
+                " WHERE user_id = ? GROUP BY month, category ORDER BY month, category",
+                (user_id,),
+            )
+            return [
+                {"month": month, "category": category, "count": count, "total": total}
+                for month, category, count, total in rows
+            ]
+
+        return await self._run(select)
+
+    async def project(
+        self, user_id: str | None, fields: list[str], since: datetime | None = None
+    ) -> AsyncIterator[Document]:
+        def select(connection: sqlite3.Connection) -> list[Document]:
+            rows = connection.execute(
+                f"SELECT doc FROM {self.name} WHERE user_id = ? AND created_at >= ?",
+                (user_id, epoch_micros(since) if since else 0),
+            )
+            return [
+                {field: doc[field] for field in fields if field in doc}
+                for doc in (bson.decode(doc) for doc, in rows)
+            ]
+
+        for doc in await self._run(select):
+            yield doc
+
+    async def search(
+        self, user_id: str | None, text: str, limit: int
+    ) -> list[Document]:
+        """
+        Documents with words starting with any of the search words, ranked by
+        BM25 with the text field weighted like the MongoDB text indexes.
+        """
+        terms = text.split()
+        if not terms:
+            return []
+
+        match = " OR ".join('"{}"*'.format(term.replace('"', '""')) for term in terms)
+
+        def select(connection: sqlite3.Connection) -> list[Document]:
+            rows = connection.execute(
+                f"SELECT {self.name}.doc, -bm25({self.name}_search, 2.0, 1.0) AS score"
+                f" FROM {self.name}_search JOIN {self.name}"
+                f" ON {self.name}.rowid = {self.name}_search.rowid"
+                f" WHERE {self.name}_search MATCH ? AND {self.name}.user_id = ?"
+                " ORDER BY score DESC LIMIT ?",
+                (match, user_id, limit),
+            )
+            return [bson.decode(doc) | {"score": score} for doc, score in rows]
+
+        return await self._run(select)
+
+    async def count_values(self, user_id: str | None, field: str) -> dict[str, int]:
+        column = {"category": "category", self.text_field: "text"}[field]
+
+        def select(connection: sqlite3.Connection) -> dict[str, int]:
+            rows = connection.execute(
+                f"SELECT {column}, count(*) FROM {self.name}"
+                f" WHERE user_id = ? AND {column} IS NOT NULL AND {column} != ''"
+                f" GROUP BY {column}",
+                (user_id,),
+            )
+            return dict(rows)
+
+        return await self._run(select)
+
+    async def older_than(self, before: datetime, limit: int) -> list[Document]:
+        def select(connection: sqlite3.Connection) -> list[Document]:
+            rows = connection.execute(
+                f"SELECT doc FROM {self.name} WHERE created_at < ?"
+                " ORDER BY created_at LIMIT ?",
+                (epoch_micros(before), limit),
+            )
+            return [bson.decode(doc) for doc, in rows]
+
+        return await self._run(select)
+
+    async def delete_many(self, entry_ids: list[ObjectId]) -> int:
+        def delete(connection: sqlite3.Connection) -> int:
+            cursor = connection.execute(
+                f"DELETE FROM {self.name} WHERE id IN (SELECT value FROM json_each(?))",
+                (json.dumps([str(entry_id) for entry_id in entry_ids]),),
+            )
+            return cursor.rowcount
+
+        return await self._run(delete)
+
+    async def restore_many(self, data: list[dict[str, Any]]) -> int:
+        rows = [self._row(doc) for doc in data]
+
+        def insert(connection: sqlite3.Connection) -> int:
+            with write_transaction(connection):
+                cursor = connection.executemany(self._insert("INSERT OR IGNORE"), rows)
+            return cursor.rowcount
+
+        return await self._run(insert)
+
+    async def create_indexes(self) -> None:
+        """
+        Create the table, its indexes and the search index kept in sync by
+        triggers.
+        """
+        name = self.name
+        statements = [
+            f"CREATE TABLE IF NOT EXISTS {name} (id TEXT PRIMARY KEY, user_id TEXT,"
+            " ledger_id TEXT, created_at INTEGER NOT NULL, category TEXT, text TEXT,"
+            " total REAL, import_hash TEXT, doc BLOB NOT NULL)",
+            f"CREATE INDEX IF NOT EXISTS {name}_user_created"
+            f" ON {name} (user_id, created_at, category, total)",
+            f"CREATE INDEX IF NOT EXISTS {name}_ledger_created"
+            f" ON {name} (ledger_id, created_at)",
+            f"CREATE INDEX IF NOT EXISTS {name}_created ON {name} (created_at)",
+            f"CREATE INDEX IF NOT EXISTS {name}_ledger_category_created"
+            f" ON {name} (ledger_id, category, created_at)",
+            f"CREATE UNIQUE INDEX IF NOT EXISTS {name}_import_hash"
+            f" ON {name} (user_id, import_hash) WHERE import_hash IS NOT NULL",
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {name}_search USING fts5"
+            f"(text, category, content={name}, content_rowid=rowid)",
+            f"CREATE TRIGGER IF NOT EXISTS {name}_search_insert AFTER INSERT ON {name}"
+            f" BEGIN INSERT INTO {name}_search (rowid, text, category)"
+            " VALUES (new.rowid, new.text, new.category); END",
+            f"CREATE TRIGGER IF NOT EXISTS {name}_search_delete AFTER DELETE ON {name}"
+            f" BEGIN INSERT INTO {name}_search ({name}_search, rowid, text, category)"
+            " VALUES ('delete', old.rowid, old.text, old.category); END",
+            f"CREATE TRIGGER IF NOT EXISTS {name}_search_update AFTER UPDATE ON {name}"
+            f" BEGIN INSERT INTO {name}_search ({name}_search, rowid, text, category)"
+            " VALUES ('delete', old.rowid, old.text, old.category);"
+            f" INSERT INTO {name}_search (rowid, text, category)"
+            " VALUES (new.rowid, new.text, new.category); END",
+        ]
+
+        def create(connection: sqlite3.Connection) -> None:
+            with write_transaction(connection):
+                for statement in statements:
+                    connection.execute(statement)
+
+        await self.pool.run(create)
+        if self.changes is not None:
+            await self.changes.create_indexes()
+        self._ready = True
@@ -0,0 +1,205 @@
+import heapq
+from datetime import datetime
+from typing import Any, AsyncIterator
+
+from bson import ObjectId
+
+from app.models import CategoryFilters, TransactionFilters, as_utc
+from app.utilities.archive import (
+    ROLLUP_FIELDS,
+    ColdStore,
+    archive_cutoff,
+    rollup_rows,
+    unpack,
+)
+from app.utilities.stores.base import (
+    Document,
+    TransactionStore,
+    month_of,
+)
+
+
+class TieredStore:
+    """
+    Recent transactions in a hot store, and older ones archived into
+    compressed monthly chunks in a cold store.
+
+    Reads only go to the archive when their date range reaches before the
+    archive cutoff. Projections of amounts, dates and categories read the
+    archive's daily totals instead of its documents, so reports do not
+    decompress it. Search and suggestions only cover recent transactions.
+
+    Writes to an archived transaction first move it back to the hot store,
+    until archiving moves it again.
+    """
+
+    # Retries when a chunk changes between reading and rewriting it.
+    max_update_attempts = 5
+
+    def __init__(self, hot: TransactionStore, cold: ColdStore) -> None:
+        self.hot = hot
+        self.cold = cold
+
+    @staticmethod
+    def _key(doc: dict[str, Any]) -> tuple[datetime, ObjectId]:
+        return as_utc(doc["created_at"]), doc["_id"]
+
+    async def find(
+        self, ledger_ids: list[str | None], filters: CategoryFilters
+    ) -> AsyncIterator[Document]:
+        start = end = None
+        if isinstance(filters, TransactionFilters):
+            start, end = filters.start, filters.end
+        if start is not None and as_utc(start) >= archive_cutoff():
+            async for doc in self.hot.find(ledger_ids, filters):
+                yield doc
+            return
+
+        archived = [
+            doc
+            async for chunk in self.cold.ledger_chunks(ledger_ids, start, end)
+            for doc in unpack(chunk)
+            if filters.matches(doc)
+        ]
+        archived.sort(key=self._key, reverse=True)
+        hot = [doc async for doc in self.hot.find(ledger_ids, filters)]
+        for doc in heapq.merge(hot, archived, key=self._key, reverse=True):
+            yield doc
+
+    async def find_one(
+        self, ledger_ids: list[str | None], entry_id: ObjectId
+    ) -> Document | None:
+        doc = await self.hot.find_one(ledger_ids, entry_id)
+        if doc is not None:
+            return doc
+
+        chunk = await self.cold.chunk_with(ledger_ids, entry_id)
+        if chunk is None:
+            return None
+
+        return next(doc for doc in unpack(chunk) if doc["_id"] == entry_id)
+
+    async def insert_one(self, data: dict[str, Any]) -> ObjectId:
+        return await self.hot.insert_one(data)
+
+    async def insert_many(self, data: list[dict[str, Any]]) -> int:
+        return await self.hot.insert_many(data)
+
+    async def existing_import_hashes(
+        self, user_id: str | None, hashes: list[str]
+    ) -> set[str]:
+        return await self.hot.existing_import_hashes(
+            user_id, hashes
+        ) | await self.cold.existing_import_hashes(user_id, hashes)
+
+    async def _restore(self, ledger_ids: list[str | None], entry_id: ObjectId) -> bool:
+        """
+        Move an archived transaction back to the hot store.
+
+        It is copied before it leaves its chunk, so an interruption leaves it
+        in both, and the next archiving run drops the hot copy.
+        """
+        for _ in range(self.max_update_attempts):
+            chunk = await self.cold.chunk_with(ledger_ids, entry_id)
+            if chunk is None:
+                return False
+
+            docs = unpack(chunk)
+            doc = next(doc for doc in docs if doc["_id"] == entry_id)
+            if await self.hot.find_one(ledger_ids, entry_id) is None:
+                await self.hot.restore_many([doc])
+            if await self.cold.replace(
+                chunk, [doc for doc in docs if doc["_id"] != entry_id]
+            ):
+                return True
+
+        return False
+
+    async def update_one(
+        self,
+        ledger_ids: list[str | None],
+        entry_id: ObjectId,
+        update_data: dict[str, Any],
+    ) -> bool:
+        if await self.hot.update_one(ledger_ids, entry_id, update_data):
+            return True
+
+        return await self._restore(ledger_ids, entry_id) and await self.hot.update_one(
+            ledger_ids, entry_id, update_data
+        )
+
+    async def delete_one(
+        self, ledger_ids: list[str | None], entry_id: ObjectId
+    ) -> bool:
+        if await self.hot.delete_one(ledger_ids, entry_id):
+            return True
+
+        return await self._restore(ledger_ids, entry_id) and await self.hot.delete_one(
+            ledger_ids, entry_id
+        )
+
+    async def monthly_totals(self, user_id: str | None) -> list[dict[str, Any]]:
+        groups = {
+            (group["month"], group["category"]): group
+            for group in await self.hot.monthly_totals(user_id)
+        }
+        async for chunk in self.cold.user_chunks(user_id, None, with_data=False):
+            month = month_of(chunk["month"])
+            for rollup in chunk["days"]:
+                group = groups.setdefault(
+                    (month, rollup["category"]),
+                    {
+                        "month": month,
+                        "category": rollup["category"],
+                        "count": 0,
+                        "total": 0,
+                    },
+                )
+                group["count"] += rollup["count"]
+                group["total"] += rollup["total"]
+
+        return [
+            groups[key] for key in sorted(groups, key=lambda key: (key[0], str(key[1])))
+        ]
+
+    async def search(
+        self, user_id: str | None, text: str, limit: int
+    ) -> list[Document]:
+        return await self.hot.search(user_id, text, limit)
+
+    async def project(
+        self, user_id: str | None, fields: list[str], since: datetime | None = None
+    ) -> AsyncIterator[Document]:
+        """
+        A user's transactions with only some fields. Archived ones come as one
+        row per day, category and currency when only rollup fields are asked
+        for, which adds up to the same totals.
+        """
+        async for doc in self.hot.project(user_id, fields, since):
+            yield doc
+
+        if since is not None and as_utc(since) >= archive_cutoff():
+            return
+
+        rollups = set(fields) <= ROLLUP_FIELDS
+        async for chunk in self.cold.user_chunks(user_id, since, with_data=not rollups):
+            docs = rollup_rows(chunk, fields) if rollups else unpack(chunk)
+            for doc in docs:
+                if since is None or as_utc(doc["created_at"]) >= as_utc(since):
+                    yield {field: doc[field] for field in fields if field in doc}
+
+    async def count_values(self, user_id: str | None, field: str) -> dict[str, int]:
+        return await self.hot.count_values(user_id, field)
+
+    async def older_than(self, before: datetime, limit: int) -> list[Document]:
+        return await self.hot.older_than(before, limit)
+
+    async def delete_many(self, entry_ids: list[ObjectId]) -> int:
+        return await self.hot.delete_many(entry_ids)
+
+    async def restore_many(self, data: list[dict[str, Any]]) -> int:
+        return await self.hot.restore_many(data)
+
+    async def create_indexes(self) -> None:
+        await self.hot.create_indexes()
+        await self.cold.create_indexes()
@@ -0,0 +1,127 @@
+import asyncio
+import time
+from collections import Counter, OrderedDict
+from typing import Any
+
+from app.settings import settings
+from app.utilities.transactions import plan_store, transaction_store
+from app.utilities.trie import PrefixTrie
+
+SUGGESTION_FIELDS = ("place", "category")
+
+
+class Suggestions:
+    """
+    Per-user autocomplete on place and category.
+
+    A user's tries are built from MongoDB on first use, then kept up to date by
+    the write handlers, which count values in when written and out when
+    replaced or deleted. Least recently used users are evicted, and tries are
+    rebuilt after a TTL so writes handled by other workers show up.
+    """
+
+    def __init__(self) -> None:
+        self._tries: OrderedDict[str | None, tuple[float, dict[str, PrefixTrie]]] = (
+            OrderedDict()
+        )
+        self._building: dict[str | None, asyncio.Task[dict[str, PrefixTrie]]] = {}
+
+    async def _build(self, user_id: str | None) -> dict[str, PrefixTrie]:
+        counts: dict[str, Counter[str]] = {
+            field: Counter() for field in SUGGESTION_FIELDS
+        }
+        for name in ("expenses", "bills"):
+            store = transaction_store(name)
+            for field in SUGGESTION_FIELDS:
+                counts[field].update(await store.count_values(user_id, field))
+
+        for name in ("budgets", "wishlists"):
+            counts["category"].update(
+                await plan_store(name).count_values(user_id, "category")
+            )
+
+        tries = {field: PrefixTrie() for field in SUGGESTION_FIELDS}
+        for field, field_counts in counts.items():
+            for word, count in field_counts.items():
+                tries[field].add(word, count)
+
+        self._tries[user_id] = (
+            time.monotonic() + settings.suggestion_ttl_seconds,
+            tries,
+        )
+        while len(self._tries) > settings.suggestion_cache_users:
+            self._tries.popitem(last=False)
+
+        return tries
+
+    async def _get(self, user_id: str | None) -> dict[str, PrefixTrie]:
+        cached = self._tries.get(user_id)
+        if cached is not None and cached[0] > time.monotonic():
+            self._tries.move_to_end(user_id)
+            return cached[1]
+
+        # Concurrent requests for the same user share one build.
+        task = self._building.get(user_id)
+        if task is None:
+            task = asyncio.ensure_future(self._build(user_id))
+            self._building[user_id] = task
+            task.add_done_callback(lambda _: self._building.pop(user_id, None))
+
+        return await asyncio.shield(task)
+
+    async def complete(
+        self, user_id: str | None, field: str, prefix: str, limit: int
+    ) -> list[str]:
+        """
+        Most used values of a field starting with a prefix.
+        """
+        tries = await self._get(user_id)
+        return tries[field].complete(prefix, limit)
+
+    def record(self, user_id: str | None, doc: dict[str, Any]) -> None:
+        """
+        Count the values of a written document, if the user's tries are loaded.
+        """
+        cached = self._tries.get(user_id)
+        if cached is None:
+            return
+
+        for field in SUGGESTION_FIELDS:
+            value = doc.get(field)
+            if value:
+                cached[1][field].add(value)
+
+    def tracks(self, update_data: dict[str, Any] | None = None) -> bool:
+        """
+        Whether some user's tries are loaded and a delete, or an update with
+        some data, changes them, so the previous document is worth reading to
+        find its owner and values.
+        """
+        if not self._tries:
+            return False
+
+        return update_data is None or any(
+            field in update_data for field in SUGGESTION_FIELDS
+        )
+
+    def forget(
+        self,
+        user_id: str | None,
+        doc: dict[str, Any],
+        update_data: dict[str, Any] | None = None,
+    ) -> None:
+        """
+        Count out the values of a deleted document, or those an update
+        replaced, if the user's tries are loaded.
+        """
+        cached = self._tries.get(user_id)
+        if cached is None:
+            return
+
+        for field in SUGGESTION_FIELDS:
+            value = doc.get(field)
+            if value and (update_data is None or field in update_data):
+                cached[1][field].discard(value)
+
+
+suggestions = Suggestions()
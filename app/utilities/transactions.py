@@ -0,0 +1,68 @@
+from app.settings import settings
+from app.utilities.archive import (
+    cold_store,
+)
+from app.utilities.changes import (
+    change_log,
+    sqlite_changes,
+)
+from app.utilities.stores.base import (
+    PlanStore,
+    TransactionStore,
+)
+from app.utilities.stores.bucket import BucketStore
+from app.utilities.stores.document import DocumentStore
+from app.utilities.stores.memory import memory_store
+from app.utilities.stores.sqlite import SQLiteStore
+from app.utilities.stores.tiered import TieredStore
+
+
+def hot_store(name: str) -> TransactionStore:
+    """
+    Get the store for a transaction collection in the configured backend and
+    layout, without its archive.
+    """
+    if settings.storage_backend == "memory":
+        return memory_store(name)
+
+    if settings.storage_backend == "sqlite":
+        return SQLiteStore(
+            name, changes=sqlite_changes if settings.change_log else None
+        )
+
+    if settings.transaction_storage == "bucket":
+        return BucketStore(name, change_log())
+
+    return DocumentStore(
+        name,
+        batched=name == "expenses" and settings.expense_write_batching,
+        changes=change_log(),
+    )
+
+
+def transaction_store(name: str) -> TransactionStore:
+    """
+    Get the store for a transaction collection, with its archive when old
+    transactions are archived.
+    """
+    if settings.archive_after_days is None:
+        return hot_store(name)
+
+    return TieredStore(hot_store(name), cold_store(name))
+
+
+def plan_store(name: str) -> PlanStore:
+    """
+    Get the store for budgets or wishlists in the configured backend.
+    """
+    if settings.storage_backend == "memory":
+        return memory_store(name, text_field="name")
+
+    if settings.storage_backend == "sqlite":
+        return SQLiteStore(
+            name,
+            text_field="name",
+            changes=sqlite_changes if settings.change_log else None,
+        )
+
+    return DocumentStore(name, text_field="name", changes=change_log())
@@ -0,0 +1,81 @@
+import heapq
+from dataclasses import dataclass, field
+
+
+@dataclass
+class _Node:
+    children: dict[str, "_Node"] = field(default_factory=dict)
+    word: str | None = None
+    count: int = 0
+
+
+class PrefixTrie:
+    """
+    Case-insensitive prefix tree of words with how often each was used.
+    """
+
+    def __init__(self) -> None:
+        self.root = _Node()
+
+    def add(self, word: str, count: int = 1) -> None:
+        """
+        Add a word, or count another use of it.
+        """
+        node = self.root
+        for char in word.casefold():
+            node = node.children.setdefault(char, _Node())
+
+        node.word = node.word or word
+        node.count += count
+
+    def discard(self, word: str, count: int = 1) -> None:
+        """
+        Count one use less of a word, removing it when no uses are left.
+        """
+        path = [self.root]
+        for char in word.casefold():
+            child = path[-1].children.get(char)
+            if child is None:
+                return
+            path.append(child)
+
+        path[-1].count = max(path[-1].count - count, 0)
+        if path[-1].count == 0:
+            path[-1].word = None
+
+        # Prune branches that no longer lead to a word.
+        for char, parent, node in zip(
+            reversed(word.casefold()), reversed(path[:-1]), reversed(path[1:])
+        ):
+            if node.word is not None or node.children:
+                break
+            del parent.children[char]
+
+    def _words(self, node: _Node) -> list[_Node]:
+        found = []
+        stack = [node]
+        while stack:
+            current = stack.pop()
+            if current.word is not None:
+                found.append(current)
+            stack.extend(current.children.values())
+
+        return found
+
+    def complete(self, prefix: str, limit: int = 10) -> list[str]:
+        """
+        Most used words starting with a prefix.
+        """
+        node = self.root
+        for char in prefix.casefold():
+            child = node.children.get(char)
+            if child is None:
+                return []
+            node = child
+
+        best = heapq.nsmallest(
+            limit,
+            self._words(node),
+            key=lambda n: (-n.count, n.word),
+        )
+        return [n.word for n in best if n.word is not None]
@@ -0,0 +1,18 @@
+import asyncio
+
+from app.settings import settings
+from app.utilities.clients import db
+
+
+async def warm_up() -> None:
+    """
+    Open MongoDB connections before serving requests, so the first requests of
+    a worker are not slower than the rest.
+    """
+    if settings.storage_backend != "mongo":
+        return
+
+    # Concurrent commands each need a connection of their own.
+    await asyncio.gather(
+        *(db.command("ping") for _ in range(max(1, settings.mongo_min_pool_size)))
+    )
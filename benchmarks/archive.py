@@ -0,0 +1,163 @@
+"""
+Measure hot/cold tiering of expenses on a multi-year history in SQLite, before
+and after archiving everything older than the cutoff.
+
+Data goes to a temporary file:
+
+    python -m benchmarks.archive --years 5 --per-day 20 --keep-days 90
+"""
+
+import argparse
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any, Awaitable, Callable
+
+import anyio
+from bson import ObjectId
+
+from app.models import TransactionFilters
+from app.settings import settings
+from app.utilities.archive import SQLiteArchive, archive_cutoff
+from app.utilities.migrations import move_to_archive
+from app.utilities.sqlite import ConnectionPool
+from app.utilities.stores.base import TransactionStore
+from app.utilities.stores.sqlite import SQLiteStore
+from app.utilities.stores.tiered import TieredStore
+
+CATEGORIES = ["food", "gas", "rent", "fun", "travel", "health", "gifts", "other"]
+USER_ID = "bench-user"
+FIELDS = ["created_at", "total", "amount_minor", "currency", "category"]
+
+
+def history(years: int, per_day: int) -> list[dict[str, Any]]:
+    """
+    Random expenses for one user, oldest first.
+    """
+    start = datetime.now(timezone.utc) - timedelta(days=365 * years)
+    step = timedelta(days=1) / per_day
+    return [
+        {
+            "_id": ObjectId(),
+            "user_id": USER_ID,
+            "ledger_id": USER_ID,
+            "total": round(random.uniform(1, 200), 2),
+            "currency": "USD",
+            "category": random.choice(CATEGORIES),
+            "place": f"place-{random.randint(1, 500)}",
+            "created_at": start + step * n,
+        }
+        for n in range(365 * years * per_day)
+    ]
+
+
+async def timed(fn: Callable[[], Awaitable[Any]], runs: int) -> float:
+    """
+    Median run time in milliseconds.
+    """
+    durations = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        await fn()
+        durations.append((time.perf_counter() - start) * 1000)
+
+    return statistics.median(durations)
+
+
+def table_bytes(path: str, prefix: str) -> int:
+    """
+    Size of the tables and indexes whose names start with a prefix.
+    """
+    connection = sqlite3.connect(path)
+    try:
+        (size,) = connection.execute(
+            "SELECT coalesce(sum(pgsize), 0) FROM dbstat WHERE name LIKE ?",
+            (f"{prefix}%",),
+        ).fetchone()
+    finally:
+        connection.close()
+
+    return int(size)
+
+
+async def measure(store: TransactionStore, runs: int) -> dict[str, float]:
+    """
+    Latency of a recent list, a full list and the reads of the forecast.
+    """
+    recent = TransactionFilters(start=datetime.now(timezone.utc) - timedelta(days=30))
+
+    async def list_recent() -> None:
+        async for _ in store.find([USER_ID], recent):
+            pass
+
+    async def list_all() -> None:
+        async for _ in store.find([USER_ID], TransactionFilters()):
+            pass
+
+    async def report() -> None:
+        async for _ in store.project(USER_ID, FIELDS):
+            pass
+
+    return {
+        "recent_ms": await timed(list_recent, runs),
+        "list_ms": await timed(list_all, runs),
+        "report_ms": await timed(report, runs),
+    }
+
+
+async def main(years: int, per_day: int, keep_days: int, runs: int) -> None:
+    """
+    Run the comparison
+    """
+    settings.archive_after_days = keep_days
+    docs = history(years, per_day)
+    print(f"{len(docs)} expenses over {years} years")
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = str(Path(directory) / "bench.db")
+        pool = ConnectionPool(path, 4)
+        hot = SQLiteStore("expenses")
+        hot.pool = pool
+        cold = SQLiteArchive("expenses")
+        cold.pool = pool
+        store = TieredStore(hot, cold)
+        await store.create_indexes()
+        await hot.insert_many(docs)
+
+        print(
+            f"{'':<10}{'hot MB':>8}{'cold MB':>9}{'recent ms':>11}"
+            f"{'list ms':>9}{'report ms':>11}"
+        )
+
+        def row(label: str, result: dict[str, float]) -> None:
+            cold_mb = table_bytes(path, "expenses_archive") / 1e6
+            hot_mb = table_bytes(path, "expenses") / 1e6 - cold_mb
+            print(
+                f"{label:<10}{hot_mb:>8.1f}{cold_mb:>9.1f}"
+                f"{result['recent_ms']:>11.1f}{result['list_ms']:>9.1f}"
+                f"{result['report_ms']:>11.1f}"
+            )
+
+        row("before", await measure(store, runs))
+
+        start = time.perf_counter()
+        moved = await move_to_archive(hot, cold, archive_cutoff())
+        print(f"archived {moved} in {time.perf_counter() - start:.1f} s")
+
+        row("after", await measure(store, runs))
+        pool.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--years", type=int, default=5)
+    parser.add_argument("--per-day", type=int, default=20)
+    parser.add_argument("--keep-days", type=int, default=90)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    anyio.run(main, args.years, args.per_day, args.keep_days, args.runs)
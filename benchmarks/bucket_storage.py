@@ -0,0 +1,160 @@
+"""
+Compare the document and bucket layouts for expenses on a multi-year history.
+
+Needs the MongoDB from the app settings, data goes to a Budget-app-bench database:
+
+    python -m benchmarks.bucket_storage --years 5 --per-day 10
+"""
+
+import argparse
+import random
+import statistics
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable
+
+import anyio
+from bson import ObjectId
+
+from app.models import TransactionFilters
+from app.utilities.clients import db
+from app.utilities.stores.base import TransactionStore
+from app.utilities.stores.bucket import BucketStore
+from app.utilities.stores.document import DocumentStore
+
+CATEGORIES = ["food", "gas", "rent", "fun", "travel", "health", "gifts", "other"]
+USER_ID = "bench-user"
+
+bench_db = db.client["Budget-app-bench"]
+
+
+def history(years: int, per_day: int) -> list[dict[str, Any]]:
+    """
+    Random expenses for one user, oldest first.
+    """
+    start = datetime.now(timezone.utc) - timedelta(days=365 * years)
+    return [
+        {
+            "_id": ObjectId(),
+            "user_id": USER_ID,
+            "ledger_id": USER_ID,
+            "total": round(random.uniform(1, 200), 2),
+            "category": random.choice(CATEGORIES),
+            "place": f"place-{random.randint(1, 500)}",
+            "created_at": start + timedelta(days=day, minutes=n),
+        }
+        for day in range(365 * years)
+        for n in range(per_day)
+    ]
+
+
+async def seed(
+    documents: DocumentStore, buckets: BucketStore, docs: list[dict[str, Any]]
+) -> None:
+    """
+    Load the same history in both layouts.
+    """
+    await documents.collection.drop()
+    await buckets.collection.drop()
+    await documents.create_indexes()
+    await buckets.create_indexes()
+
+    await documents.collection.insert_many(docs)
+
+    grouped: dict[tuple[Any, ...], list[dict[str, Any]]] = defaultdict(list)
+    for doc in docs:
+        grouped[tuple(buckets.bucket_key(doc).values())].append(buckets.to_entry(doc))
+
+    await buckets.collection.insert_many(
+        [
+            {
+                "user_id": user_id,
+                "month": month,
+                "category": category,
+                "count": len(entries),
+                "total": sum(entry["total"] for entry in entries),
+                "entries": entries,
+            }
+            for (user_id, month, category), entries in grouped.items()
+        ]
+    )
+
+
+async def timed(fn: Callable[[], Awaitable[Any]], runs: int) -> float:
+    """
+    Median run time in milliseconds.
+    """
+    durations = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        await fn()
+        durations.append((time.perf_counter() - start) * 1000)
+
+    return statistics.median(durations)
+
+
+async def measure(store: TransactionStore, name: str, runs: int) -> dict[str, Any]:
+    """
+    Document reads, index size, list and report latency of one layout.
+    """
+
+    async def list_all() -> None:
+        async for _ in store.find([USER_ID], TransactionFilters()):
+            pass
+
+    async def report() -> None:
+        await store.monthly_totals(USER_ID)
+
+    explain = await bench_db.command(
+        "explain",
+        {"find": name, "filter": {"user_id": USER_ID}},
+        verbosity="executionStats",
+    )
+    stats = await bench_db.command("collStats", name)
+
+    return {
+        "docs_read": explain["executionStats"]["totalDocsExamined"],
+        "index_kb": stats["totalIndexSize"] // 1024,
+        "list_ms": await timed(list_all, runs),
+        "report_ms": await timed(report, runs),
+    }
+
+
+async def main(years: int, per_day: int, runs: int) -> None:
+    """
+    Run the comparison
+    """
+    documents = DocumentStore("expenses")
+    documents.collection = bench_db["expenses"]
+    buckets = BucketStore("expenses")
+    buckets.collection = bench_db["expenses_buckets"]
+
+    docs = history(years, per_day)
+    print(f"Seeding {len(docs)} expenses over {years} years")
+    await seed(documents, buckets, docs)
+
+    print(
+        f"{'layout':<10}{'docs read':>12}{'index KB':>12}"
+        f"{'list ms':>12}{'report ms':>12}"
+    )
+    layouts: list[tuple[str, TransactionStore, str]] = [
+        ("document", documents, "expenses"),
+        ("bucket", buckets, "expenses_buckets"),
+    ]
+    for label, store, name in layouts:
+        result = await measure(store, name, runs)
+        print(
+            f"{label:<10}{result['docs_read']:>12}{result['index_kb']:>12}"
+            f"{result['list_ms']:>12.1f}{result['report_ms']:>12.1f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--years", type=int, default=5)
+    parser.add_argument("--per-day", type=int, default=10)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    anyio.run(main, args.years, args.per_day, args.runs)
@@ -0,0 +1,96 @@
+"""
+Time the vectorized forecast against a per-row Python loop on large histories.
+
+Runs without a database:
+
+    python -m benchmarks.forecast --rows 1000000
+"""
+
+import argparse
+import calendar
+import random
+import time
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+
+from app.utilities.forecast import Columns, project_month
+
+CATEGORIES = ["food", "gas", "rent", "fun", "travel", "health", "gifts", "other"]
+
+
+def loop_projection(
+    created_at: list[datetime], totals: list[float], categories: list[str], today: date
+) -> dict[str, float]:
+    """
+    The same projection, one row at a time.
+    """
+    month_start = datetime(today.year, today.month, 1)
+    window_start = datetime.combine(today - timedelta(days=29), datetime.min.time())
+    days_in_month = calendar.monthrange(today.year, today.month)[1]
+
+    spent: dict[str, float] = defaultdict(float)
+    recent: dict[str, float] = defaultdict(float)
+    monthly: dict[tuple[str, int, int], float] = defaultdict(float)
+    for when, total, category in zip(created_at, totals, categories):
+        if when >= month_start:
+            spent[category] += total
+        else:
+            monthly[(category, when.year, when.month)] += total
+        if when >= window_start:
+            recent[category] += total
+
+    projected = {}
+    for category in set(categories):
+        months = [v for (c, _, _), v in monthly.items() if c == category]
+        same = [
+            v for (c, _, m), v in monthly.items() if c == category and m == today.month
+        ]
+        average = sum(months) / len(months) if months else 0
+        seasonality = (sum(same) / len(same)) / average if same and average else 1.0
+        projected[category] = (
+            spent[category]
+            + recent[category] / 30 * (days_in_month - today.day) * seasonality
+        )
+
+    return projected
+
+
+def main(rows: int, years: int) -> None:
+    """
+    Run the comparison
+    """
+    today = date.today()
+    start = datetime.combine(today, datetime.min.time()) - timedelta(days=365 * years)
+    seconds = 365 * years * 86400
+    created_at = [
+        start + timedelta(seconds=random.randrange(seconds)) for _ in range(rows)
+    ]
+    totals = [round(random.uniform(1, 200), 2) for _ in range(rows)]
+    categories = [random.choice(CATEGORIES) for _ in range(rows)]
+    budgets = {category: 1000.0 for category in CATEGORIES}
+
+    started = time.perf_counter()
+    columns = Columns.from_rows(created_at, totals, categories)
+    to_columns = time.perf_counter() - started
+
+    started = time.perf_counter()
+    project_month(columns, budgets, today)
+    vectorized = time.perf_counter() - started
+
+    started = time.perf_counter()
+    loop_projection(created_at, totals, categories, today)
+    loop = time.perf_counter() - started
+
+    print(f"{rows} rows over {years} years")
+    print(f"{'to columns':<14}{to_columns * 1000:>10.1f} ms")
+    print(f"{'vectorized':<14}{vectorized * 1000:>10.1f} ms")
+    print(f"{'python loop':<14}{loop * 1000:>10.1f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--years", type=int, default=5)
+    args = parser.parse_args()
+
+    main(args.rows, args.years)
@@ -0,0 +1,79 @@
+"""
+Payload size, server encode and client decode CPU of JSON, MessagePack and CBOR
+for a large GET /v1/expenses response.
+
+Runs without a database:
+
+    python -m benchmarks.formats --rows 10000
+"""
+
+import argparse
+import json
+from typing import Any, Callable
+
+import cbor2
+import msgpack
+import orjson
+from pydantic import TypeAdapter
+
+from app.routers.expenses.models import Expense
+from app.utilities.responses import CBORResponse, MessagePackResponse, ORJSONResponse
+from benchmarks.responses import compress, expenses, timed
+
+
+def main(rows: int, repeat: int) -> None:
+    """
+    Run the comparison
+    """
+    models = expenses(rows)
+    adapter = TypeAdapter(list[Expense])
+
+    formats: list[tuple[str, Callable[[], bytes], Callable[[bytes], Any]]] = [
+        (
+            "json/json",
+            lambda: bytes(
+                ORJSONResponse(adapter.dump_python(models, mode="json")).body
+            ),
+            json.loads,
+        ),
+        (
+            "json/orjson",
+            lambda: bytes(
+                ORJSONResponse(adapter.dump_python(models, mode="json")).body
+            ),
+            orjson.loads,
+        ),
+        (
+            "msgpack",
+            lambda: bytes(MessagePackResponse(adapter.dump_python(models)).body),
+            lambda body: msgpack.unpackb(body, timestamp=3),
+        ),
+        (
+            "cbor",
+            lambda: bytes(CBORResponse(adapter.dump_python(models)).body),
+            cbor2.loads,
+        ),
+    ]
+
+    print(f"{rows} expenses, client decoder after the slash")
+    print(
+        f"{'format':<14}{'bytes':>10}{'zstd bytes':>12}"
+        f"{'encode ms':>11}{'decode ms':>11}"
+    )
+    for label, encode, decode in formats:
+        body, encode_ms = timed(encode, repeat)
+        _, decode_ms = timed(lambda: decode(body), repeat)
+        compressed = len(compress("zstd", body))
+        print(
+            f"{label:<14}{len(body):>10}{compressed:>12}"
+            f"{encode_ms:>11.1f}{decode_ms:>11.1f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    main(args.rows, args.repeat)
@@ -0,0 +1,424 @@
+"""
+Replay traffic captured with CAPTURE_PATH against a local instance, at the
+captured pace or faster, and compare latencies per route with the captured
+ones.
+
+Captures hold shapes, not requests: each is rebuilt with ids of documents
+seeded for its user bucket, values for its query parameters and a body of
+about its size. Routes the capture did not match, and logins, are skipped.
+
+By default the app runs in-process on the configured storage backend, with one
+user per bucket and authentication replaced:
+
+    STORAGE_BACKEND=sqlite SQLITE_PATH=/tmp/replay.db \\
+        python -m benchmarks.replay traffic.jsonl --speed 4
+
+With --base-url requests go to a running server instead, all as the user of
+--token:
+
+    python -m benchmarks.replay traffic.jsonl --base-url http://127.0.0.1:8000 \\
+        --token "$TOKEN"
+"""
+
+import argparse
+import asyncio
+import logging
+import random
+import re
+import statistics
+import time
+from collections import defaultdict
+from contextlib import AsyncExitStack
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable
+
+import anyio
+import httpx
+import orjson
+from bson import ObjectId
+
+CATEGORIES = ["food", "gas", "rent", "fun", "travel", "health", "gifts", "other"]
+SKIPPED_ROUTES = {"/v1/auth/login"}
+SEED_CONCURRENCY = 16
+
+# Collections of documents created by a POST to a route, whose ids fill the
+# path parameters of later requests.
+CREATES = {
+    "/v1/expenses": "expenses",
+    "/v1/bills": "bills",
+    "/v1/budgets": "budgets",
+    "/v1/wishlists": "wishlists",
+    "/v1/ledgers": "ledgers",
+    "/v1/reports/year": "jobs",
+}
+PARAMETERS = {
+    "expense_id": "expenses",
+    "bill_id": "bills",
+    "budget_id": "budgets",
+    "wishlist_id": "wishlists",
+    "ledger_id": "ledgers",
+    "job_id": "jobs",
+}
+QUERY: dict[str, Callable[[], Any]] = {
+    "category": lambda: random.choice(CATEGORIES),
+    "start": lambda: (datetime.now(timezone.utc) - timedelta(days=30)).isoformat(),
+    "end": lambda: datetime.now(timezone.utc).isoformat(),
+    "min_total": lambda: 10,
+    "max_total": lambda: 150,
+    "days": lambda: 30,
+    "q": lambda: f"place-{random.randint(1, 500)}",
+    "prefix": lambda: "place-",
+    "page": lambda: 1,
+    "page_size": lambda: 20,
+    "limit": lambda: 20,
+    "year": lambda: datetime.now(timezone.utc).year,
+    "at": lambda: (datetime.now(timezone.utc) - timedelta(minutes=5)).isoformat(),
+}
+
+
+@dataclass(eq=False)
+class User:
+    token: str
+    ids: dict[str, list[str]] = field(default_factory=lambda: defaultdict(list))
+
+
+@dataclass
+class Replayed:
+    route: str
+    method: str
+    status: int
+    ms: float
+    captured_ms: float
+
+
+def authenticate_by_token(app: Any) -> None:
+    """
+    Take bearer tokens of the in-process app as user ids.
+    """
+    from fastapi import Request
+
+    from app.auth import validate_access
+    from app.utilities.capture import REQUEST_USER
+
+    def user_of(request: Request) -> str:
+        user_id = request.headers["authorization"].removeprefix("Bearer ")
+        request.scope[REQUEST_USER] = user_id
+        return user_id
+
+    app.dependency_overrides[validate_access] = user_of
+
+
+def load(path: str, limit: int | None) -> list[dict[str, Any]]:
+    """
+    Captured requests oldest first, the first `limit` of them if given.
+    """
+    with open(path, "rb") as file:
+        records = [orjson.loads(line) for line in file if line.strip()]
+
+    records.sort(key=lambda record: record["at"])
+    return records[:limit]
+
+
+def csv_statement(rows: int) -> bytes:
+    """
+    A bank statement of random debits over the last year.
+    """
+    now = datetime.now(timezone.utc)
+    lines = ["date,amount,description"] + [
+        f"{(now - timedelta(days=random.uniform(0, 365))).date()},"
+        f"-{random.uniform(1, 200):.2f},place-{random.randint(1, 500)}"
+        for _ in range(rows)
+    ]
+    return "\n".join(lines).encode()
+
+
+def padded(data: dict[str, Any], key: str, size: int) -> dict[str, Any]:
+    """
+    A body grown to about the captured size by lengthening one text field.
+    """
+    missing = size - len(orjson.dumps(data))
+    if missing > 0:
+        data[key] += "x" * missing
+    return data
+
+
+def body(method: str, route: str, size: int) -> dict[str, Any]:
+    """
+    Keyword arguments for the body of a request to a route.
+    """
+    total = round(random.uniform(1, 200), 2)
+    category = random.choice(CATEGORIES)
+    place = f"place-{random.randint(1, 500)}"
+    name = f"name-{random.randint(1, 500)}"
+
+    if route == "/v1/expenses/import":
+        rows = max(1, size // 32)
+        return {
+            "content": csv_statement(rows),
+            "headers": {"content-type": "text/csv"},
+        }
+    if route == "/v1/batch":
+        queries = [
+            {"id": str(n), "path": random.choice(["/v1/expenses", "/v1/budgets"])}
+            for n in range(max(1, min(20, size // 40)))
+        ]
+        return {"json": {"queries": queries}}
+    if route == "/v1/profile":
+        return {"json": {"base_currency": random.choice(["USD", "EUR", "GBP"])}}
+    if route.endswith("/contributions"):
+        return {"json": {"amount": round(random.uniform(1, 50), 2)}}
+    if route.endswith("/members/{member_id}"):
+        return {"json": {"role": "viewer"}} if method == "PUT" else {}
+    if route == "/v1/ledgers":
+        return {"json": padded({"name": name}, "name", size)}
+
+    if route.startswith(("/v1/expenses", "/v1/bills")):
+        data = {"total": total, "category": category, "place": place}
+        key = "place"
+    elif route.startswith(("/v1/budgets", "/v1/wishlists")):
+        data = {"total": total, "category": category, "name": name}
+        key = "name"
+    else:
+        return {}
+
+    if method == "PATCH":
+        data = {"total": total, key: data[key]}
+    return {"json": padded(data, key, size)}
+
+
+def request_of(
+    record: dict[str, Any], user: User, users: list[User]
+) -> dict[str, Any] | None:
+    """
+    Arguments of a request like a captured one for a user, None when it cannot
+    be rebuilt.
+    """
+    route, method = record["route"], record["method"]
+    if route is None or route in SKIPPED_ROUTES:
+        return None
+
+    def fill(match: re.Match[str]) -> str:
+        name = match.group(1)
+        if name == "member_id":
+            return random.choice(users).token
+        ids = user.ids[PARAMETERS.get(name, "")]
+        if not ids:
+            return str(ObjectId())
+        if method == "DELETE" and route.endswith(match.group(0)):
+            return ids.pop(random.randrange(len(ids)))
+        return random.choice(ids)
+
+    params = {name: QUERY[name]() for name in record["query"] if name in QUERY}
+    arguments: dict[str, Any] = {
+        "method": method,
+        "url": re.sub(r"\{(\w+)\}", fill, route),
+        "params": params,
+        "headers": {"Authorization": f"Bearer {user.token}"},
+    }
+    if method in ("POST", "PUT", "PATCH"):
+        extra = body(method, route, record["request_bytes"])
+        arguments["headers"] |= extra.pop("headers", {})
+        arguments |= extra
+    return arguments
+
+
+async def seed(client: httpx.AsyncClient, user: User, expenses: int) -> None:
+    """
+    Documents of a user for replayed requests to read, change and delete.
+    """
+    headers = {"Authorization": f"Bearer {user.token}"}
+    response = await client.post(
+        "/v1/expenses/import",
+        content=csv_statement(expenses),
+        headers=headers | {"content-type": "text/csv"},
+    )
+    response.raise_for_status()
+    response = await client.get("/v1/expenses", headers=headers)
+    response.raise_for_status()
+    user.ids["expenses"] = [expense["id"] for expense in response.json()]
+
+    for route, collection in CREATES.items():
+        if collection in ("expenses", "jobs"):
+            continue
+        for _ in range(max(1, expenses // 20)):
+            arguments = body("POST", route, 0)
+            response = await client.post(route, headers=headers, **arguments)
+            response.raise_for_status()
+            user.ids[collection].append(response.json()["id"])
+
+
+async def issue(
+    client: httpx.AsyncClient,
+    record: dict[str, Any],
+    arguments: dict[str, Any],
+    user: User,
+) -> Replayed:
+    start = time.perf_counter()
+    response = await client.request(**arguments)
+    ms = (time.perf_counter() - start) * 1000
+
+    collection = CREATES.get(record["route"])
+    if record["method"] == "POST" and collection and response.is_success:
+        user.ids[collection].append(response.json()["id"])
+
+    return Replayed(
+        record["route"], record["method"], response.status_code, ms, record["ms"]
+    )
+
+
+async def replay(
+    client: httpx.AsyncClient,
+    records: list[dict[str, Any]],
+    users: dict[int | None, User],
+    speed: float,
+) -> tuple[list[Replayed], list[float]]:
+    """
+    Send requests like the captured ones at their captured offsets divided by
+    the speed, without waiting for responses, and return how late each went.
+    """
+    everyone = list(users.values())
+    tasks = []
+    lags = []
+    first = records[0]["at"]
+    start = time.perf_counter()
+    for record in records:
+        user = users[record["user"]]
+        arguments = request_of(record, user, everyone)
+        if arguments is None:
+            continue
+
+        due = start + (record["at"] - first) / speed
+        delay = due - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        lags.append(max(0.0, -delay) * 1000)
+        tasks.append(asyncio.create_task(issue(client, record, arguments, user)))
+
+    return list(await asyncio.gather(*tasks)), lags
+
+
+def percentiles(values: list[float]) -> tuple[float, float, float]:
+    if len(values) == 1:
+        return values[0], values[0], values[0]
+
+    cuts = statistics.quantiles(values, n=100, method="inclusive")
+    return cuts[49], cuts[89], cuts[98]
+
+
+def report(results: list[Replayed], skipped: int, lags: list[float]) -> None:
+    """
+    Latency percentiles per route, replayed against captured.
+    """
+    if not results:
+        print(f"skipped all {skipped} requests")
+        return
+
+    by_route: dict[tuple[str, str], list[Replayed]] = defaultdict(list)
+    for result in results:
+        by_route[(result.method, result.route)].append(result)
+
+    print(
+        f"{'route':<44}{'count':>7}{'5xx':>8}{'p50 ms':>9}{'p90 ms':>9}"
+        f"{'p99 ms':>9}{'max ms':>9}{'was p50':>9}{'was p99':>9}"
+    )
+    rows = sorted(by_route.items(), key=lambda item: -len(item[1]))
+    rows.append((("", "all"), results))
+    for (method, route), replayed in rows:
+        ms = [result.ms for result in replayed]
+        captured = [result.captured_ms for result in replayed]
+        errors = sum(result.status >= 500 for result in replayed)
+        p50, p90, p99 = percentiles(ms)
+        was_p50, _, was_p99 = percentiles(captured)
+        print(
+            f"{f'{method} {route}'.strip():<44}{len(replayed):>7}{errors:>8}"
+            f"{p50:>9.1f}{p90:>9.1f}{p99:>9.1f}{max(ms):>9.1f}"
+            f"{was_p50:>9.1f}{was_p99:>9.1f}"
+        )
+
+    print(
+        f"skipped {skipped}, sent late by p99 {percentiles(lags)[2]:.1f} ms, "
+        f"max {max(lags):.1f} ms"
+    )
+
+
+async def main(
+    path: str,
+    speed: float,
+    limit: int | None,
+    expenses: int,
+    base_url: str | None,
+    token: str | None,
+) -> None:
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    records = load(path, limit)
+    if not records:
+        raise SystemExit(f"No requests captured in {path}")
+
+    async with AsyncExitStack() as stack:
+        if base_url is None:
+            # Imported here so --base-url runs need no app settings.
+            from app.main import app
+            from app.utilities.log import logger
+
+            # Access logs of every replayed request would be timed as well.
+            logger.setLevel(logging.WARNING)
+            authenticate_by_token(app)
+            await stack.enter_async_context(app.router.lifespan_context(app))
+            transport = httpx.ASGITransport(app=app)
+            client = httpx.AsyncClient(
+                transport=transport, base_url="http://replay", timeout=60
+            )
+            users = {
+                bucket: User(f"replay-user-{bucket}")
+                for bucket in {record["user"] for record in records}
+            }
+        else:
+            if token is None:
+                raise SystemExit("--token is needed with --base-url")
+            client = httpx.AsyncClient(base_url=base_url, timeout=60)
+            shared = User(token)
+            users = defaultdict(lambda: shared)
+            users[None] = shared
+
+        await stack.enter_async_context(client)
+
+        start = time.perf_counter()
+        limiter = anyio.Semaphore(SEED_CONCURRENCY)
+
+        async def seed_user(user: User) -> None:
+            async with limiter:
+                await seed(client, user, expenses)
+
+        seeded = set(users.values())
+        async with anyio.create_task_group() as group:
+            for user in seeded:
+                group.start_soon(seed_user, user)
+        print(f"seeded {len(seeded)} users in {time.perf_counter() - start:.1f} s")
+
+        span = records[-1]["at"] - records[0]["at"]
+        print(f"replaying {len(records)} requests over {span / speed:.1f} s")
+        results, lags = await replay(client, records, users, speed)
+
+    report(results, len(records) - len(results), lags)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("capture")
+    parser.add_argument("--speed", type=float, default=1.0)
+    parser.add_argument("--limit", type=int, default=None)
+    parser.add_argument("--seed-expenses", type=int, default=200)
+    parser.add_argument("--base-url", default=None)
+    parser.add_argument("--token", default=None)
+    args = parser.parse_args()
+
+    anyio.run(
+        main,
+        args.capture,
+        args.speed,
+        args.limit,
+        args.seed_expenses,
+        args.base_url,
+        args.token,
+    )
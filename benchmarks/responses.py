@@ -0,0 +1,93 @@
+"""
+Bytes on the wire and CPU per encoding for a large GET /v1/expenses response.
+
+Runs without a database:
+
+    python -m benchmarks.responses --rows 10000
+"""
+
+import argparse
+import random
+import statistics
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable
+
+from bson import ObjectId
+from fastapi.responses import JSONResponse
+from pydantic import TypeAdapter
+
+from app.routers.expenses.models import Expense
+from app.utilities.compression import COMPRESSORS
+from app.utilities.responses import ORJSONResponse
+
+CATEGORIES = ["food", "gas", "rent", "fun", "travel", "health", "gifts", "other"]
+
+
+def expenses(rows: int) -> list[Expense]:
+    now = datetime.now(timezone.utc)
+    return [
+        Expense(
+            id=str(ObjectId()),
+            user_id="bench-user",
+            ledger_id="bench-user",
+            total=round(random.uniform(1, 200), 2),
+            currency="USD",
+            amount_minor=random.randrange(100, 20000),
+            category=random.choice(CATEGORIES),
+            place=f"Shop {random.randrange(500)}",
+            created_at=now - timedelta(minutes=random.randrange(525600)),
+        )
+        for _ in range(rows)
+    ]
+
+
+def timed(fn: Callable[[], Any], repeat: int) -> tuple[Any, float]:
+    """
+    Result of a call and its median time in milliseconds.
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        times.append((time.perf_counter() - start) * 1000)
+
+    return result, statistics.median(times)
+
+
+def compress(encoding: str, body: bytes) -> bytes:
+    compressor = COMPRESSORS[encoding]()
+    return compressor.compress(body) + compressor.finish()
+
+
+def main(rows: int, repeat: int) -> None:
+    """
+    Run the comparison
+    """
+    models = expenses(rows)
+    adapter = TypeAdapter(list[Expense])
+    # What FastAPI hands the response class for a response model.
+    content, to_python = timed(lambda: adapter.dump_python(models, mode="json"), repeat)
+    body, stdlib = timed(lambda: JSONResponse(content).body, repeat)
+    _, orjson = timed(lambda: ORJSONResponse(content).body, repeat)
+
+    print(f"{rows} expenses")
+    print(f"{'to python':<14}{to_python:>10.1f} ms")
+    print(f"{'json':<14}{stdlib:>10.1f} ms")
+    print(f"{'orjson':<14}{orjson:>10.1f} ms")
+    print()
+    print(f"{'encoding':<14}{'bytes':>10}{'ratio':>8}{'ms':>8}")
+    print(f"{'identity':<14}{len(body):>10}{1:>8.2f}{0:>8.1f}")
+    for encoding in COMPRESSORS:
+        compressed, elapsed = timed(lambda: compress(encoding, body), repeat)
+        ratio = len(body) / len(compressed)
+        print(f"{encoding:<14}{len(compressed):>10}{ratio:>8.2f}{elapsed:>8.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    main(args.rows, args.repeat)
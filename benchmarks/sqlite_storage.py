@@ -0,0 +1,169 @@
+"""
+Compare the SQLite and MongoDB stores for expenses at 100k rows per user.
+
+SQLite data goes to a temporary file. MongoDB is the one from the app settings,
+data goes to a Budget-app-bench database, and is skipped when unreachable:
+
+    python -m benchmarks.sqlite_storage --rows 100000 --users 2
+"""
+
+import argparse
+import asyncio
+import random
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any, Awaitable, Callable
+
+import anyio
+from bson import ObjectId
+
+from app.models import TransactionFilters
+from app.utilities.clients import db
+from app.utilities.sqlite import ConnectionPool
+from app.utilities.stores.base import TransactionStore
+from app.utilities.stores.document import DocumentStore
+from app.utilities.stores.sqlite import SQLiteStore
+
+CATEGORIES = ["food", "gas", "rent", "fun", "travel", "health", "gifts", "other"]
+
+bench_db = db.client["Budget-app-bench"]
+
+
+def history(user_id: str, rows: int) -> list[dict[str, Any]]:
+    """
+    Random expenses for one user over about three years.
+    """
+    start = datetime.now(timezone.utc) - timedelta(days=3 * 365)
+    step = timedelta(days=3 * 365) / rows
+    return [
+        {
+            "_id": ObjectId(),
+            "user_id": user_id,
+            "ledger_id": user_id,
+            "total": round(random.uniform(1, 200), 2),
+            "category": random.choice(CATEGORIES),
+            "place": f"place-{random.randint(1, 500)}",
+            "created_at": start + step * n,
+        }
+        for n in range(rows)
+    ]
+
+
+async def timed(fn: Callable[[], Awaitable[Any]], runs: int) -> float:
+    """
+    Median run time in milliseconds.
+    """
+    durations = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        await fn()
+        durations.append((time.perf_counter() - start) * 1000)
+
+    return statistics.median(durations)
+
+
+async def measure(
+    store: TransactionStore, user_id: str, entry_id: ObjectId, runs: int
+) -> dict[str, float]:
+    """
+    Latency of the reads the routes and reports make, and of a single insert.
+    """
+    recent = TransactionFilters(
+        category="food", start=datetime.now(timezone.utc) - timedelta(days=90)
+    )
+
+    async def list_all() -> None:
+        async for _ in store.find([user_id], TransactionFilters()):
+            pass
+
+    async def list_recent() -> None:
+        async for _ in store.find([user_id], recent):
+            pass
+
+    async def insert() -> None:
+        await store.insert_one(
+            {
+                "user_id": user_id,
+                "ledger_id": user_id,
+                "total": 1.0,
+                "category": "food",
+                "place": "bench",
+                "created_at": datetime.now(timezone.utc),
+            }
+        )
+
+    return {
+        "list_ms": await timed(list_all, runs),
+        "recent_ms": await timed(list_recent, runs),
+        "get_ms": await timed(lambda: store.find_one([user_id], entry_id), runs),
+        "report_ms": await timed(lambda: store.monthly_totals(user_id), runs),
+        "search_ms": await timed(lambda: store.search(user_id, "place-4", 20), runs),
+        "insert_ms": await timed(insert, runs * 10),
+    }
+
+
+async def mongo_reachable() -> bool:
+    try:
+        await asyncio.wait_for(bench_db.command("ping"), 5)
+    except Exception:
+        return False
+
+    return True
+
+
+async def main(rows: int, users: int, runs: int) -> None:
+    """
+    Run the comparison
+    """
+    histories = {
+        f"bench-user-{n}": history(f"bench-user-{n}", rows) for n in range(users)
+    }
+    print(f"{users} users with {rows} expenses each")
+
+    with tempfile.TemporaryDirectory() as directory:
+        sqlite_store = SQLiteStore("expenses")
+        sqlite_store.pool = ConnectionPool(str(Path(directory) / "bench.db"), 4)
+        stores: list[tuple[str, TransactionStore]] = [("sqlite", sqlite_store)]
+
+        if await mongo_reachable():
+            mongo_store = DocumentStore("expenses")
+            mongo_store.collection = bench_db["expenses"]
+            await mongo_store.collection.drop()
+            stores.append(("mongo", mongo_store))
+        else:
+            print("MongoDB is not reachable, only measuring SQLite")
+
+        print(
+            f"{'store':<8}{'seed s':>9}{'list ms':>10}{'recent ms':>11}"
+            f"{'get ms':>9}{'report ms':>11}{'search ms':>11}{'insert ms':>11}"
+        )
+        for label, store in stores:
+            await store.create_indexes()
+            start = time.perf_counter()
+            for docs in histories.values():
+                await store.insert_many([dict(doc) for doc in docs])
+            seed_seconds = time.perf_counter() - start
+
+            user_id, docs = next(iter(histories.items()))
+            result = await measure(store, user_id, docs[rows // 2]["_id"], runs)
+            print(
+                f"{label:<8}{seed_seconds:>9.1f}{result['list_ms']:>10.1f}"
+                f"{result['recent_ms']:>11.1f}{result['get_ms']:>9.2f}"
+                f"{result['report_ms']:>11.1f}{result['search_ms']:>11.1f}"
+                f"{result['insert_ms']:>11.2f}"
+            )
+
+        sqlite_store.pool.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--users", type=int, default=2)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    anyio.run(main, args.rows, args.users, args.runs)
@@ -0,0 +1,90 @@
+"""
+Compare per-call insert_one with coalesced insert_many for expense inserts.
+
+Needs the MongoDB from the app settings, data goes to a Budget-app-bench database:
+
+    python -m benchmarks.write_batching --inserts 20000 --concurrency 500
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable
+
+import anyio
+
+from app.utilities.batching import InsertBatcher
+from app.utilities.clients import db
+
+bench_db = db.client["Budget-app-bench"]
+
+
+def expense(n: int) -> dict[str, Any]:
+    return {
+        "user_id": f"bench-user-{n % 50}",
+        "total": 12.5,
+        "category": "food",
+        "place": "bank sync",
+        "created_at": datetime.now(timezone.utc),
+    }
+
+
+async def run(
+    insert: Callable[[dict[str, Any]], Awaitable[Any]], inserts: int, concurrency: int
+) -> tuple[float, list[float]]:
+    """
+    Throughput in inserts per second, and each insert's latency in milliseconds.
+    """
+    latencies: list[float] = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(n: int) -> None:
+        async with semaphore:
+            start = time.perf_counter()
+            await insert(expense(n))
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(n) for n in range(inserts)))
+    elapsed = time.perf_counter() - start
+
+    return inserts / elapsed, latencies
+
+
+async def main(
+    inserts: int, concurrency: int, max_docs: int, max_delay_ms: int
+) -> None:
+    """
+    Run the comparison
+    """
+    collection = bench_db["expenses"]
+
+    await collection.drop()
+    per_call = await run(collection.insert_one, inserts, concurrency)
+
+    await collection.drop()
+    batcher = InsertBatcher(collection, max_docs=max_docs, max_delay_ms=max_delay_ms)
+    batched = await run(batcher.insert, inserts, concurrency)
+    await batcher.close()
+
+    print(f"{'mode':<10}{'inserts/s':>12}{'p50 ms':>10}{'p99 ms':>10}")
+    for label, (throughput, latencies) in [
+        ("per-call", per_call),
+        ("batched", batched),
+    ]:
+        p50 = statistics.median(latencies)
+        p99 = statistics.quantiles(latencies, n=100)[98]
+        print(f"{label:<10}{throughput:>12.0f}{p50:>10.2f}{p99:>10.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--inserts", type=int, default=20000)
+    parser.add_argument("--concurrency", type=int, default=500)
+    parser.add_argument("--max-docs", type=int, default=500)
+    parser.add_argument("--max-delay-ms", type=int, default=5)
+    args = parser.parse_args()
+
+    anyio.run(main, args.inserts, args.concurrency, args.max_docs, args.max_delay_ms)
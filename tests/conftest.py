@@ -0,0 +1,66 @@
+import os
+import tempfile
+from typing import Iterator
+from uuid import uuid4
+
+import pytest
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+
+def service_account_key() -> str:
+    """
+    Generate a throwaway key for the Firebase app, which is never called.
+    """
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    return key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption(),
+    ).decode()
+
+
+# Settings are read when the app is first imported.
+os.environ.update(
+    STORAGE_BACKEND="memory",
+    SQLITE_PATH=os.path.join(tempfile.mkdtemp(), "budget.db"),
+    MONGO_URI="mongodb://localhost:27017",
+    STATIC_TOKEN="test",
+    GOOGLE_PROJECT="test",
+    GOOGLE_AUTH_PK=service_account_key(),
+    GOOGLE_AUTH_CLIENT_EMAIL="test@example.com",
+    GOOGLE_AUTH_TOKEN_URI="https://oauth2.googleapis.com/token",
+    GOOGLE_AUTH_SIGN_IN_KEY="test",
+)
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+from app.auth import validate_access  # noqa: E402
+from app.main import app  # noqa: E402
+
+HEADERS = {"Authorization": "Bearer test"}
+
+
+@pytest.fixture
+def anyio_backend() -> str:
+    return "asyncio"
+
+
+@pytest.fixture
+def user_id() -> str:
+    """
+    A new user for each test, as the memory backend keeps data for the whole
+    process.
+    """
+    return f"user-{uuid4().hex}"
+
+
+@pytest.fixture
+def client(user_id: str) -> Iterator[TestClient]:
+    """
+    A client for the app running as `user_id`, with its lifespan.
+    """
+    app.dependency_overrides[validate_access] = lambda: user_id
+    with TestClient(app, headers=HEADERS) as client:
+        yield client
+    app.dependency_overrides.clear()
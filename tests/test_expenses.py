@@ -0,0 +1,87 @@
+import pytest
+from fastapi.testclient import TestClient
+
+from app.auth import validate_access
+from app.main import app
+
+EXPENSE = {"total": 12.5, "category": "food", "place": "Bakery"}
+
+
+def test_create_get_update_delete(client: TestClient, user_id: str) -> None:
+    created = client.post("/v1/expenses", json=EXPENSE)
+    assert created.status_code == 200
+    expense_id = created.json()["id"]
+
+    expense = client.get(f"/v1/expenses/{expense_id}").json()
+    assert expense["user_id"] == user_id
+    assert expense["place"] == "Bakery"
+
+    updated = client.patch(f"/v1/expenses/{expense_id}", json={"total": 20})
+    assert updated.status_code == 200
+    assert client.get(f"/v1/expenses/{expense_id}").json()["total"] == 20
+
+    assert client.delete(f"/v1/expenses/{expense_id}").json() == {"success": True}
+    assert client.get(f"/v1/expenses/{expense_id}").status_code == 404
+
+
+def test_other_users_expenses_are_hidden(client: TestClient) -> None:
+    expense_id = client.post("/v1/expenses", json=EXPENSE).json()["id"]
+
+    app.dependency_overrides[validate_access] = lambda: "someone-else"
+    assert client.get(f"/v1/expenses/{expense_id}").status_code == 404
+    assert client.get("/v1/expenses").json() == []
+
+
+@pytest.mark.parametrize(
+    "query",
+    [
+        # Naive and aware bounds together.
+        "start=2020-01-01T00:00:00&end=2100-01-01T00:00:00Z",
+        "start=2020-01-01T00:00:00%2B05:00&end=2100-01-01",
+        "start=2020-01-01T00:00:00%2B05:00",
+        "end=2100-01-01T00:00:00-08:00",
+    ],
+)
+def test_filters_mix_offsets(client: TestClient, query: str) -> None:
+    client.post("/v1/expenses", json=EXPENSE)
+
+    response = client.get(f"/v1/expenses?{query}")
+    assert response.status_code == 200
+    assert len(response.json()) == 1
+
+
+def test_filters_compare_offsets_in_utc(client: TestClient) -> None:
+    # 2024-02-29T04:00+05:00 is still 2024-02-28 in UTC, so before the end.
+    ok = client.get("/v1/expenses?start=2024-02-29T04:00:00%2B05:00&end=2024-02-29")
+    assert ok.status_code == 200
+
+    reversed = client.get(
+        "/v1/expenses?start=2024-03-01T00:00:00%2B05:00&end=2024-02-28"
+    )
+    assert reversed.status_code == 422
+
+
+def test_idempotent_create(client: TestClient) -> None:
+    headers = {"Idempotency-Key": "create-1"}
+
+    first = client.post("/v1/expenses", json=EXPENSE, headers=headers)
+    replay = client.post("/v1/expenses", json=EXPENSE, headers=headers)
+    assert replay.json() == first.json()
+    assert len(client.get("/v1/expenses").json()) == 1
+
+    changed = client.post("/v1/expenses", json={**EXPENSE, "total": 1}, headers=headers)
+    assert changed.status_code == 422
+
+
+def test_idempotency_fingerprint_includes_ledger(client: TestClient) -> None:
+    ledger_id = client.post("/v1/ledgers", json={"name": "Home"}).json()["id"]
+    headers = {"Idempotency-Key": "create-2"}
+
+    first = client.post("/v1/expenses", json=EXPENSE, headers=headers)
+    other_ledger = client.post(
+        f"/v1/expenses?ledger_id={ledger_id}", json=EXPENSE, headers=headers
+    )
+    assert other_ledger.status_code == 422
+    assert client.post("/v1/expenses", json=EXPENSE, headers=headers).json() == (
+        first.json()
+    )
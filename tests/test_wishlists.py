@@ -0,0 +1,38 @@
+from fastapi.testclient import TestClient
+
+WISHLIST = {"total": 100, "name": "Bike", "category": "sport"}
+
+
+def test_contributions_add_up(client: TestClient) -> None:
+    wishlist_id = client.post("/v1/wishlists", json=WISHLIST).json()["id"]
+
+    for amount in (10, 15):
+        response = client.post(
+            f"/v1/wishlists/{wishlist_id}/contributions", json={"amount": amount}
+        )
+        assert response.status_code == 200
+
+    assert client.get(f"/v1/wishlists/{wishlist_id}").json()["saved"] == 25
+    contributions = client.get(f"/v1/wishlists/{wishlist_id}/contributions").json()
+    assert len(contributions) == 2
+
+
+def test_contribution_keys_are_scoped_to_their_wishlist(client: TestClient) -> None:
+    first = client.post("/v1/wishlists", json=WISHLIST).json()["id"]
+    second = client.post("/v1/wishlists", json=WISHLIST).json()["id"]
+    headers = {"Idempotency-Key": "same-key"}
+
+    for wishlist_id in (first, second):
+        response = client.post(
+            f"/v1/wishlists/{wishlist_id}/contributions",
+            json={"amount": 10},
+            headers=headers,
+        ).json()
+        assert response["id"] == wishlist_id
+        assert response["saved"] == 10
+
+    replay = client.post(
+        f"/v1/wishlists/{second}/contributions", json={"amount": 10}, headers=headers
+    ).json()
+    assert replay["saved"] == 10
+    assert len(client.get(f"/v1/wishlists/{second}/contributions").json()) == 1